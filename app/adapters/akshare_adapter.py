@@ -3,23 +3,24 @@
 akshare适配器 - 老王说：内部多数据源自动切换！
 东财挂了切同花顺，同花顺挂了切新浪，新浪挂了切腾讯...
 """
-import akshare as ak
+import os
+from ..core.akshare_client import ak, upstream_of
+from ..core.bar_schema import empty_bars, normalize_bars, volume_to_shares
+from ..core.metrics import get_metrics
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
-from .base_adapter import BaseAdapter
+from .base_adapter import BaseAdapter, UpstreamError
+from ..core.rate_limiter import get_rate_limiter
+from ..core.spot_snapshot import SpotSnapshot
 
 
 class AkshareAdapter(BaseAdapter):
     """akshare数据源适配器，支持内部多数据源冗余"""
 
-    # 字段映射：统一不同数据源的返回格式
-    FIELD_MAPPING = {
-        'stock_zh_a_hist': {
-            '日期': 'date', '开盘': 'open', '收盘': 'close',
-            '最高': 'high', '最低': 'low', '成交量': 'volume', '成交额': 'amount'
-        },
-        'stock_zh_a_hist_tx': {},  # 腾讯接口字段已是英文
-    }
+    def __init__(self):
+        # 全市场行情快照，板块列表/名称/最新价共用一份
+        self.spot = SpotSnapshot(ak.stock_zh_a_spot_em)
 
     @property
     def name(self) -> str:
@@ -31,90 +32,141 @@ class AkshareAdapter(BaseAdapter):
         prefix = 'sh' if code.startswith('6') else 'sz'
         return f"{prefix}{code}"
 
+    def _record_path(self, method: str, func_name: Optional[str] = None):
+        """记录内部兜底最后是哪个接口给的数据（都失败记为 none）"""
+        path = f"{upstream_of(func_name)}:{func_name}" if func_name else 'none'
+        get_metrics().record_path(f"adapter:{self.name}", method, path)
+
     def get_stock_history(self, code: str, start_date: str, end_date: str,
                           adjust: str = "qfq") -> pd.DataFrame:
-        """获取股票历史K线 - 东财挂了自动切腾讯"""
+        """获取股票历史K线 - 东财挂了自动切腾讯，返回标准格式K线（见 bar_schema.py，成交量为股）"""
         code = code.replace('.SH', '').replace('.SZ', '').replace('sh', '').replace('sz', '')
+        source = f"adapter:{self.name}"
 
-        # 尝试东财接口
+        errors = []
+        # 尝试东财接口（中文列名在标准化时统一改掉，成交量单位是手）
         try:
             df = ak.stock_zh_a_hist(symbol=code, start_date=start_date,
                                     end_date=end_date, adjust=adjust)
-            if df is not None and not df.empty:
-                df = df.rename(columns=self.FIELD_MAPPING['stock_zh_a_hist'])
-                return df
-        except Exception:
-            pass
-
-        # 东财挂了，切腾讯
+            bars, _ = normalize_bars(df, source)
+            if bars is not None and not bars.empty:
+                self._record_path('get_stock_history', 'stock_zh_a_hist')
+                return self._tag(volume_to_shares(bars, lots=True, source=source), 'stock_zh_a_hist')
+        except Exception as e:
+            errors.append(e)
+
+        # 东财挂了或者数据不能用，切腾讯
         try:
             tx_code = self._format_code_for_tx(code)
             df = ak.stock_zh_a_hist_tx(symbol=tx_code, start_date=start_date,
                                        end_date=end_date, adjust=adjust)
-            if df is not None and not df.empty:
-                return df
-        except Exception:
-            pass
-
-        return pd.DataFrame()
+            bars, _ = normalize_bars(df, source)
+            if bars is not None and not bars.empty:
+                self._record_path('get_stock_history', 'stock_zh_a_hist_tx')
+                # akshare 已把腾讯的手换算成股，但把 sz000 开头的当成指数漏掉了
+                lots = tx_code.startswith('sz000')
+                return self._tag(volume_to_shares(bars, lots=lots, source=source), 'stock_zh_a_hist_tx')
+        except Exception as e:
+            errors.append(e)
+
+        return self._empty_or_raise('get_stock_history', errors, 2, empty_bars())
+
+    def _empty_or_raise(self, method: str, errors: List[Exception], attempts: int, empty):
+        """内部接口都没给出数据时的收尾：每条路都抛了异常说明上游挂了，向上抛让熔断器记成失败；
+        有一条路正常返回了（只是没数据），才算真的没数据"""
+        self._record_path(method)
+        if errors and len(errors) >= attempts:
+            raise UpstreamError(f"{method} 内部接口全部失败: "
+                                + '; '.join(f"{type(e).__name__}: {e}" for e in errors))
+        return empty
+
+    def _tag(self, bars: pd.DataFrame, func_name: str) -> pd.DataFrame:
+        """在K线上记下是哪个接口给的（本地K线仓库写进元数据）"""
+        bars.attrs['source'] = f"{self.name}:{func_name}"
+        return bars
+
+    def get_stock_history_many(self, codes: List[str], start_date: str, end_date: str,
+                               adjust: str = "qfq") -> Dict[str, pd.DataFrame]:
+        """批量获取K线 - HTTP接口没有批量查询，用有上限的线程池并发拉（HISTORY_BATCH_WORKERS）"""
+        def fetch(code):
+            get_rate_limiter().acquire(self.name)
+            try:
+                return code, self.get_stock_history(code, start_date, end_date, adjust), None
+            except Exception as e:
+                return code, None, e
+
+        workers = max(1, min(len(codes), int(os.getenv('HISTORY_BATCH_WORKERS', '4'))))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='akshare-history') as executor:
+            results = list(executor.map(fetch, codes))
+        errors = [e for _, _, e in results if e is not None]
+        if codes and len(errors) == len(codes):
+            raise UpstreamError(f"批量获取K线全部失败: {errors[-1]}")
+        return {code: df for code, df, _ in results if df is not None and not df.empty}
 
     def get_index_stocks(self, index_code: str) -> List[str]:
         """获取指数成分股"""
+        errors = []
         try:
             df = ak.index_stock_cons_weight_csindex(symbol=index_code)
             if df is not None and not df.empty:
                 col = '成分券代码' if '成分券代码' in df.columns else df.columns[0]
                 return df[col].tolist()
-        except Exception:
-            pass
-        return []
+        except Exception as e:
+            errors.append(e)
+        return self._empty_or_raise('get_index_stocks', errors, 1, [])
 
     def get_stock_info(self, code: str) -> Dict:
         """获取股票基本信息 - 东财→雪球"""
         code = code.replace('.SH', '').replace('.SZ', '').replace('sh', '').replace('sz', '')
 
+        errors = []
         # 东财
         try:
             df = ak.stock_individual_info_em(symbol=code)
             if df is not None and not df.empty:
+                self._record_path('get_stock_info', 'stock_individual_info_em')
                 return dict(zip(df['item'], df['value']))
-        except Exception:
-            pass
+        except Exception as e:
+            errors.append(e)
 
         # 雪球
         try:
             df = ak.stock_individual_basic_info_xq(symbol=code)
             if df is not None and not df.empty:
-                return df.to_dict('records')[0] if len(df) > 0 else {}
-        except Exception:
-            pass
+                self._record_path('get_stock_info', 'stock_individual_basic_info_xq')
+                return df.to_dict('records')[0]
+        except Exception as e:
+            errors.append(e)
 
-        return {}
+        return self._empty_or_raise('get_stock_info', errors, 2, {})
 
     def get_financial_data(self, code: str) -> Dict:
         """获取财务数据 - 东财→同花顺"""
         code = code.replace('.SH', '').replace('.SZ', '').replace('sh', '').replace('sz', '')
 
+        errors = []
         # 东财财务分析指标
         try:
             df = ak.stock_financial_analysis_indicator(symbol=code, start_year="2023")
             if df is not None and not df.empty:
+                self._record_path('get_financial_data', 'stock_financial_analysis_indicator')
                 return {'indicator': df.to_dict('records')}
-        except Exception:
-            pass
+        except Exception as e:
+            errors.append(e)
 
         # 同花顺财务摘要
         try:
             df = ak.stock_financial_abstract_ths(symbol=code)
             if df is not None and not df.empty:
+                self._record_path('get_financial_data', 'stock_financial_abstract_ths')
                 return {'abstract': df.to_dict('records')}
-        except Exception:
-            pass
+        except Exception as e:
+            errors.append(e)
 
-        return {}
+        return self._empty_or_raise('get_financial_data', errors, 2, {})
 
     def get_board_stocks(self, board: str) -> List[str]:
-        """获取板块股票列表"""
+        """获取板块股票列表 - 优先从全市场快照里按代码前缀筛"""
         board_map = {
             'all': 'stock_zh_a_spot_em',
             'sh': 'stock_sh_a_spot_em',
@@ -127,57 +179,82 @@ class AkshareAdapter(BaseAdapter):
         if not func_name:
             return []
 
+        codes = self.spot.get_board_codes(board)
+        if codes:
+            self._record_path('get_board_stocks', 'stock_zh_a_spot_em')
+            return codes
+
+        errors = []
+        # 快照拉不到，退回分板块接口
         try:
             func = getattr(ak, func_name)
             df = func()
             if df is not None and not df.empty:
                 col = '代码' if '代码' in df.columns else df.columns[0]
+                self._record_path('get_board_stocks', func_name)
                 return df[col].tolist()
-        except Exception:
-            pass
-        return []
+        except Exception as e:
+            errors.append(e)
+        return self._empty_or_raise('get_board_stocks', errors, 1, [])
+
+    def get_spot_quote(self, code: str) -> Dict:
+        """获取单只股票实时行情（来自全市场快照）"""
+        return self.spot.get_quote(code)
+
+    def get_stock_name(self, code: str) -> Optional[str]:
+        """按代码查股票名称（来自全市场快照）"""
+        return self.spot.get_name(code)
+
+    def get_latest_price(self, code: str) -> Optional[float]:
+        """按代码查最新价（来自全市场快照）"""
+        return self.spot.get_price(code)
 
     def get_industry_list(self) -> pd.DataFrame:
         """获取行业板块列表 - 东财→同花顺"""
+        errors = []
         # 东财
         try:
             df = ak.stock_board_industry_name_em()
             if df is not None and not df.empty:
+                self._record_path('get_industry_list', 'stock_board_industry_name_em')
                 return df
-        except Exception:
-            pass
+        except Exception as e:
+            errors.append(e)
 
         # 同花顺
         try:
             df = ak.stock_board_industry_summary_ths()
             if df is not None and not df.empty:
+                self._record_path('get_industry_list', 'stock_board_industry_summary_ths')
                 return df
-        except Exception:
-            pass
+        except Exception as e:
+            errors.append(e)
 
-        return pd.DataFrame()
+        return self._empty_or_raise('get_industry_list', errors, 2, pd.DataFrame())
 
     def get_industry_stocks(self, industry: str) -> List[str]:
         """获取行业成分股"""
+        errors = []
         try:
             df = ak.stock_board_industry_cons_em(symbol=industry)
             if df is not None and not df.empty:
                 col = '代码' if '代码' in df.columns else df.columns[0]
                 return df[col].tolist()
-        except Exception:
-            pass
-        return []
+        except Exception as e:
+            errors.append(e)
+        return self._empty_or_raise('get_industry_stocks', errors, 1, [])
 
     def get_concept_stocks(self, concept: str) -> List[str]:
         """获取概念板块成分股代码列表"""
+        errors = []
         # 先尝试概念板块
         try:
             df = ak.stock_board_concept_cons_em(symbol=concept)
             if df is not None and not df.empty:
                 col = '代码' if '代码' in df.columns else df.columns[0]
                 return df[col].tolist()
-        except Exception:
-            pass
+        except Exception as e:
+            errors.append(e)
 
         # 概念失败，尝试行业板块
         try:
@@ -185,30 +262,31 @@ class AkshareAdapter(BaseAdapter):
             if df is not None and not df.empty:
                 col = '代码' if '代码' in df.columns else df.columns[0]
                 return df[col].tolist()
-        except Exception:
-            pass
+        except Exception as e:
+            errors.append(e)
 
-        return []
+        return self._empty_or_raise('get_concept_stocks', errors, 2, [])
 
     def get_concept_stocks_detail(self, concept: str) -> List[Dict]:
         """获取概念板块成分股详细信息（含名称、价格等）"""
+        errors = []
         # 先尝试概念板块
         try:
             df = ak.stock_board_concept_cons_em(symbol=concept)
             if df is not None and not df.empty:
                 return self._parse_board_stocks_df(df)
-        except Exception:
-            pass
+        except Exception as e:
+            errors.append(e)
 
         # 概念失败，尝试行业板块
         try:
             df = ak.stock_board_industry_cons_em(symbol=concept)
             if df is not None and not df.empty:
                 return self._parse_board_stocks_df(df)
-        except Exception:
-            pass
+        except Exception as e:
+            errors.append(e)
 
-        return []
+        return self._empty_or_raise('get_concept_stocks_detail', errors, 2, [])
 
     def _parse_board_stocks_df(self, df) -> List[Dict]:
         """解析板块成分股DataFrame为字典列表"""
@@ -233,26 +311,37 @@ class AkshareAdapter(BaseAdapter):
 
     def get_capital_flow(self, code: str) -> Dict:
         """获取资金流向"""
+        errors = []
         try:
             df = ak.stock_individual_fund_flow(stock=code, market="sh" if code.startswith('6') else "sz")
             if df is not None and not df.empty:
                 return {'flow': df.to_dict('records')}
-        except Exception:
-            pass
-        return {}
+        except Exception as e:
+            errors.append(e)
+        return self._empty_or_raise('get_capital_flow', errors, 1, {})
 
     def get_north_flow(self) -> pd.DataFrame:
         """获取北向资金"""
         try:
             df = ak.stock_hsgt_hist_em(symbol="沪股通")
-            return df if df is not None else pd.DataFrame()
-        except Exception:
-            return pd.DataFrame()
+        except Exception as e:
+            return self._empty_or_raise('get_north_flow', [e], 1, pd.DataFrame())
+        return df if df is not None else pd.DataFrame()
+
+    def get_trade_dates(self) -> List[str]:
+        """获取交易日列表 - 新浪"""
+        errors = []
+        try:
+            df = ak.tool_trade_date_hist_sina()
+            if df is not None and not df.empty:
+                return pd.to_datetime(df['trade_date']).dt.strftime('%Y-%m-%d').tolist()
+        except Exception as e:
+            errors.append(e)
+        return self._empty_or_raise('get_trade_dates', errors, 1, [])
 
     def health_check(self) -> bool:
-        """健康检查"""
+        """健康检查 - 快照未过期就不再重复下载"""
         try:
-            df = ak.stock_zh_a_spot_em()
-            return df is not None and len(df) > 0
+            return self.spot.refresh() and self.spot.age() < self.spot.ttl
         except Exception:
             return False
@@ -2,31 +2,32 @@
 """
 baostock数据源适配器 - 老王说：akshare全挂了就靠你了！
 注意：baostock数据是T+1的，没有实时数据
+所有查询经 BaostockSession 会话线程执行，扫描、指数分析的多个线程同时故障转移过来也不会互相串包
 """
-import baostock as bs
 import pandas as pd
+from concurrent.futures import Future
+from datetime import datetime
 from typing import List, Dict
-from .base_adapter import BaseAdapter
+from .base_adapter import BaseAdapter, UpstreamError
+from .baostock_session import BaostockResult, get_baostock_session
+from ..core.bar_schema import empty_bars, normalize_bars
+from ..core.rate_limiter import get_rate_limiter
 
 
 class BaostockAdapter(BaseAdapter):
     """baostock数据源适配器"""
 
+    # 复权标志：1后复权 2前复权 3不复权
+    ADJUST_MAP = {'hfq': '1', 'qfq': '2', '': '3'}
+
     def __init__(self):
-        self._logged_in = False
+        # baostock 的全局 socket 不能多线程共用，所有查询都交给会话线程排队执行
+        self.session = get_baostock_session()
 
     @property
     def name(self) -> str:
         return "baostock"
 
-    def _ensure_login(self):
-        """确保已登录"""
-        if not self._logged_in:
-            lg = bs.login()
-            if lg.error_code != '0':
-                raise Exception(f"baostock登录失败: {lg.error_msg}")
-            self._logged_in = True
-
     def _convert_code(self, code: str) -> str:
         """转换股票代码格式：000001 -> sh.000001 或 sz.000001"""
         code = code.replace('.SH', '').replace('.SZ', '').replace('sh.', '').replace('sz.', '')
@@ -40,59 +41,74 @@ class BaostockAdapter(BaseAdapter):
             return f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}"
         return date_str
 
-    def get_stock_history(self, code: str, start_date: str, end_date: str,
-                          adjust: str = "qfq") -> pd.DataFrame:
-        """获取股票历史K线"""
-        self._ensure_login()
-        bs_code = self._convert_code(code)
-        start_date = self._format_date(start_date)
-        end_date = self._format_date(end_date)
-
-        # 复权标志：1后复权 2前复权 3不复权
-        adjust_map = {'hfq': '1', 'qfq': '2', '': '3'}
-        adjustflag = adjust_map.get(adjust, '2')
-
-        rs = bs.query_history_k_data_plus(
-            bs_code,
+    def _submit_history(self, code: str, start_date: str, end_date: str, adjust: str) -> Future:
+        """提交一只股票的日K查询"""
+        return self.session.submit(
+            'query_history_k_data_plus',
+            self._convert_code(code),
             "date,open,high,low,close,volume,amount",
-            start_date=start_date,
-            end_date=end_date,
+            start_date=self._format_date(start_date),
+            end_date=self._format_date(end_date),
             frequency="d",
-            adjustflag=adjustflag
+            adjustflag=self.ADJUST_MAP.get(adjust, '2')
         )
 
-        data_list = []
-        while rs.error_code == '0' and rs.next():
-            data_list.append(rs.get_row_data())
+    @staticmethod
+    def _check(result: BaostockResult, method: str) -> BaostockResult:
+        """查询报错（不是正常返回了空数据）时抛 UpstreamError，让熔断器记成失败"""
+        if not result.ok:
+            raise UpstreamError(f"baostock {method} 失败: {result.error_code} {result.error_msg}")
+        return result
 
-        if not data_list:
-            return pd.DataFrame()
+    def _history_frame(self, result: BaostockResult) -> pd.DataFrame:
+        """查询结果（全是字符串）转成标准格式K线，baostock 的成交量本来就是股"""
+        self._check(result, 'query_history_k_data_plus')
+        bars, _ = normalize_bars(result.to_frame(), f"adapter:{self.name}")
+        if bars is None:
+            return empty_bars()
+        bars.attrs['source'] = f"{self.name}:query_history_k_data_plus"
+        return bars
 
-        df = pd.DataFrame(data_list, columns=rs.fields)
-        for col in ['open', 'high', 'low', 'close', 'volume', 'amount']:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        df['date'] = pd.to_datetime(df['date'])
-        return df
+    def get_stock_history(self, code: str, start_date: str, end_date: str,
+                          adjust: str = "qfq") -> pd.DataFrame:
+        """获取股票历史K线"""
+        return self._history_frame(self.session.wait(self._submit_history(code, start_date, end_date, adjust)))
+
+    def get_stock_history_many(self, codes: List[str], start_date: str, end_date: str,
+                               adjust: str = "qfq") -> Dict[str, pd.DataFrame]:
+        """批量获取K线 - 一次把查询都排进会话线程，在同一个会话里连续执行，不用一只只等"""
+        futures = {}
+        for code in codes:
+            get_rate_limiter().acquire(self.name)
+            futures[code] = self._submit_history(code, start_date, end_date, adjust)
+
+        frames, errors = {}, []
+        for code, future in futures.items():
+            try:
+                df = self._history_frame(self.session.wait(future))
+            except Exception as e:
+                errors.append(e)
+                continue
+            if not df.empty:
+                frames[code] = df
+        if futures and len(errors) == len(futures):
+            raise UpstreamError(f"批量获取K线全部失败: {errors[-1]}")
+        return frames
 
     def get_index_stocks(self, index_code: str) -> List[str]:
         """获取指数成分股"""
-        self._ensure_login()
-
         index_map = {
-            '000300': bs.query_hs300_stocks,
-            '000905': bs.query_zz500_stocks,
-            '000016': bs.query_sz50_stocks,
+            '000300': 'query_hs300_stocks',
+            '000905': 'query_zz500_stocks',
+            '000016': 'query_sz50_stocks',
         }
 
-        query_func = index_map.get(index_code)
-        if not query_func:
+        method = index_map.get(index_code)
+        if not method:
             return []
 
-        rs = query_func()
         stocks = []
-        while rs.error_code == '0' and rs.next():
-            row = rs.get_row_data()
+        for row in self.session.query(method).rows:
             code = row[1].replace('sh.', '').replace('sz.', '') if len(row) > 1 else ''
             if code:
                 stocks.append(code)
@@ -100,50 +116,47 @@ class BaostockAdapter(BaseAdapter):
 
     def get_stock_info(self, code: str) -> Dict:
         """获取股票基本信息"""
-        self._ensure_login()
-        bs_code = self._convert_code(code)
-
-        rs = bs.query_stock_basic(code=bs_code)
-        if rs.error_code == '0' and rs.next():
-            return dict(zip(rs.fields, rs.get_row_data()))
+        result = self._check(self.session.query('query_stock_basic', code=self._convert_code(code)),
+                             'query_stock_basic')
+        if result.rows:
+            return dict(zip(result.fields, result.rows[0]))
         return {}
 
     def get_financial_data(self, code: str) -> Dict:
         """获取财务数据"""
-        self._ensure_login()
         bs_code = self._convert_code(code)
         result = {}
 
-        # 盈利能力
-        try:
-            rs = bs.query_profit_data(code=bs_code, year=2024, quarter=3)
-            if rs.error_code == '0' and rs.next():
-                result['profit'] = dict(zip(rs.fields, rs.get_row_data()))
-        except Exception:
-            pass
+        # 盈利能力、成长能力两个查询一起排队
+        futures = {
+            'profit': self.session.submit('query_profit_data', code=bs_code, year=2024, quarter=3),
+            'growth': self.session.submit('query_growth_data', code=bs_code, year=2024, quarter=3),
+        }
+        errors = []
+        for key, future in futures.items():
+            try:
+                rs = self._check(self.session.wait(future), f"query_{key}_data")
+                if rs.rows:
+                    result[key] = dict(zip(rs.fields, rs.rows[0]))
+            except Exception as e:
+                errors.append(e)
+
+        if len(errors) == len(futures):
+            raise UpstreamError(f"baostock 财务数据查询全部失败: {errors[-1]}")
+        return result
 
-        # 成长能力
-        try:
-            rs = bs.query_growth_data(code=bs_code, year=2024, quarter=3)
-            if rs.error_code == '0' and rs.next():
-                result['growth'] = dict(zip(rs.fields, rs.get_row_data()))
-        except Exception:
-            pass
+    def get_trade_dates(self) -> List[str]:
+        """获取交易日列表（到今年年底）"""
+        end_date = f"{datetime.now().year}-12-31"
+        result = self._check(self.session.query('query_trade_dates', start_date="2000-01-01", end_date=end_date),
+                             'query_trade_dates')
 
-        return result
+        # 字段: calendar_date, is_trading_day
+        return [row[0] for row in result.rows if len(row) > 1 and row[1] == '1']
 
     def health_check(self) -> bool:
         """健康检查"""
         try:
-            self._ensure_login()
-            rs = bs.query_trade_dates(start_date="2024-01-01", end_date="2024-01-02")
-            return rs.error_code == '0'
+            return self.session.query('query_trade_dates', start_date="2024-01-01", end_date="2024-01-02").ok
         except Exception:
             return False
-
-    def __del__(self):
-        if self._logged_in:
-            try:
-                bs.logout()
-            except Exception:
-                pass
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+baostock会话线程 - 老王说：baostock 整个模块就一个全局 socket，几个线程同时查，回包串了你都不知道！
+所有 baostock 调用都排队交给一个专门的线程执行，这个线程独占登录会话：
+    submit() 立即返回 Future，调用方可以一次提交一批查询再统一等结果，队列里的查询在同一个会话里连续执行
+    分页数据（rs.next() 会继续走 socket）也在这个线程里读完，调用方拿到的是完整的行
+    会话掉线（未登录/网络错误）自动重新登录，重试一次
+    每个查询的排队时间、执行耗时和结果记到指标里（来源 baostock:session）
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import List, Optional
+
+import baostock as bs
+import pandas as pd
+
+from ..core.metrics import OUTCOME_EMPTY, OUTCOME_ERROR, OUTCOME_SUCCESS, get_metrics
+
+logger = logging.getLogger(__name__)
+
+# 会话失效，需要重新登录的错误码：未登录，以及 10002xxx 的各种网络错误
+NOT_LOGGED_IN = '10001001'
+NETWORK_ERROR_PREFIX = '10002'
+SOCKET_ERROR = '10002001'
+
+# 指标里的来源名
+METRICS_SOURCE = 'baostock:session'
+
+
+class BaostockResult:
+    """一次查询的完整结果（已经读完所有分页）"""
+
+    def __init__(self, error_code: str, error_msg: str, fields: List[str], rows: List[List[str]]):
+        self.error_code = error_code
+        self.error_msg = error_msg
+        self.fields = fields
+        self.rows = rows
+
+    @property
+    def ok(self) -> bool:
+        return self.error_code == '0'
+
+    def to_frame(self) -> pd.DataFrame:
+        """转成 DataFrame，没有数据时返回空表"""
+        if not self.rows:
+            return pd.DataFrame()
+        return pd.DataFrame(self.rows, columns=self.fields)
+
+
+def _needs_relogin(error_code: str) -> bool:
+    return error_code == NOT_LOGGED_IN or error_code.startswith(NETWORK_ERROR_PREFIX)
+
+
+class BaostockSession:
+    """独占 baostock 登录会话的工作线程，对外提供基于 Future 的查询接口"""
+
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        Args:
+            timeout: query() 等待结果的秒数，默认读 BAOSTOCK_QUERY_TIMEOUT
+        """
+        self.timeout = timeout or float(os.getenv('BAOSTOCK_QUERY_TIMEOUT', '60'))
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._logged_in = False
+        self._stats = {'queries': 0, 'errors': 0, 'logins': 0, 'relogins': 0}
+
+    # ========== 对外接口 ==========
+
+    def submit(self, method: str, *args, **kwargs) -> Future:
+        """排队执行 bs.<method>(*args, **kwargs)，Future 的结果是 BaostockResult"""
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((method, args, kwargs, future, time.monotonic()))
+        return future
+
+    def query(self, method: str, *args, **kwargs) -> BaostockResult:
+        """同步查询：提交后等结果，超时抛 TimeoutError"""
+        return self.wait(self.submit(method, *args, **kwargs))
+
+    def wait(self, future: Future) -> BaostockResult:
+        """等 submit() 返回的 Future，超时抛 TimeoutError"""
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # 还没轮到的就别查了
+            future.cancel()
+            raise
+
+    def close(self):
+        """登出并停止会话线程，队列里剩下的查询照常执行完"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread = None
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(logged_in=self._logged_in, queued=self._queue.qsize())
+        return stats
+
+    # ========== 会话线程 ==========
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='baostock-session')
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._logout()
+                return
+            method, args, kwargs, future, submitted_at = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            # 在队列里等会话线程的时间
+            get_metrics().observe_queue(METRICS_SOURCE, method, time.monotonic() - submitted_at)
+            try:
+                future.set_result(self._execute(method, args, kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _login(self):
+        if self._logged_in:
+            return
+        lg = bs.login()
+        if lg.error_code != '0':
+            raise Exception(f"baostock登录失败: {lg.error_msg}")
+        self._logged_in = True
+        self._count('logins')
+
+    def _logout(self):
+        if not self._logged_in:
+            return
+        try:
+            bs.logout()
+        except Exception:
+            pass
+        self._logged_in = False
+
+    def _execute(self, method: str, args: tuple, kwargs: dict) -> BaostockResult:
+        """在当前会话里执行查询并读完所有分页；会话掉线时重新登录再试一次"""
+        start = time.monotonic()
+        for attempt in range(2):
+            self._login()
+            try:
+                rs = getattr(bs, method)(*args, **kwargs)
+                rows = []
+                while rs.error_code == '0' and rs.next():
+                    rows.append(rs.get_row_data())
+                result = BaostockResult(rs.error_code, rs.error_msg, rs.fields or [], rows)
+            except (OSError, EOFError) as e:
+                # socket 层直接抛出来的错误，也当作会话掉线
+                result = BaostockResult(SOCKET_ERROR, str(e), [], [])
+
+            if attempt == 0 and _needs_relogin(result.error_code):
+                logger.info(f"baostock会话失效({result.error_code} {result.error_msg})，重新登录")
+                self._logged_in = False
+                self._count('relogins')
+                continue
+            break
+
+        self._count('queries')
+        if not result.ok:
+            self._count('errors')
+        get_metrics().observe(METRICS_SOURCE, method, time.monotonic() - start,
+                              OUTCOME_ERROR if not result.ok else OUTCOME_SUCCESS if result.rows else OUTCOME_EMPTY,
+                              rows=len(result.rows))
+        return result
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+
+# baostock 模块只有一个全局连接，整个进程也只能有一个会话线程
+_session: Optional[BaostockSession] = None
+_session_lock = threading.Lock()
+
+
+def get_baostock_session() -> BaostockSession:
+    """获取进程内唯一的 baostock 会话"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = BaostockSession()
+    return _session
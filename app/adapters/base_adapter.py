@@ -6,6 +6,12 @@ from abc import ABC, abstractmethod
 from typing import Optional, List, Dict
 import pandas as pd
 
+from ..core.rate_limiter import get_rate_limiter
+
+
+class UpstreamError(Exception):
+    """上游接口全部报错（不是正常返回了空数据），故障转移时计为失败"""
+
 
 class BaseAdapter(ABC):
     """数据源适配器基类"""
@@ -22,10 +28,35 @@ class BaseAdapter(ABC):
             adjust: 复权类型 qfq前复权/hfq后复权/空字符串不复权
 
         Returns:
-            DataFrame with columns: date, open, high, low, close, volume, amount
+            标准格式K线（bar_schema.normalize_bars）：date(datetime64[ns]), open, high, low, close, volume, amount(float64)，
+            按日期升序、日期不重复
         """
         pass
 
+    def get_stock_history_many(self, codes: List[str], start_date: str, end_date: str,
+                               adjust: str = "qfq") -> Dict[str, pd.DataFrame]:
+        """批量获取多只股票同一区间的K线
+
+        默认逐只调用 get_stock_history，数据源有更省的批量方式（一个会话连续查、并发拉）就重写它。
+        每只股票都按数据源限流；单只失败或没数据的不在结果里，由调用方决定要不要单独补。
+
+        Returns:
+            {股票代码: DataFrame}，列同 get_stock_history
+        """
+        frames, errors = {}, []
+        for code in codes:
+            get_rate_limiter().acquire(self.name)
+            try:
+                df = self.get_stock_history(code, start_date, end_date, adjust)
+            except Exception as e:
+                errors.append(e)
+                continue
+            if df is not None and not df.empty:
+                frames[code] = df
+        if codes and len(errors) == len(codes):
+            raise UpstreamError(f"批量获取K线全部失败: {errors[-1]}")
+        return frames
+
     @abstractmethod
     def get_index_stocks(self, index_code: str) -> List[str]:
         """获取指数成分股
@@ -48,6 +79,10 @@ class BaseAdapter(ABC):
         """获取财务数据"""
         pass
 
+    def get_trade_dates(self) -> List[str]:
+        """获取交易日列表（YYYY-MM-DD），不支持的数据源返回空列表"""
+        return []
+
     @abstractmethod
     def health_check(self) -> bool:
         """健康检查，返回数据源是否可用"""
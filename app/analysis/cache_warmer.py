@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+缓存预热 - 老王说：重启后第一个打开页面的用户等半天，那是我们没干活！
+每个交易日开盘前（CACHE_WARM_TIME）把常用股票池的K线、基本信息、资金流向先拉进缓存：
+    指数成分股（CACHE_WARM_INDEXES，默认沪深300/中证500/中证1000）
+    自选股（CACHE_WARM_WATCHLIST，逗号分隔的代码）
+    数据库里保存的投资组合（USE_DATABASE 开启时）
+开了本地K线仓库时先用 get_stock_history_many 批量把K线拉进仓库，再逐只预热其余数据。
+请求都经过限流（akshare 按上游站点分桶），多 worker 部署时用文件锁保证同一时间只有一个进程在预热。
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.core.trading_calendar import parse_time
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有fcntl，不做跨进程互斥
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAMES = {'000300': '沪深300', '000905': '中证500', '000852': '中证1000'}
+
+# 预热的数据项
+WARM_STEPS = ('history', 'info', 'capital_flow')
+
+
+class CacheWarmer:
+    """缓存预热任务"""
+
+    def __init__(self, analyzer, capital_flow_analyzer=None):
+        """
+        Args:
+            analyzer: StockAnalyzer，K线和基本信息走它的缓存
+            capital_flow_analyzer: CapitalFlowAnalyzer，资金流向走它的缓存，不传则不预热资金流向
+        """
+        self.analyzer = analyzer
+        self.capital_flow_analyzer = capital_flow_analyzer
+        self.data_provider = analyzer.data_provider
+        self.indexes = [c.strip() for c in os.getenv('CACHE_WARM_INDEXES', '000300,000905,000852').split(',') if c.strip()]
+        self.watchlist = [c.strip() for c in os.getenv('CACHE_WARM_WATCHLIST', '').split(',') if c.strip()]
+        self.warm_time = parse_time(os.getenv('CACHE_WARM_TIME', '08:30'))
+        self.max_workers = int(os.getenv('CACHE_WARM_WORKERS', '4'))
+        self.lock_path = Path(os.getenv('CACHE_WARM_LOCK', 'data/cache_warmer.lock'))
+
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._scheduler: Optional[threading.Thread] = None
+        self.status = {'state': 'idle'}
+
+    # ========== 股票池 ==========
+
+    def _portfolio_codes(self) -> List[str]:
+        from app.core.database import get_session, Portfolio, USE_DATABASE
+        if not USE_DATABASE:
+            return []
+        session = get_session()
+        try:
+            codes = []
+            for portfolio in session.query(Portfolio).all():
+                for item in portfolio.stocks or []:
+                    code = (item.get('stock_code') or item.get('code')) if isinstance(item, dict) else item
+                    if code:
+                        codes.append(str(code))
+            return codes
+        finally:
+            session.close()
+
+    def collect_universe(self) -> Dict[str, List[str]]:
+        """各股票池的代码，自选和组合排前面先预热"""
+        universes = {'watchlist': list(self.watchlist)}
+        try:
+            universes['portfolios'] = self._portfolio_codes()
+        except Exception as e:
+            logger.warning(f"读取投资组合失败，跳过: {e}")
+            universes['portfolios'] = []
+        for index_code in self.indexes:
+            try:
+                universes[INDEX_NAMES.get(index_code, index_code)] = [
+                    str(c) for c in self.data_provider.get_index_stocks(index_code)]
+            except Exception as e:
+                logger.warning(f"获取指数 {index_code} 成分股失败，跳过: {e}")
+        return universes
+
+    # ========== 预热 ==========
+
+    def _warm_one(self, stock_code: str) -> Dict[str, float]:
+        """预热单只股票，返回各项耗时；失败抛异常"""
+        timings = {}
+        start = time.time()
+        df = self.analyzer.get_stock_data(stock_code)
+        if df is None or df.empty:
+            raise ValueError("K线为空")
+        timings['history'] = time.time() - start
+
+        start = time.time()
+        self.analyzer.get_stock_info(stock_code)
+        timings['info'] = time.time() - start
+
+        if self.capital_flow_analyzer is not None:
+            # 资金流向直接调 akshare，限流由 akshare_client 按上游站点处理
+            start = time.time()
+            self.capital_flow_analyzer.get_individual_fund_flow(stock_code)
+            timings['capital_flow'] = time.time() - start
+        return timings
+
+    def _prefetch_history(self, codes: List[str]):
+        """批量把K线拉进本地仓库（区间同 get_stock_data 默认的一年），后面逐只预热时直接读仓库"""
+        if self.data_provider.bar_store is None:
+            return
+        start = time.time()
+        end_date = datetime.now()
+        try:
+            frames = self.data_provider.get_stock_history_many(
+                codes, (end_date - timedelta(days=365)).strftime('%Y%m%d'), end_date.strftime('%Y%m%d'))
+            logger.info(f"批量预取K线 {len(frames)}/{len(codes)} 只，耗时 {time.time() - start:.0f} 秒")
+        except Exception as e:
+            logger.warning(f"批量预取K线失败，逐只预热时再拉: {e}")
+        self._update(prefetch_elapsed=round(time.time() - start, 1))
+
+    def _update(self, **fields):
+        with self._lock:
+            self.status.update(fields)
+
+    def warm(self, codes: Optional[List[str]] = None):
+        """执行一次预热（阻塞），codes 不传则预热配置的全部股票池"""
+        started = time.time()
+        self._update(state='running', started_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                     finished_at=None, processed=0, failed=0, total=0, elapsed=0.0, error=None,
+                     prefetch_elapsed=None,
+                     timings={step: 0.0 for step in WARM_STEPS})
+        try:
+            if codes is None:
+                universes = self.collect_universe()
+                self._update(universes={name: len(c) for name, c in universes.items()})
+                codes = [code for universe in universes.values() for code in universe]
+            codes = list(dict.fromkeys(codes))
+            self._update(total=len(codes))
+            logger.info(f"开始缓存预热，共 {len(codes)} 只股票")
+            self._prefetch_history(codes)
+
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='cache-warm') as executor:
+                futures = {executor.submit(self._warm_one, code): code for code in codes}
+                for future in as_completed(futures):
+                    with self._lock:
+                        self.status['processed'] += 1
+                        try:
+                            for step, seconds in future.result().items():
+                                self.status['timings'][step] += seconds
+                        except Exception as e:
+                            self.status['failed'] += 1
+                            logger.debug(f"预热 {futures[future]} 失败: {e}")
+                        self.status['elapsed'] = round(time.time() - started, 1)
+
+            with self._lock:
+                succeeded = max(1, self.status['processed'] - self.status['failed'])
+                self.status['avg_timings'] = {step: round(total / succeeded, 3)
+                                              for step, total in self.status['timings'].items()}
+            self._update(state='completed')
+            logger.info(f"缓存预热完成，{len(codes)} 只，失败 {self.status['failed']} 只，"
+                        f"耗时 {time.time() - started:.0f} 秒")
+        except Exception as e:
+            logger.error(f"缓存预热出错: {e}")
+            self._update(state='failed', error=str(e))
+        finally:
+            self._update(finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                         elapsed=round(time.time() - started, 1))
+
+    def _warm_exclusive(self, codes: Optional[List[str]] = None):
+        """拿到跨进程文件锁才预热，其他 worker 正在预热就跳过；没有 fcntl 的平台直接预热"""
+        if fcntl is None:
+            self.warm(codes)
+            return
+        try:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, 'w') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    logger.info("其他进程正在预热缓存，本进程跳过")
+                    self._update(state='skipped', finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                    return
+                try:
+                    self.warm(codes)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except OSError as e:
+            logger.warning(f"预热锁文件不可用，直接预热: {e}")
+            self.warm(codes)
+
+    def trigger(self, codes: Optional[List[str]] = None) -> bool:
+        """后台启动一次预热，已在运行时返回 False"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self._warm_exclusive, args=(codes,), daemon=True)
+            self._thread.start()
+        return True
+
+    def get_status(self) -> Dict:
+        with self._lock:
+            status = dict(self.status)
+            if 'timings' in status:
+                status['timings'] = {step: round(seconds, 3) for step, seconds in status['timings'].items()}
+        status['next_run'] = self.next_run().strftime('%Y-%m-%d %H:%M:%S') if self._scheduler else None
+        return status
+
+    # ========== 定时 ==========
+
+    def next_run(self, now: Optional[datetime] = None) -> datetime:
+        """下一次预热时间：今天是交易日且还没到点就是今天，否则下一个交易日"""
+        now = now or datetime.now()
+        calendar = self.data_provider.calendar
+        if calendar.is_trading_day(now.date()) and now.time() < self.warm_time:
+            return datetime.combine(now.date(), self.warm_time)
+        return datetime.combine(calendar.next_trading_day(now.date()).date(), self.warm_time)
+
+    def start_scheduler(self):
+        """启动定时预热线程"""
+        if self._scheduler is not None:
+            return
+
+        def _run():
+            while True:
+                try:
+                    run_at = self.next_run()
+                    # 分段睡，交易日历更新或系统时间调整后能重新计算
+                    while datetime.now() < run_at:
+                        time.sleep(min(600.0, max(1.0, (run_at - datetime.now()).total_seconds())))
+                    self._warm_exclusive()
+                except Exception as e:
+                    logger.error(f"定时预热出错: {e}")
+                    time.sleep(60)
+
+        self._scheduler = threading.Thread(target=_run, daemon=True, name='cache-warm-scheduler')
+        self._scheduler.start()
+        logger.info(f"缓存预热定时任务已启动，下次预热: {self.next_run():%Y-%m-%d %H:%M}")
@@ -1,7 +1,7 @@
 # capital_flow_analyzer.py
 import logging
 import traceback
-import akshare as ak
+from app.core.akshare_client import ak
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -9,7 +9,9 @@ from datetime import datetime, timedelta
 
 class CapitalFlowAnalyzer:
     def __init__(self):
-        self.data_cache = {}
+        # 1小时过期的缓存命名空间
+        from app.core.cache import get_cache
+        self.data_cache = get_cache().namespace('capital_flow', ttl=3600, shared=True)
 
         # 设置日志记录
         logging.basicConfig(level=logging.INFO,
@@ -27,11 +29,10 @@ class CapitalFlowAnalyzer:
 
             # 检查缓存
             cache_key = f"concept_fund_flow_{period}"
-            if cache_key in self.data_cache:
-                cache_time, cached_data = self.data_cache[cache_key]
-                # 如果在最近一小时内有缓存数据，则返回缓存数据
-                if (datetime.now() - cache_time).total_seconds() < 3600:
-                    return cached_data
+            cached_data = self.data_cache.get(cache_key)
+            # 如果在最近一小时内有缓存数据，则返回缓存数据
+            if cached_data is not None:
+                return cached_data
 
             # 从akshare获取数据
             concept_data = ak.stock_fund_flow_concept(symbol=period)
@@ -57,7 +58,7 @@ class CapitalFlowAnalyzer:
                     continue
 
             # 缓存结果
-            self.data_cache[cache_key] = (datetime.now(), result)
+            self.data_cache[cache_key] = result
 
             return result
         except Exception as e:
@@ -73,11 +74,10 @@ class CapitalFlowAnalyzer:
 
             # 检查缓存
             cache_key = f"individual_fund_flow_rank_{period}"
-            if cache_key in self.data_cache:
-                cache_time, cached_data = self.data_cache[cache_key]
-                # 如果在最近一小时内有缓存数据，则返回缓存数据
-                if (datetime.now() - cache_time).total_seconds() < 3600:
-                    return cached_data
+            cached_data = self.data_cache.get(cache_key)
+            # 如果在最近一小时内有缓存数据，则返回缓存数据
+            if cached_data is not None:
+                return cached_data
 
             # 从akshare获取数据
             stock_data = ak.stock_individual_fund_flow_rank(indicator=period)
@@ -112,7 +112,7 @@ class CapitalFlowAnalyzer:
                     continue
 
             # 缓存结果
-            self.data_cache[cache_key] = (datetime.now(), result)
+            self.data_cache[cache_key] = result
 
             return result
         except Exception as e:
@@ -128,11 +128,10 @@ class CapitalFlowAnalyzer:
 
             # 检查缓存
             cache_key = f"individual_fund_flow_{stock_code}_{market_type}"
-            if cache_key in self.data_cache:
-                cache_time, cached_data = self.data_cache[cache_key]
-                # 如果在一小时内有缓存数据，则返回缓存数据
-                if (datetime.now() - cache_time).total_seconds() < 3600:
-                    return cached_data
+            cached_data = self.data_cache.get(cache_key)
+            # 如果在一小时内有缓存数据，则返回缓存数据
+            if cached_data is not None:
+                return cached_data
 
             # 如果未提供市场类型，则根据股票代码判断
             if not market_type:
@@ -189,7 +188,7 @@ class CapitalFlowAnalyzer:
                 }
 
             # Cache the result
-            self.data_cache[cache_key] = (datetime.now(), result)
+            self.data_cache[cache_key] = result
 
             return result
         except Exception as e:
@@ -205,16 +204,15 @@ class CapitalFlowAnalyzer:
 
             # 检查缓存
             cache_key = f"sector_stocks_{sector}"
-            if cache_key in self.data_cache:
-                cache_time, cached_data = self.data_cache[cache_key]
-                # 如果在一小时内有缓存数据，则返回缓存数据
-                if (datetime.now() - cache_time).total_seconds() < 3600:
-                    return cached_data
+            cached_data = self.data_cache.get(cache_key)
+            # 如果在一小时内有缓存数据，则返回缓存数据
+            if cached_data is not None:
+                return cached_data
 
             # 使用DataProvider获取概念/行业成分股详细信息
             result = self.data_provider.get_concept_stocks_detail(sector)
             if result:
-                self.data_cache[cache_key] = (datetime.now(), result)
+                self.data_cache[cache_key] = result
             return result  # 没数据就返回空，不用mock
 
         except Exception as e:
@@ -1,5 +1,5 @@
 
-import akshare as ak
+from app.core.akshare_client import ak
 import pandas as pd
 from datetime import datetime, timedelta
 import numpy as np
@@ -15,17 +15,24 @@ class EtfAnalyzer:
         from app.core.data_provider import get_data_provider
         self.data_provider = get_data_provider()
 
-    def run_analysis(self):
+    def run_analysis(self, progress_callback=None):
         """
         运行所有分析步骤并返回结果
+        progress_callback: 每开始一个步骤回调 (进度百分比, 步骤说明)，供任务推送分析进度
         """
-        self.get_basic_info()
-        self.analyze_market_performance()
-        self.analyze_fund_flow()
-        self.analyze_risk_and_tracking()
-        self.analyze_holdings()
-        self.analyze_sector()
-        self.get_ai_summary()
+        steps = [
+            (self.get_basic_info, 10, '正在获取基本信息...'),
+            (self.analyze_market_performance, 25, '正在分析市场表现...'),
+            (self.analyze_fund_flow, 40, '正在分析资金流向...'),
+            (self.analyze_risk_and_tracking, 50, '正在分析风险与跟踪误差...'),
+            (self.analyze_holdings, 60, '正在分析持仓...'),
+            (self.analyze_sector, 70, '正在分析所属板块...'),
+            (self.get_ai_summary, 80, '正在生成AI总结...'),
+        ]
+        for step, progress, message in steps:
+            if progress_callback:
+                progress_callback(progress, message)
+            step()
         
         return self.analysis_result
 
@@ -6,7 +6,7 @@
 许可证：MIT License
 """
 # fundamental_analyzer.py
-import akshare as ak
+from app.core.akshare_client import ak
 import pandas as pd
 import numpy as np
 
@@ -14,7 +14,8 @@ import numpy as np
 class FundamentalAnalyzer:
     def __init__(self):
         """初始化基础分析类"""
-        self.data_cache = {}
+        from app.core.cache import get_cache
+        self.data_cache = get_cache().namespace('fundamental', ttl=3600)
         # 初始化统一数据层
         from app.core.data_provider import get_data_provider
         self.data_provider = get_data_provider()
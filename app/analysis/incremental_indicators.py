@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+增量技术指标 - 老王说：来一根新K线就把几年的历史重算一遍，CPU不是这么烧的！
+每只股票一个状态对象，保存EMA、RSI涨跌均值、布林带/ATR/量均线的滑动窗口和MACD状态，
+新K线（或盘中最新价）进来 O(1) 更新。
+滚动均值、滚动方差、EWM 的累加方式与 pandas 的实现逐步对应（含 Kahan 补偿），
+所以结果与 StockAnalyzer.calculate_indicators 全量重算完全一致。
+"""
+import math
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.analysis.indicator_engine import DEFAULT_PARAMS, ROC_PERIOD, ROUND_DIGITS, PRICE_COLUMNS, INDICATOR_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+NAN = float('nan')
+
+
+def _is_nan(value: float) -> bool:
+    return value != value
+
+
+def _div(a: float, b: float) -> float:
+    """按 numpy 的规则做除法，除以0得到 inf/NaN 而不是抛异常"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(np.float64(a) / np.float64(b))
+
+
+class _Ewm:
+    """等价于 series.ewm(span=span, adjust=False).mean()"""
+
+    __slots__ = ('alpha', 'factor', 'weighted', 'old_wt', 'nobs', 'started')
+
+    def __init__(self, span: int):
+        com = (span - 1) / 2
+        self.alpha = 1.0 / (1.0 + com)
+        self.factor = 1.0 - self.alpha
+        self.weighted = NAN
+        self.old_wt = 1.0
+        self.nobs = 0
+        self.started = False
+
+    def copy(self) -> '_Ewm':
+        other = _Ewm.__new__(_Ewm)
+        for name in _Ewm.__slots__:
+            setattr(other, name, getattr(self, name))
+        return other
+
+    def update(self, value: float) -> float:
+        is_observation = not _is_nan(value)
+        if not self.started:
+            self.started = True
+            self.weighted = value
+            self.nobs = int(is_observation)
+        else:
+            self.nobs += int(is_observation)
+            if not _is_nan(self.weighted):
+                self.old_wt *= self.factor
+                if is_observation:
+                    # 常数序列不做运算，避免累积误差（与 pandas 相同）
+                    if self.weighted != value:
+                        self.weighted = self.old_wt * self.weighted + self.alpha * value
+                        self.weighted /= (self.old_wt + self.alpha)
+                    self.old_wt = 1.0
+            elif is_observation:
+                self.weighted = value
+        return self.weighted if self.nobs >= 1 else NAN
+
+
+class _RollingMean:
+    """等价于 series.rolling(window).mean()，加减窗口两端各自做 Kahan 补偿"""
+
+    __slots__ = ('window', 'values', 'nobs', 'sum_x', 'neg_ct', 'comp_add', 'comp_remove',
+                 'same_count', 'prev_value')
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.nobs = 0
+        self.sum_x = 0.0
+        self.neg_ct = 0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.same_count = 0
+        self.prev_value = NAN
+
+    def copy(self) -> '_RollingMean':
+        other = _RollingMean.__new__(_RollingMean)
+        for name in _RollingMean.__slots__:
+            setattr(other, name, getattr(self, name))
+        other.values = deque(self.values, maxlen=self.window)
+        return other
+
+    def _add(self, value: float):
+        if _is_nan(value):
+            return
+        self.nobs += 1
+        y = value - self.comp_add
+        t = self.sum_x + y
+        self.comp_add = t - self.sum_x - y
+        self.sum_x = t
+        if math.copysign(1.0, value) < 0:
+            self.neg_ct += 1
+        self.same_count = self.same_count + 1 if value == self.prev_value else 1
+        self.prev_value = value
+
+    def _remove(self, value: float):
+        if _is_nan(value):
+            return
+        self.nobs -= 1
+        y = -value - self.comp_remove
+        t = self.sum_x + y
+        self.comp_remove = t - self.sum_x - y
+        self.sum_x = t
+        if math.copysign(1.0, value) < 0:
+            self.neg_ct -= 1
+
+    def update(self, value: float) -> float:
+        if len(self.values) == self.window:
+            self._remove(self.values[0])
+        self.values.append(value)
+        self._add(value)
+
+        if self.nobs >= self.window and self.nobs > 0:
+            result = self.sum_x / self.nobs
+            if self.same_count >= self.nobs:
+                result = self.prev_value
+            elif self.neg_ct == 0 and result < 0:
+                result = 0.0
+            elif self.neg_ct == self.nobs and result > 0:
+                result = 0.0
+            return result
+        return NAN
+
+
+class _RollingStd:
+    """等价于 series.rolling(window).std()（ddof=1），Welford 算法加 Kahan 补偿"""
+
+    __slots__ = ('window', 'values', 'nobs', 'mean_x', 'ssqdm_x', 'comp_add', 'comp_remove',
+                 'same_count', 'prev_value')
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.nobs = 0
+        self.mean_x = 0.0
+        self.ssqdm_x = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.same_count = 0
+        self.prev_value = NAN
+
+    def copy(self) -> '_RollingStd':
+        other = _RollingStd.__new__(_RollingStd)
+        for name in _RollingStd.__slots__:
+            setattr(other, name, getattr(self, name))
+        other.values = deque(self.values, maxlen=self.window)
+        return other
+
+    def _add(self, value: float):
+        if _is_nan(value):
+            return
+        self.nobs += 1
+        self.same_count = self.same_count + 1 if value == self.prev_value else 1
+        self.prev_value = value
+        prev_mean = self.mean_x - self.comp_add
+        y = value - self.comp_add
+        t = y - self.mean_x
+        self.comp_add = t + self.mean_x - y
+        self.mean_x = self.mean_x + t / self.nobs if self.nobs else 0.0
+        self.ssqdm_x = self.ssqdm_x + (value - prev_mean) * (value - self.mean_x)
+
+    def _remove(self, value: float):
+        if _is_nan(value):
+            return
+        self.nobs -= 1
+        if self.nobs:
+            prev_mean = self.mean_x - self.comp_remove
+            y = value - self.comp_remove
+            t = y - self.mean_x
+            self.comp_remove = t + self.mean_x - y
+            self.mean_x = self.mean_x - t / self.nobs
+            self.ssqdm_x = self.ssqdm_x - (value - prev_mean) * (value - self.mean_x)
+        else:
+            self.mean_x = 0.0
+            self.ssqdm_x = 0.0
+
+    def update(self, value: float) -> float:
+        if len(self.values) == self.window:
+            self._remove(self.values[0])
+        self.values.append(value)
+        self._add(value)
+
+        if self.nobs >= self.window and self.nobs > 1:
+            if self.same_count >= self.nobs:
+                return 0.0
+            variance = self.ssqdm_x / (self.nobs - 1)
+            return math.sqrt(variance) if variance >= 0 else 0.0
+        return NAN
+
+
+class IncrementalIndicators:
+    """单只股票的增量指标状态
+
+    用法：
+        state = IncrementalIndicators.from_history(df)      # 用历史K线初始化
+        row = state.update(bar)                               # 收盘K线，确认后推进状态
+        row = state.update(tick_bar, final=False)             # 盘中最新价，只预览不推进
+    update 返回最新一根K线的全部字段和指标，数值与对整段历史调用 calculate_indicators 后的最后一行相同。
+    """
+
+    def __init__(self, params: Optional[Dict] = None):
+        self.params = params or DEFAULT_PARAMS
+        ma = self.params['ma_periods']
+        self._ema = {'MA5': _Ewm(ma['short']), 'MA20': _Ewm(ma['medium']), 'MA60': _Ewm(ma['long']),
+                     'EXP12': _Ewm(12), 'EXP26': _Ewm(26), 'Signal': _Ewm(9)}
+        self._rolling = {
+            'gain': _RollingMean(self.params['rsi_period']),
+            'loss': _RollingMean(self.params['rsi_period']),
+            'BB_middle': _RollingMean(self.params['bollinger_period']),
+            'Volume_MA': _RollingMean(self.params['volume_ma_period']),
+            'ATR': _RollingMean(self.params['atr_period']),
+        }
+        self._bb_std = _RollingStd(self.params['bollinger_period'])
+        # 最近 ROC_PERIOD+1 根收盘价：ROC 和前收盘都从这里取
+        self._closes = deque(maxlen=ROC_PERIOD + 1)
+        self.bars = 0
+        self.latest: Optional[Dict] = None
+        # 盘中预览时的结果，不影响已确认的状态
+        self._provisional: Optional[Dict] = None
+
+    @classmethod
+    def from_history(cls, df: pd.DataFrame, params: Optional[Dict] = None) -> 'IncrementalIndicators':
+        """用历史K线初始化（逐根回放，只在建状态时做一次）"""
+        state = cls(params)
+        for bar in df.to_dict('records'):
+            state.update(bar)
+        return state
+
+    def copy(self) -> 'IncrementalIndicators':
+        other = IncrementalIndicators.__new__(IncrementalIndicators)
+        other.params = self.params
+        other._ema = {name: ema.copy() for name, ema in self._ema.items()}
+        other._rolling = {name: rolling.copy() for name, rolling in self._rolling.items()}
+        other._bb_std = self._bb_std.copy()
+        other._closes = deque(self._closes, maxlen=self._closes.maxlen)
+        other.bars = self.bars
+        other.latest = self.latest
+        other._provisional = None
+        return other
+
+    def update(self, bar: Dict, final: bool = True) -> Dict:
+        """推入一根K线
+
+        Args:
+            bar: 至少包含 open/high/low/close/volume 的字典
+            final: True 表示这根K线已经收盘，状态向前推进；
+                   False 表示盘中最新价，结果按“今天这根K线到此为止”计算，下次更新会覆盖它
+
+        Returns:
+            最新一根K线的字段和指标（已按 format_indicator_data 的规则保留小数）
+        """
+        if final:
+            self._provisional = None
+            row = self._push(bar)
+            self.latest = row
+            return row
+
+        preview = self.copy()
+        row = preview._push(bar)
+        self._provisional = row
+        return row
+
+    @property
+    def current(self) -> Optional[Dict]:
+        """当前最新值：有盘中预览时返回预览结果"""
+        return self._provisional or self.latest
+
+    def _push(self, bar: Dict) -> Dict:
+        close = float(bar['close'])
+        high = float(bar['high'])
+        low = float(bar['low'])
+        volume = float(bar['volume'])
+        prev_close = self._closes[-1] if self._closes else NAN
+        self._closes.append(close)
+        self.bars += 1
+
+        values = {}
+        values['MA5'] = self._ema['MA5'].update(close)
+        values['MA20'] = self._ema['MA20'].update(close)
+        values['MA60'] = self._ema['MA60'].update(close)
+
+        # RSI：第一根的涨跌（NaN）按0处理，和 delta.where(...) 一致
+        delta = close - prev_close
+        gain = self._rolling['gain'].update(delta if delta > 0 else 0.0)
+        loss = self._rolling['loss'].update(-delta if delta < 0 else 0.0)
+        values['RSI'] = float(100 - _div(100, 1 + _div(gain, loss)))
+
+        macd = self._ema['EXP12'].update(close) - self._ema['EXP26'].update(close)
+        signal = self._ema['Signal'].update(macd)
+        values['MACD'], values['Signal'], values['MACD_hist'] = macd, signal, macd - signal
+
+        middle = self._rolling['BB_middle'].update(close)
+        std = self._bb_std.update(close)
+        values['BB_upper'] = middle + (std * self.params['bollinger_std'])
+        values['BB_middle'] = middle
+        values['BB_lower'] = middle - (std * self.params['bollinger_std'])
+
+        volume_ma = self._rolling['Volume_MA'].update(volume)
+        values['Volume_MA'] = volume_ma
+        values['Volume_Ratio'] = _div(volume, volume_ma)
+
+        # 三种真实波幅取最大值，缺失的跳过
+        ranges = [r for r in (high - low, abs(high - prev_close), abs(low - prev_close)) if not _is_nan(r)]
+        atr = self._rolling['ATR'].update(max(ranges) if ranges else NAN)
+        values['ATR'] = atr
+        values['Volatility'] = _div(atr, close) * 100
+
+        base = self._closes[0] if len(self._closes) > ROC_PERIOD else NAN
+        values['ROC'] = (_div(close, base) - 1) * 100
+
+        row = dict(bar)
+        for col in PRICE_COLUMNS:
+            if col in row:
+                row[col] = float(np.round(np.float64(row[col]), 2))
+        for name in INDICATOR_COLUMNS:
+            value = values[name]
+            if name in ROUND_DIGITS:
+                value = float(np.round(np.float64(value), ROUND_DIGITS[name]))
+            row[name] = value
+        return row
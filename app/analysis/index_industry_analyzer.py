@@ -1,27 +1,63 @@
 # index_industry_analyzer.py
-import akshare as ak
+import os
+from app.core.akshare_client import ak
 import pandas as pd
 import numpy as np
-import threading
+
+from app.analysis.scan_engine import ScanEngine
 
 
 class IndexIndustryAnalyzer:
     def __init__(self, analyzer):
         self.analyzer = analyzer
-        self.data_cache = {}
+        # 成分股分析的截止时间（秒），到点没分析完的股票放弃，用已有结果出报告
+        self.deadline = float(os.getenv('INDEX_ANALYSIS_DEADLINE', '120'))
+        from app.core.cache import get_cache
+        self.data_cache = get_cache().namespace('index_industry', ttl=3600, shared=True)
         # 初始化统一数据层
         from app.core.data_provider import get_data_provider
         self.data_provider = get_data_provider()
 
-    def analyze_index(self, index_code, limit=30):
-        """分析指数整体情况"""
+    def _analyze_stocks(self, stock_list, progress_callback=None, should_stop=None):
+        """在有上限的线程池里分析成分股，返回 (结果列表, 统计)
+
+        结果里每只股票带上取数耗时 elapsed；超时或被中止时统计里 partial 为 True
+        """
+        engine = ScanEngine(self.analyzer)
+        results = engine.scan(stock_list, min_score=0, progress_callback=progress_callback,
+                              should_stop=should_stop, deadline=self.deadline)
+        # 超时放弃的请求可能还在往 timings 里写，先拷一份
+        timings = dict(engine.stats.get('timings', {}))
+        for result in results:
+            result['elapsed'] = timings.get(result['stock_code'])
+
+        slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[:5]
+        stats = {
+            'total': engine.stats.get('total', 0),
+            'analyzed': len(results),
+            'failed': engine.stats.get('failed', 0),
+            'timed_out': engine.stats.get('timed_out', 0),
+            'cancelled': engine.stats.get('cancelled', False),
+            'elapsed': engine.stats.get('elapsed', 0.0),
+            'avg_fetch_time': round(sum(timings.values()) / len(timings), 3) if timings else None,
+            'slowest': [{'stock_code': code, 'elapsed': seconds} for code, seconds in slowest],
+        }
+        stats['partial'] = bool(stats['timed_out'] or stats['cancelled'])
+        return results, stats
+
+    def analyze_index(self, index_code, limit=30, progress_callback=None, should_stop=None):
+        """分析指数整体情况
+
+        Args:
+            progress_callback: 每分析完一只成分股回调 (processed, total, stock_code, report, error)，可用于逐步展示结果
+            should_stop: 返回True时中止，用已完成的成分股出报告
+        """
         try:
             cache_key = f"index_{index_code}"
-            if cache_key in self.data_cache:
-                cache_time, cached_result = self.data_cache[cache_key]
-                # 如果缓存时间在1小时内，直接返回
-                if (pd.Timestamp.now() - cache_time).total_seconds() < 3600:
-                    return cached_result
+            cached_result = self.data_cache.get(cache_key)
+            # 如果缓存时间在1小时内，直接返回
+            if cached_result is not None:
+                return cached_result
 
             # 获取指数成分股 - 使用DataProvider统一数据层
             index_names = {
@@ -45,32 +81,11 @@ class IndexIndustryAnalyzer:
                 stock_list = [s[0] for s in stock_weights[:limit]]
                 weights = [s[1] for s in stock_weights[:limit]]
 
-            # 多线程分析股票
-            results = []
-            threads = []
-            results_lock = threading.Lock()
-
-            def analyze_stock(stock_code, weight):
-                try:
-                    # 分析股票
-                    result = self.analyzer.quick_analyze_stock(stock_code)
-                    result['weight'] = weight
-
-                    with results_lock:
-                        results.append(result)
-                except Exception as e:
-                    print(f"分析股票 {stock_code} 时出错: {str(e)}")
-
-            # 创建并启动线程
-            for i, stock_code in enumerate(stock_list):
-                weight = weights[i] if i < len(weights) else 1
-                thread = threading.Thread(target=analyze_stock, args=(stock_code, weight))
-                threads.append(thread)
-                thread.start()
-
-            # 等待所有线程完成
-            for thread in threads:
-                thread.join()
+            # 有上限的线程池并发拉数据，指标整批计算
+            results, stats = self._analyze_stocks(stock_list, progress_callback, should_stop)
+            weight_map = dict(zip(stock_list, weights))
+            for result in results:
+                result['weight'] = weight_map.get(result['stock_code'], 1)
 
             # 计算指数整体情况
             total_weight = sum([r.get('weight', 1) for r in results])
@@ -108,11 +123,13 @@ class IndexIndustryAnalyzer:
                 "up_ratio": up_ratio,
                 "weighted_change": weighted_change,
                 "top_stocks": results[:5] if len(results) >= 5 else results,
-                "results": results
+                "results": results,
+                "timing": stats
             }
 
-            # 缓存结果
-            self.data_cache[cache_key] = (pd.Timestamp.now(), index_analysis)
+            # 缓存结果（超时或中止的不完整结果不缓存）
+            if not stats['partial']:
+                self.data_cache[cache_key] = index_analysis
 
             return index_analysis
 
@@ -120,15 +137,14 @@ class IndexIndustryAnalyzer:
             print(f"分析指数整体情况时出错: {str(e)}")
             return {"error": f"分析指数时出错: {str(e)}"}
 
-    def analyze_industry(self, industry, limit=30):
-        """分析行业整体情况"""
+    def analyze_industry(self, industry, limit=30, progress_callback=None, should_stop=None):
+        """分析行业整体情况，参数含义同 analyze_index"""
         try:
             cache_key = f"industry_{industry}"
-            if cache_key in self.data_cache:
-                cache_time, cached_result = self.data_cache[cache_key]
-                # 如果缓存时间在1小时内，直接返回
-                if (pd.Timestamp.now() - cache_time).total_seconds() < 3600:
-                    return cached_result
+            cached_result = self.data_cache.get(cache_key)
+            # 如果缓存时间在1小时内，直接返回
+            if cached_result is not None:
+                return cached_result
 
             # 获取行业成分股 - 使用DataProvider统一数据层
             stock_list = self.data_provider.get_industry_stocks(industry)
@@ -139,30 +155,8 @@ class IndexIndustryAnalyzer:
             if limit and len(stock_list) > limit:
                 stock_list = stock_list[:limit]
 
-            # 多线程分析股票
-            results = []
-            threads = []
-            results_lock = threading.Lock()
-
-            def analyze_stock(stock_code):
-                try:
-                    # 分析股票
-                    result = self.analyzer.quick_analyze_stock(stock_code)
-
-                    with results_lock:
-                        results.append(result)
-                except Exception as e:
-                    print(f"分析股票 {stock_code} 时出错: {str(e)}")
-
-            # 创建并启动线程
-            for stock_code in stock_list:
-                thread = threading.Thread(target=analyze_stock, args=(stock_code,))
-                threads.append(thread)
-                thread.start()
-
-            # 等待所有线程完成
-            for thread in threads:
-                thread.join()
+            # 有上限的线程池并发拉数据，指标整批计算
+            results, stats = self._analyze_stocks(stock_list, progress_callback, should_stop)
 
             # 计算行业整体情况
             if not results:
@@ -196,11 +190,13 @@ class IndexIndustryAnalyzer:
                 "up_ratio": up_ratio,
                 "avg_change": avg_change,
                 "top_stocks": results[:5] if len(results) >= 5 else results,
-                "results": results
+                "results": results,
+                "timing": stats
             }
 
-            # 缓存结果
-            self.data_cache[cache_key] = (pd.Timestamp.now(), industry_analysis)
+            # 缓存结果（超时或中止的不完整结果不缓存）
+            if not stats['partial']:
+                self.data_cache[cache_key] = industry_analysis
 
             return industry_analysis
 
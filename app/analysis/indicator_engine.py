@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+截面指标引擎 - 老王说：几百只股票挨个 ewm/rolling，光函数调用开销就够喝一壶的！
+把一批股票按行号右对齐拼成 (T, N) 面板，前面不够长的补 NaN，
+每个指标对整个面板只算一遍，结果与 StockAnalyzer.calculate_indicators 逐只计算完全一致。
+"""
+import logging
+from typing import Dict, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 与 StockAnalyzer.params 一致的默认参数
+DEFAULT_PARAMS = {
+    'ma_periods': {'short': 5, 'medium': 20, 'long': 60},
+    'rsi_period': 14,
+    'bollinger_period': 20,
+    'bollinger_std': 2,
+    'volume_ma_period': 20,
+    'atr_period': 14
+}
+
+# 动量指标周期
+ROC_PERIOD = 10
+
+# 面板需要的输入列
+PANEL_FIELDS = ['close', 'high', 'low', 'volume']
+
+# 输出列（顺序与逐只计算时新增列的顺序相同）
+INDICATOR_COLUMNS = ['MA5', 'MA20', 'MA60', 'RSI', 'MACD', 'Signal', 'MACD_hist',
+                     'BB_upper', 'BB_middle', 'BB_lower', 'Volume_MA', 'Volume_Ratio',
+                     'ATR', 'Volatility', 'ROC']
+
+# 小数位数，与 format_indicator_data 保持一致
+ROUND_DIGITS = {
+    'MA5': 2, 'MA20': 2, 'MA60': 2, 'BB_upper': 2, 'BB_middle': 2, 'BB_lower': 2,
+    'MACD': 3, 'Signal': 3, 'MACD_hist': 3,
+    'RSI': 2, 'Volatility': 2, 'ROC': 2, 'Volume_Ratio': 2,
+}
+PRICE_COLUMNS = ['open', 'close', 'high', 'low']
+
+
+def compute_panel(close: Union[np.ndarray, pd.DataFrame], high, low, volume,
+                  lengths: Optional[np.ndarray] = None, params: Optional[Dict] = None,
+                  round_output: bool = True) -> Dict[str, np.ndarray]:
+    """对 (T, N) 面板计算全部技术指标
+
+    Args:
+        close/high/low/volume: 形状相同的二维数组，每列一只股票，按行号右对齐，前面补 NaN
+        lengths: 每列真实数据的行数，缺省时按 close 第一个非空值推断
+        params: 指标参数，缺省用 DEFAULT_PARAMS
+        round_output: 是否按 format_indicator_data 的规则保留小数
+
+    Returns:
+        {指标名: (T, N) 数组}
+    """
+    params = params or DEFAULT_PARAMS
+    close = pd.DataFrame(np.asarray(close, dtype=float))
+    high = pd.DataFrame(np.asarray(high, dtype=float))
+    low = pd.DataFrame(np.asarray(low, dtype=float))
+    volume = pd.DataFrame(np.asarray(volume, dtype=float))
+    n_rows = close.shape[0]
+
+    if lengths is None:
+        valid = close.notna().to_numpy()
+        first_valid = np.where(valid.any(axis=0), valid.argmax(axis=0), n_rows)
+        lengths = n_rows - first_valid
+    # 补齐区域：这些格子不属于任何一只股票
+    padding = np.arange(n_rows)[:, None] < (n_rows - np.asarray(lengths))[None, :]
+
+    out = {}
+
+    # 移动平均线（EMA）
+    ma = params['ma_periods']
+    out['MA5'] = close.ewm(span=ma['short'], adjust=False).mean()
+    out['MA20'] = close.ewm(span=ma['medium'], adjust=False).mean()
+    out['MA60'] = close.ewm(span=ma['long'], adjust=False).mean()
+
+    # RSI：逐只计算时第一根的涨跌被当成0，补齐区域要保持 NaN，否则窗口会提前凑满
+    rsi_period = params['rsi_period']
+    delta = close.diff()
+    gain = delta.where(delta > 0, 0).mask(padding)
+    loss = (-delta.where(delta < 0, 0)).mask(padding)
+    rs = gain.rolling(window=rsi_period).mean() / loss.rolling(window=rsi_period).mean()
+    out['RSI'] = 100 - (100 / (1 + rs))
+
+    # MACD
+    exp1 = close.ewm(span=12, adjust=False).mean()
+    exp2 = close.ewm(span=26, adjust=False).mean()
+    macd = exp1 - exp2
+    signal = macd.ewm(span=9, adjust=False).mean()
+    out['MACD'], out['Signal'], out['MACD_hist'] = macd, signal, macd - signal
+
+    # 布林带
+    bb_period = params['bollinger_period']
+    middle = close.rolling(window=bb_period).mean()
+    std = close.rolling(window=bb_period).std()
+    out['BB_upper'] = middle + (std * params['bollinger_std'])
+    out['BB_middle'] = middle
+    out['BB_lower'] = middle - (std * params['bollinger_std'])
+
+    # 成交量
+    volume_ma = volume.rolling(window=params['volume_ma_period']).mean()
+    out['Volume_MA'] = volume_ma
+    out['Volume_Ratio'] = volume / volume_ma
+
+    # ATR 和波动率：三种真实波幅取最大值，缺失的跳过
+    prev_close = close.shift(1).to_numpy()
+    tr = np.fmax(np.fmax((high - low).to_numpy(), np.abs(high.to_numpy() - prev_close)),
+                 np.abs(low.to_numpy() - prev_close))
+    atr = pd.DataFrame(tr).rolling(window=params['atr_period']).mean()
+    out['ATR'] = atr
+    out['Volatility'] = atr / close * 100
+
+    # 动量
+    out['ROC'] = close.pct_change(periods=ROC_PERIOD) * 100
+
+    result = {}
+    for name in INDICATOR_COLUMNS:
+        values = out[name]
+        if round_output and name in ROUND_DIGITS:
+            values = values.round(ROUND_DIGITS[name])
+        result[name] = values.to_numpy()
+    return result
+
+
+def _split_frames(frames) -> Dict[str, pd.DataFrame]:
+    """把 MultiIndex(第一层为股票代码) 的 DataFrame 拆成 {代码: DataFrame}"""
+    if isinstance(frames, pd.DataFrame):
+        if not isinstance(frames.index, pd.MultiIndex):
+            raise ValueError("面板DataFrame需要以股票代码为第一层的MultiIndex")
+        return {code: group.droplevel(0) for code, group in frames.groupby(level=0, sort=False)}
+    return dict(frames)
+
+
+def calculate_panel_indicators(frames, params: Optional[Dict] = None) -> Dict[str, pd.DataFrame]:
+    """批量计算多只股票的技术指标
+
+    Args:
+        frames: {股票代码: K线DataFrame}，或以股票代码为第一层索引的 MultiIndex DataFrame
+        params: 指标参数
+
+    Returns:
+        {股票代码: 带指标列的新DataFrame}，与逐只调用 calculate_indicators 的结果相同；
+        缺少必要列或为空的股票不在结果里
+    """
+    frames = _split_frames(frames)
+    valid = {}
+    for code, df in frames.items():
+        if df is None or df.empty or any(col not in df.columns for col in PANEL_FIELDS):
+            logger.warning(f"{code} 数据不完整，跳过批量指标计算")
+            continue
+        valid[code] = df
+    if not valid:
+        return {}
+
+    codes = list(valid)
+    lengths = np.array([len(valid[code]) for code in codes])
+    n_rows = int(lengths.max())
+
+    panels = {}
+    for field in PANEL_FIELDS:
+        panel = np.full((n_rows, len(codes)), np.nan)
+        for j, code in enumerate(codes):
+            panel[n_rows - lengths[j]:, j] = valid[code][field].to_numpy(dtype=float)
+        panels[field] = panel
+
+    indicators = compute_panel(panels['close'], panels['high'], panels['low'], panels['volume'],
+                               lengths=lengths, params=params)
+
+    # (T, N, 指标数)，每只股票切一块直接拼到原表后面
+    stacked = np.stack([indicators[name] for name in INDICATOR_COLUMNS], axis=-1)
+
+    results = {}
+    for j, code in enumerate(codes):
+        df = valid[code]
+        block = stacked[n_rows - lengths[j]:, j, :]
+        # 一次性构造新表，已有同名指标列时原位覆盖，列顺序与逐只计算相同
+        columns = {col: (df[col].round(2).array if col in PRICE_COLUMNS else df[col].array)
+                   for col in df.columns}
+        for k, name in enumerate(INDICATOR_COLUMNS):
+            columns[name] = block[:, k]
+        results[code] = pd.DataFrame(columns, index=df.index)
+    return results
@@ -6,9 +6,10 @@
 许可证：MIT License
 """
 # industry_analyzer.py
+import asyncio
 import logging
 import random
-import akshare as ak
+from app.core.akshare_client import ak
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -17,7 +18,8 @@ from datetime import datetime, timedelta
 class IndustryAnalyzer:
     def __init__(self):
         """初始化行业分析类"""
-        self.data_cache = {}
+        from app.core.cache import get_cache
+        self.data_cache = get_cache().namespace('industry', ttl=3600, shared=True)
         self.industry_code_map = {}  # 缓存行业名称到代码的映射
 
         # 设置日志记录
@@ -36,12 +38,11 @@ class IndustryAnalyzer:
             cache_key = f"industry_fund_flow_{symbol}"
 
             # 检查缓存
-            if cache_key in self.data_cache:
-                cache_time, cached_data = self.data_cache[cache_key]
-                # 如果缓存时间在30分钟内，直接返回
-                if (datetime.now() - cache_time).total_seconds() < 1800:
-                    self.logger.info(f"从缓存获取行业资金流向数据: {symbol}")
-                    return cached_data
+            cached_data = self.data_cache.get(cache_key)
+            # 如果缓存时间在30分钟内，直接返回
+            if cached_data is not None:
+                self.logger.info(f"从缓存获取行业资金流向数据: {symbol}")
+                return cached_data
 
             # 获取行业资金流向数据
             self.logger.info(f"从API获取行业资金流向数据: {symbol}")
@@ -99,7 +100,7 @@ class IndustryAnalyzer:
                         continue
 
             # 缓存结果
-            self.data_cache[cache_key] = (datetime.now(), result)
+            self.data_cache.set(cache_key, result, ttl=1800)
 
             return result
 
@@ -187,12 +188,11 @@ class IndustryAnalyzer:
             cache_key = f"industry_stocks_{industry}"
 
             # 检查缓存
-            if cache_key in self.data_cache:
-                cache_time, cached_data = self.data_cache[cache_key]
-                # 如果缓存时间在1小时内，直接返回
-                if (datetime.now() - cache_time).total_seconds() < 3600:
-                    self.logger.info(f"从缓存获取行业成分股: {industry}")
-                    return cached_data
+            cached_data = self.data_cache.get(cache_key)
+            # 如果缓存时间在1小时内，直接返回
+            if cached_data is not None:
+                self.logger.info(f"从缓存获取行业成分股: {industry}")
+                return cached_data
 
             # 获取行业成分股
             self.logger.info(f"获取 {industry} 行业成分股")
@@ -241,7 +241,7 @@ class IndustryAnalyzer:
                 result = self._generate_mock_industry_stocks(industry)
 
             # 缓存结果
-            self.data_cache[cache_key] = (datetime.now(), result)
+            self.data_cache[cache_key] = result
 
             return result
 
@@ -310,11 +310,15 @@ class IndustryAnalyzer:
             if not industry_data:
                 return None
 
-            # 获取历史资金流向数据
+            # 获取历史资金流向数据，4个周期并发拉取
             history_data = []
+            periods = ["3日排行", "5日排行", "10日排行", "20日排行"]
 
-            for period in ["3日排行", "5日排行", "10日排行", "20日排行"]:
-                period_data = self.get_industry_fund_flow(period)
+            async def fetch_periods():
+                return await asyncio.gather(
+                    *(self.data_provider.arun(self.get_industry_fund_flow, period) for period in periods))
+
+            for period, period_data in zip(periods, self.data_provider.run_coroutine(fetch_periods())):
                 industry_period_data = next((item for item in period_data if item["industry"] == industry), None)
 
                 if industry_period_data:
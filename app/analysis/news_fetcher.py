@@ -11,7 +11,7 @@ import logging
 import time
 import hashlib
 from datetime import datetime, timedelta, date
-import akshare as ak
+from app.core.akshare_client import ak
 import pandas as pd
 
 # 设置日志
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+多进程打分 - 老王说：数据都在缓存里了，扫描还是慢？那是指标计算被 GIL 卡在一个核上！
+K线拼成右对齐的 (字段, T, N) 面板放进共享内存，子进程直接按名字挂上去读，不用 pickle 一堆 DataFrame；
+每个子进程算一段股票的指标和评分，只回传评分和快速报告要用的最后两根K线，数据量很小。
+结果与 calculate_indicators_batch + calculate_score_batch 完全一致。
+"""
+import os
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.analysis.indicator_engine import PANEL_FIELDS, compute_panel
+from app.analysis.score_engine import SCORE_FIELDS, SCORE_PARTS, TAIL_ROWS, score_panel
+
+logger = logging.getLogger(__name__)
+
+# 快速报告用到的字段（最后两根K线）
+REPORT_FIELDS = ['close', 'MA5', 'MA20', 'RSI', 'MACD', 'Signal', 'Volume_Ratio']
+
+# 每个子进程至少处理多少只股票
+MIN_CHUNK = 20
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def get_process_workers() -> int:
+    """SCAN_SCORE_PROCESSES：0 关闭多进程打分，auto 为 CPU 核数"""
+    value = os.getenv('SCAN_SCORE_PROCESSES', '0').strip().lower()
+    if value == 'auto':
+        return os.cpu_count() or 1
+    try:
+        return max(0, int(value))
+    except ValueError:
+        return 0
+
+
+def _get_executor(max_workers: int) -> ProcessPoolExecutor:
+    """常驻进程池，第一次用时创建
+
+    启动方式默认跟平台走（Linux 是 fork），可用 SCAN_SCORE_START_METHOD 改成 spawn/forkserver，
+    但那两种会在子进程里重新导入入口模块，run.py 这种导入时就起后台线程的入口不适用
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            start_method = os.getenv('SCAN_SCORE_START_METHOD') or None
+            _executor = ProcessPoolExecutor(max_workers=max_workers,
+                                            mp_context=multiprocessing.get_context(start_method))
+            _executor_workers = max_workers
+        return _executor
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """子进程挂载共享内存，由父进程负责 unlink"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数；子进程和父进程共用一个 resource_tracker，重复登记无妨
+        return shared_memory.SharedMemory(name=name)
+
+
+def _score_chunk(shm_name: str, shape: Tuple[int, int, int], lo: int, hi: int, lengths: np.ndarray,
+                 params: Optional[Dict], market_type: str, earnings_season: bool):
+    """子进程：对面板第 lo:hi 列算指标和评分"""
+    shm = _attach(shm_name)
+    try:
+        panel = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        close, high, low, volume = (panel[k, :, lo:hi].copy() for k in range(len(PANEL_FIELDS)))
+    finally:
+        shm.close()
+
+    indicators = compute_panel(close, high, low, volume, lengths=lengths, params=params)
+    # 与 calculate_panel_indicators 一致：指标用原始价格算，输出的价格保留两位小数
+    indicators['close'] = np.round(close, 2)
+
+    n = hi - lo
+    rows = min(TAIL_ROWS, close.shape[0])
+    # 面板是右对齐的，最后几行就是每只股票最新的K线；不足 TAIL_ROWS 根的补齐区域保持 NaN
+    padding = np.arange(TAIL_ROWS)[:, None] < (TAIL_ROWS - lengths)[None, :]
+    tail = np.full((TAIL_ROWS, n, len(SCORE_FIELDS)), np.nan)
+    for k, field in enumerate(SCORE_FIELDS):
+        tail[TAIL_ROWS - rows:, :, k] = indicators[field][-rows:]
+    tail[padding] = np.nan
+    has_field = {field: np.ones(n, dtype=bool) for field in SCORE_FIELDS}
+    scores = score_panel(tail, lengths, has_field, market_type, earnings_season=earnings_season)
+
+    report_rows = np.stack([indicators[field][-2:] for field in REPORT_FIELDS], axis=-1)
+    return {part: np.asarray(scores[part]) for part in ['total'] + SCORE_PARTS}, report_rows
+
+
+def score_frames(frames: Dict[str, pd.DataFrame], params: Optional[Dict] = None, market_type: str = 'A',
+                 earnings_season: bool = False,
+                 max_workers: Optional[int] = None) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """多进程计算一批股票的评分
+
+    Args:
+        frames: {股票代码: K线DataFrame}（未算指标）
+        max_workers: 进程数，默认读 SCAN_SCORE_PROCESSES
+
+    Returns:
+        (以股票代码为索引的评分表，列同 calculate_score_batch,
+         {股票代码: 最后两根K线的报告字段}，可直接传给 build_quick_report(indicators_ready=True))
+        数据不完整的股票不在结果里
+    """
+    valid = {code: df for code, df in frames.items()
+             if df is not None and not df.empty and all(col in df.columns for col in PANEL_FIELDS)}
+    if not valid:
+        return pd.DataFrame(columns=['total'] + SCORE_PARTS), {}
+
+    codes: List[str] = list(valid)
+    lengths = np.array([len(valid[code]) for code in codes])
+    n_rows, n_codes = int(lengths.max()), len(codes)
+    shape = (len(PANEL_FIELDS), n_rows, n_codes)
+
+    # 每个进程至少分 MIN_CHUNK 只，太碎了进程间往返比算指标还慢
+    workers = max(1, min(max_workers or get_process_workers() or 1, -(-n_codes // MIN_CHUNK)))
+    bounds = np.linspace(0, n_codes, workers + 1).astype(int)
+
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+    try:
+        panel = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        panel.fill(np.nan)
+        for j, code in enumerate(codes):
+            values = valid[code][PANEL_FIELDS].to_numpy(dtype=float)
+            panel[:, n_rows - lengths[j]:, j] = values.T
+        del panel
+
+        executor = _get_executor(workers)
+        futures = [executor.submit(_score_chunk, shm.name, shape, lo, hi, lengths[lo:hi],
+                                   params, market_type, earnings_season)
+                   for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        chunks = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    scores = pd.DataFrame({part: np.concatenate([chunk[0][part] for chunk in chunks])
+                           for part in ['total'] + SCORE_PARTS},
+                          index=pd.Index(codes, name='stock_code'))
+    report_rows = np.concatenate([chunk[1] for chunk in chunks], axis=1)
+
+    reports = {}
+    for j, code in enumerate(codes):
+        rows = report_rows[-min(2, lengths[j]):, j, :]
+        reports[code] = pd.DataFrame(rows, columns=REPORT_FIELDS, index=valid[code].index[-len(rows):])
+    return scores, reports
@@ -20,6 +20,8 @@ class RiskMonitor:
             # 获取股票数据和技术指标
             df = self.analyzer.get_stock_data(stock_code, market_type)
             df = self.analyzer.calculate_indicators(df)
+            # 盘中用最新行情增量算出今天的指标，风险按当前价格评估
+            df = self.analyzer.apply_realtime_bar(stock_code, df, market_type)
 
             # 计算各类风险指标
             volatility_risk = self._analyze_volatility_risk(df)
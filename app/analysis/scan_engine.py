@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+市场扫描引擎 - 老王说：几百只股票一只只排队拉数据，等到收盘都扫不完！
+拉数据（等网络）放线程池并发跑，A股按组走批量K线接口（get_stock_data_many），一组拉回来就是一个面板，
+在扫描线程里一次算完指标和评分；数据源的并发压力由 FallbackManager 里的限流器兜着。
+大扫描可以开 SCAN_SCORE_PROCESSES 把指标和评分放到子进程里算，K线经共享内存传过去（见 process_scoring.py）。
+支持中止和截止时间，到点没拉完的直接放弃，已经算好的照常返回；每只股票的取数耗时记在 stats 里。
+iter_scan 是流式版本，报告一算好就产出，配合 TopK 随时拿到当前排名靠前的股票。
+"""
+import os
+import math
+import time
+import heapq
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ScanEngine:
+    """并发市场扫描"""
+
+    # 每处理多少只股票打一条进度日志
+    LOG_INTERVAL = 50
+    # 等待取数结果时多久醒来检查一次中止和截止时间（秒）
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, analyzer, max_workers: Optional[int] = None, batch_size: Optional[int] = None,
+                 score_processes: Optional[int] = None):
+        """
+        Args:
+            analyzer: StockAnalyzer 实例，提供取数和打分
+            max_workers: 拉数据的线程数，默认读 SCAN_FETCH_WORKERS
+            batch_size: 攒多少只一起算指标，默认读 SCAN_SCORE_BATCH
+            score_processes: 算指标和评分的进程数，0 表示在扫描线程里算，默认读 SCAN_SCORE_PROCESSES
+        """
+        from app.analysis.process_scoring import get_process_workers
+
+        self.analyzer = analyzer
+        self.max_workers = max(1, max_workers or int(os.getenv('SCAN_FETCH_WORKERS', '8')))
+        self.batch_size = max(1, batch_size or int(os.getenv('SCAN_SCORE_BATCH', '50')))
+        self.score_processes = get_process_workers() if score_processes is None else score_processes
+        # 没攒够一批时最多等多少秒就先算已拿到的
+        self.flush_interval = float(os.getenv('SCAN_FLUSH_INTERVAL', '2'))
+        # 最近一次扫描的统计
+        self.stats: Dict = {}
+
+    def _fetch(self, stock_code: str, market_type: str):
+        """I/O阶段：K线 + 股票信息"""
+        start = time.time()
+        try:
+            return self._fetch_data(stock_code, market_type)
+        finally:
+            self.stats['timings'][stock_code] = round(time.time() - start, 3)
+
+    def _fetch_data(self, stock_code: str, market_type: str):
+        df = self.analyzer.get_stock_data(stock_code, market_type)
+        if df is None or df.empty:
+            raise ValueError(f"股票 {stock_code} 的数据为空或无法处理")
+        return df, self._fetch_info(stock_code)
+
+    def _fetch_info(self, stock_code: str) -> Dict:
+        try:
+            return self.analyzer.get_stock_info(stock_code)
+        except Exception as e:
+            logger.warning(f"获取股票 {stock_code} 信息时出错: {e}")
+            return {}
+
+    def _fetch_one(self, stock_code: str, market_type: str) -> List[Tuple]:
+        """逐只取数，返回 [(股票代码, K线, 股票信息, 错误)]"""
+        try:
+            df, stock_info = self._fetch(stock_code, market_type)
+        except Exception as e:
+            return [(stock_code, None, None, str(e))]
+        return [(stock_code, df, stock_info, None)]
+
+    def _fetch_many(self, stock_codes: List[str], market_type: str) -> List[Tuple]:
+        """整组取数：K线一次批量拉完，再逐只取股票信息，返回 [(股票代码, K线, 股票信息, 错误)]
+
+        每只股票的取数耗时记为 批量K线耗时的平均份额 + 自己的信息耗时
+        """
+        start = time.time()
+        try:
+            frames = self.analyzer.get_stock_data_many(stock_codes, market_type)
+        except Exception as e:
+            logger.warning(f"批量获取 {len(stock_codes)} 只股票K线失败，改为逐只获取: {e}")
+            return [item for code in stock_codes for item in self._fetch_one(code, market_type)]
+        share = (time.time() - start) / len(stock_codes)
+
+        items = []
+        for stock_code in stock_codes:
+            info_start = time.time()
+            df = frames.get(stock_code)
+            if df is None or df.empty:
+                items.append((stock_code, None, None, f"股票 {stock_code} 的数据为空或无法处理"))
+            else:
+                items.append((stock_code, df, self._fetch_info(stock_code), None))
+            self.stats['timings'][stock_code] = round(share + time.time() - info_start, 3)
+        return items
+
+    def _submit_fetches(self, executor: ThreadPoolExecutor, stock_list: List[str],
+                        market_type: str) -> Tuple[Dict, int]:
+        """提交取数任务，返回 ({future: 这个任务负责的股票代码}, 攒够多少只就打分)
+
+        A股按组提交批量取数，组的大小不超过 batch_size，同时保证线程池的每个线程都有活干；
+        一组拉回来正好是一个面板，直接进批量打分。港美股没有批量接口，逐只提交
+        """
+        if market_type != 'A' or not hasattr(self.analyzer, 'get_stock_data_many') or len(stock_list) < 2:
+            futures = {executor.submit(self._fetch_one, code, market_type): [code] for code in stock_list}
+            return futures, self.batch_size
+        size = min(self.batch_size, math.ceil(len(stock_list) / self.max_workers))
+        chunks = [stock_list[i:i + size] for i in range(0, len(stock_list), size)]
+        return {executor.submit(self._fetch_many, chunk, market_type): chunk for chunk in chunks}, size
+
+    def scan(self, stock_list: List[str], min_score: float = 60, market_type: str = 'A',
+             progress_callback: Optional[Callable] = None,
+             should_stop: Optional[Callable[[], bool]] = None,
+             deadline: Optional[float] = None) -> List[Dict]:
+        """扫描股票列表，返回得分不低于 min_score 的快速分析报告（按完成顺序）
+
+        Args:
+            progress_callback: 每处理完一只股票回调 (processed, total, stock_code, report, error)，
+                report 为该股票的报告（出错时为 None），error 为错误信息
+            should_stop: 返回True时中止扫描，未开始的股票不再处理
+            deadline: 最多等多少秒，到点还没拉到数据的股票放弃，已拉到的照常打分
+        """
+        results = []
+        for processed, total, stock_code, report, error in self.iter_scan(
+                stock_list, market_type, should_stop=should_stop, deadline=deadline):
+            if not error and report['score'] >= min_score:
+                results.append(report)
+            if progress_callback:
+                try:
+                    progress_callback(processed, total, stock_code, report, error)
+                except Exception as e:
+                    logger.warning(f"扫描进度回调出错: {e}")
+
+        logger.info(f"找到 {len(results)} 只符合条件的股票")
+        return results
+
+    def iter_scan(self, stock_list: List[str], market_type: str = 'A',
+                  should_stop: Optional[Callable[[], bool]] = None,
+                  deadline: Optional[float] = None) -> Iterator[Tuple[int, int, str, Optional[Dict], Optional[str]]]:
+        """流式扫描：每只股票的报告一算好就产出 (processed, total, stock_code, report, error)
+
+        A股一组批量取数回来就打分；逐只取数时攒够 batch_size，或者等了 flush_interval 秒也会先算已到的，开头几只不用等整批
+        """
+        stock_list = list(dict.fromkeys(str(code).strip() for code in stock_list if str(code).strip()))
+        total = len(stock_list)
+        processed = 0
+        failed = 0
+        start_time = time.time()
+        self.stats = {'total': total, 'processed': 0, 'failed': 0, 'timed_out': 0,
+                      'cancelled': False, 'elapsed': 0.0, 'timings': {}}
+
+        def finish(stock_code, report, error):
+            nonlocal processed, failed
+            processed += 1
+            if error:
+                failed += 1
+                logger.error(f"分析股票 {stock_code} 时出错: {error}")
+
+            if processed % self.LOG_INTERVAL == 0 or processed == total:
+                elapsed = time.time() - start_time
+                remaining = elapsed / processed * (total - processed)
+                logger.info(
+                    f"已处理 {processed}/{total} 只股票，耗时 {elapsed:.1f}秒，预计剩余 {remaining:.1f}秒")
+            return processed, total, stock_code, report, error
+
+        logger.info(f"开始市场扫描，共 {total} 只股票，并发 {self.max_workers}")
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='scan-fetch')
+        pending = []
+        pending_since = None
+        try:
+            futures, score_at = self._submit_fetches(executor, stock_list, market_type)
+            deadline_at = None if deadline is None else start_time + deadline
+            not_done = set(futures)
+
+            while not_done:
+                if should_stop and should_stop():
+                    logger.info(f"市场扫描被中止，已处理 {processed}/{total} 只股票")
+                    self.stats['cancelled'] = True
+                    pending = []
+                    break
+                timeout = self.POLL_INTERVAL
+                if deadline_at is not None:
+                    timeout = min(timeout, deadline_at - time.time())
+                    if timeout <= 0:
+                        self.stats['timed_out'] = sum(len(futures[future]) for future in not_done)
+                        logger.warning(f"市场扫描超过 {deadline} 秒，放弃 {self.stats['timed_out']} 只未完成的股票")
+                        break
+
+                # 定时醒来检查中止和截止时间，不会卡在一个慢请求上
+                done, not_done = wait(not_done, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        items = future.result()
+                    except Exception as e:
+                        items = [(code, None, None, str(e)) for code in futures[future]]
+                    for stock_code, df, stock_info, error in items:
+                        if error:
+                            yield finish(stock_code, None, error)
+                        else:
+                            pending.append((stock_code, df, stock_info))
+                            pending_since = pending_since or time.time()
+
+                if pending and (len(pending) >= score_at
+                                or time.time() - pending_since >= self.flush_interval):
+                    for item in self._score_batch(pending, market_type):
+                        yield finish(*item)
+                    pending, pending_since = [], None
+
+            if pending:
+                for item in self._score_batch(pending, market_type):
+                    yield finish(*item)
+        finally:
+            # 中止时丢掉还没开始的任务，正在跑的请求让它自己结束
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.stats.update(processed=processed, failed=failed, elapsed=round(time.time() - start_time, 2))
+            logger.info(f"市场扫描结束，共分析 {processed} 只股票（失败 {failed} 只），"
+                        f"总耗时 {time.time() - start_time:.1f}秒")
+
+    def _score_batch(self, batch, market_type: str) -> List[Tuple[str, Optional[Dict], Optional[str]]]:
+        """CPU阶段：整批拼面板算指标、打分，再逐只生成报告，返回 [(股票代码, 报告, 错误)]"""
+        frames = {code: df for code, df, _ in batch}
+        ready, scores = {}, {}
+        if self.score_processes:
+            try:
+                # 子进程只回传评分和最后两根K线，ready 里是够生成快速报告的小表
+                from app.analysis.process_scoring import score_frames
+                scores, ready = score_frames(frames, self.analyzer.params, max_workers=self.score_processes)
+                scores = scores['total']
+            except Exception as e:
+                logger.warning(f"多进程计算评分失败，改为在扫描线程里计算: {e}")
+                ready, scores = {}, {}
+        if not ready:
+            try:
+                ready = self.analyzer.calculate_indicators_batch(frames)
+                scores = self.analyzer.calculate_score_batch(ready)['total'] if ready else {}
+            except Exception as e:
+                logger.warning(f"批量计算技术指标失败，改为逐只计算: {e}")
+                ready, scores = {}, {}
+
+        results = []
+        for stock_code, df, stock_info in batch:
+            try:
+                if stock_code in ready:
+                    report = self.analyzer.build_quick_report(stock_code, ready[stock_code], stock_info,
+                                                              market_type, indicators_ready=True,
+                                                              score=int(scores[stock_code]))
+                else:
+                    report = self.analyzer.build_quick_report(stock_code, df, stock_info, market_type)
+            except Exception as e:
+                results.append((stock_code, None, str(e)))
+                continue
+            results.append((stock_code, report, None))
+        return results
+
+
+class TopK:
+    """得分最高的 k 份报告（小顶堆），扫描过程中随时能取到排好序的列表"""
+
+    def __init__(self, k: int):
+        self.k = k
+        self._heap: List[Tuple[float, int, Dict]] = []
+        # 同分先到的排前面
+        self._seq = itertools.count()
+
+    def push(self, report: Dict) -> bool:
+        """加入一份报告，返回前 k 名是否有变化"""
+        entry = (report['score'], -next(self._seq), report)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def ranked(self) -> List[Dict]:
+        return [report for _, _, report in sorted(self._heap, key=lambda e: e[:2], reverse=True)]
+
+    def __len__(self) -> int:
+        return len(self._heap)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+批量评分 - 老王说：一只只 if/elif 打分，几百只股票就是几百遍Python循环！
+把每只股票最后几根K线拼成 (行, 股票, 字段) 的数组，评分规则用 np.select 一次算完，
+规则与 StockAnalyzer.calculate_score / calculate_technical_score 逐条对应，结果完全一致。
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 评分用到的字段
+SCORE_FIELDS = ['close', 'MA5', 'MA20', 'MA60', 'Volatility', 'RSI', 'MACD', 'Signal',
+                'MACD_hist', 'BB_upper', 'BB_lower', 'Volume_Ratio', 'ROC']
+
+# 取最后几根K线：最新一根、前一根，以及最近5根的量比
+TAIL_ROWS = 5
+
+SCORE_PARTS = ['trend', 'volatility', 'technical', 'volume', 'momentum']
+TECHNICAL_PARTS = ['trend', 'indicators', 'support_resistance', 'volatility_volume']
+
+# 各市场的因子权重，与 calculate_score 一致
+MARKET_WEIGHTS = {
+    'A': {'trend': 0.30, 'volatility': 0.15, 'technical': 0.25, 'volume': 0.20, 'momentum': 0.10},
+    'US': {'trend': 0.35, 'volatility': 0.10, 'technical': 0.25, 'volume': 0.20, 'momentum': 0.15},
+    'HK': {'trend': 0.30, 'volatility': 0.20, 'technical': 0.25, 'volume': 0.25, 'momentum': 0.10},
+}
+
+# 计算失败时的中性分，与逐只计算一致
+NEUTRAL_SCORE = 50
+
+
+def extract_tail(frames: Dict, rows: int = TAIL_ROWS) -> Tuple[List[str], np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """取每只股票最后 rows 根K线的评分字段
+
+    Returns:
+        (股票代码列表, (rows, N, 字段数) 数组（右对齐，不足补NaN）, 每只股票的K线根数, {字段: 该股票是否有此列})
+    """
+    codes = list(frames)
+    tail = np.full((rows, len(codes), len(SCORE_FIELDS)), np.nan)
+    lengths = np.zeros(len(codes), dtype=int)
+    has_field = {field: np.zeros(len(codes), dtype=bool) for field in SCORE_FIELDS}
+
+    for j, code in enumerate(codes):
+        df = frames[code]
+        if df is None or df.empty:
+            continue
+        lengths[j] = len(df)
+        present = [field for field in SCORE_FIELDS if field in df.columns]
+        values = df[present].iloc[-rows:].to_numpy(dtype=float)
+        for k, field in enumerate(SCORE_FIELDS):
+            if field in present:
+                has_field[field][j] = True
+                tail[rows - len(values):, j, k] = values[:, present.index(field)]
+    return codes, tail, lengths, has_field
+
+
+def _fields(tail: np.ndarray, row: int) -> Dict[str, np.ndarray]:
+    return {field: tail[row, :, k] for k, field in enumerate(SCORE_FIELDS)}
+
+
+def score_panel(tail: np.ndarray, lengths: np.ndarray, has_field: Dict[str, np.ndarray],
+                market_type: str = 'A', earnings_season: bool = False,
+                adjustment: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """批量版 calculate_score
+
+    Args:
+        tail/lengths/has_field: extract_tail 的结果
+        market_type: 市场类型，决定权重
+        earnings_season: 美股是否处于财报季
+        adjustment: 港股按A股联动情况的加减分（每只股票一个值）
+
+    Returns:
+        {'total': 总分, 'trend'/'volatility'/'technical'/'volume'/'momentum': 分项}，均为长度N的整数数组；
+        数据不足或缺字段的股票总分为50、分项为0
+    """
+    latest = _fields(tail, -1)
+    prev = _fields(tail, -2)
+    close, ma5, ma20, ma60 = latest['close'], latest['MA5'], latest['MA20'], latest['MA60']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 1. 趋势评分（最高30分）
+        trend = np.select([(ma5 > ma20) & (ma20 > ma60), ma5 > ma20, ma20 > ma60], [15, 10, 5], 0)
+        trend = trend + 5 * (close > ma5) + 5 * (close > ma20) + 5 * (close > ma60)
+        trend = np.minimum(30, trend)
+
+        # 2. 波动率评分（最高15分），NaN 落到最后的0分
+        vol = latest['Volatility']
+        volatility = np.select([(1.0 <= vol) & (vol <= 2.5), (2.5 < vol) & (vol <= 4.0), vol < 1.0], [15, 10, 5], 0)
+
+        # 3. 技术指标评分（最高25分）
+        rsi = latest['RSI']
+        technical = np.select([(40 <= rsi) & (rsi <= 60),
+                               ((30 <= rsi) & (rsi < 40)) | ((60 < rsi) & (rsi <= 70)),
+                               rsi < 30, rsi > 70], [7, 10, 8, 2], 0)
+        macd, signal, hist = latest['MACD'], latest['Signal'], latest['MACD_hist']
+        technical = technical + np.select([(macd > signal) & (hist > 0), macd > signal,
+                                           (macd < signal) & (hist < 0), hist > prev['MACD_hist']],
+                                          [10, 8, 0, 5], 0)
+        bb_position = (close - latest['BB_lower']) / (latest['BB_upper'] - latest['BB_lower'])
+        technical = technical + np.select([(0.3 <= bb_position) & (bb_position <= 0.7),
+                                           bb_position < 0.2, bb_position > 0.8], [3, 5, 1], 0)
+        technical = np.minimum(25, technical)
+
+        # 4. 成交量评分（最高20分）：最近 min(5, 根数-1) 根的平均量比，按原来的顺序累加
+        count = np.minimum(TAIL_ROWS, lengths - 1)
+        ratio_sum = np.zeros(len(lengths))
+        ratio_index = SCORE_FIELDS.index('Volume_Ratio')
+        for i in range(1, TAIL_ROWS + 1):
+            ratio_sum = ratio_sum + np.where(i <= count, tail[-i, :, ratio_index], 0.0)
+        avg_ratio = ratio_sum / count
+        up = close > prev['close']
+        down = close < prev['close']
+        volume = np.select([(avg_ratio > 1.5) & up, (avg_ratio > 1.2) & up,
+                            (avg_ratio < 0.8) & down, (avg_ratio > 1.2) & down], [20, 15, 10, 0], 8)
+
+        # 5. 动量评分（最高10分）
+        roc = latest['ROC']
+        momentum = np.select([roc > 5, (2 <= roc) & (roc <= 5), (0 <= roc) & (roc < 2), (-2 <= roc) & (roc < 0)],
+                             [10, 8, 5, 3], 0)
+
+    weights = MARKET_WEIGHTS.get(market_type, MARKET_WEIGHTS['A'])
+    final = (trend * weights['trend'] / 0.30 +
+             volatility * weights['volatility'] / 0.15 +
+             technical * weights['technical'] / 0.25 +
+             volume * weights['volume'] / 0.20 +
+             momentum * weights['momentum'] / 0.10)
+    if market_type == 'US' and earnings_season:
+        final = 0.9 * final + 5
+    elif market_type == 'HK' and adjustment is not None:
+        final = final + adjustment
+    # np.round 与 Python round 一样是四舍六入五成双
+    total = np.clip(np.round(final), 0, 100).astype(int)
+
+    # 逐只计算时会抛异常回落到中性分的情况
+    valid = lengths >= 2
+    for field in SCORE_FIELDS:
+        valid &= has_field[field]
+
+    result = {'total': np.where(valid, total, NEUTRAL_SCORE)}
+    for name, values in zip(SCORE_PARTS, [trend, volatility, technical, volume, momentum]):
+        result[name] = np.where(valid, values, 0).astype(int)
+    return result
+
+
+def technical_score_panel(tail: np.ndarray, lengths: np.ndarray,
+                          has_field: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """批量版 calculate_technical_score
+
+    Returns:
+        {'total', 'trend', 'indicators', 'support_resistance', 'volatility_volume'}，均为长度N的整数数组；
+        数据不足或缺字段的股票全部为0
+    """
+    latest = _fields(tail, -1)
+    prev = _fields(tail, -2)
+    close, ma5, ma20, ma60 = latest['close'], latest['MA5'], latest['MA20'], latest['MA60']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 1. 趋势分析 (0-10分)
+        trend = np.select([(ma5 > ma20) & (ma20 > ma60), (ma5 < ma20) & (ma20 < ma60)],
+                          [5, 0], 3 * (ma5 > ma20) + 2 * (ma20 > ma60))
+        trend = trend + np.select([close > ma5, close > ma20], [3, 2], 0)
+        trend = np.minimum(trend, 10)
+
+        # 2. 技术指标分析 (0-10分)
+        rsi = latest['RSI']
+        indicators = np.select([(40 <= rsi) & (rsi <= 60),
+                                ((30 <= rsi) & (rsi < 40)) | ((60 < rsi) & (rsi <= 70)),
+                                rsi < 30, rsi > 70], [2, 4, 5, 0], 0)
+        indicators = indicators + np.where(latest['MACD'] > latest['Signal'], 3,
+                                           np.where(latest['MACD_hist'] > prev['MACD_hist'], 1, 0))
+        indicators = np.clip(indicators, 0, 10)
+
+        # 3. 支撑压力位分析 (0-10分)
+        upper_distance = (latest['BB_upper'] - close) / close * 100
+        lower_distance = (close - latest['BB_lower']) / close * 100
+        support_resistance = (np.select([lower_distance < 2, lower_distance < 5], [5, 3], 0) +
+                              np.select([upper_distance > 5, upper_distance > 2], [5, 2], 0))
+        support_resistance = np.minimum(support_resistance, 10)
+
+        # 4. 波动性和成交量分析 (0-10分)
+        volatility_volume = np.select([latest['Volatility'] < 2, latest['Volatility'] < 4], [3, 2], 0)
+        ratio = latest['Volume_Ratio']
+        up = close > prev['close']
+        down = close < prev['close']
+        volume_part = np.select([(ratio > 1.5) & up, (ratio < 0.8) & down, (ratio > 1) & up], [4, 3, 2], 0)
+        # 没有量比列的股票不计成交量分
+        volatility_volume = volatility_volume + np.where(has_field['Volume_Ratio'], volume_part, 0)
+        volatility_volume = np.minimum(volatility_volume, 10)
+
+    valid = lengths >= 2
+    for field in SCORE_FIELDS:
+        if field not in ('Volume_Ratio', 'ROC'):
+            valid &= has_field[field]
+
+    parts = [trend, indicators, support_resistance, volatility_volume]
+    result = {name: np.where(valid, values, 0).astype(int) for name, values in zip(TECHNICAL_PARTS, parts)}
+    result['total'] = sum(result[name] for name in TECHNICAL_PARTS)
+    return result
@@ -19,6 +19,7 @@ import logging
 import math
 import json
 import threading
+from collections import OrderedDict
 from urllib.parse import urlparse
 from openai import OpenAI
 
@@ -60,8 +61,15 @@ class StockAnalyzer:
             'atr_period': 14
         }
 
-        # 添加缓存初始化
-        self.data_cache = {}
+        # 数据缓存：全进程共用、有内存上限的缓存里的一个命名空间，配置了共享缓存时各 worker 共用
+        from app.core.cache import get_cache
+        self.data_cache = get_cache().namespace('stock', ttl=86400, shared=True)
+
+        # 增量指标状态，盘中刷新时不必重算整段历史；按 (股票, 市场, 交易日, 历史起点) 存，
+        # 换了交易日的自动淘汰，总数超过 INDICATOR_STATE_MAX 时淘汰最久没用的
+        self._indicator_states = OrderedDict()
+        self._indicator_lock = threading.Lock()
+        self.indicator_state_max = int(os.getenv('INDICATOR_STATE_MAX', '500'))
 
         # JSON匹配标志
         self.json_match_flag = True
@@ -73,15 +81,30 @@ class StockAnalyzer:
         """获取股票数据 - 使用DataProvider统一数据层，支持多数据源故障转移"""
         self.logger.info(f"开始获取股票 {stock_code} 数据，市场类型: {market_type}")
 
-        cache_key = f"{stock_code}_{market_type}_{start_date}_{end_date}_price"
-        if cache_key in self.data_cache:
-            return self.data_cache[cache_key].copy()
-
         if start_date is None:
             start_date = (datetime.now() - timedelta(days=365)).strftime('%Y%m%d')
         if end_date is None:
             end_date = datetime.now().strftime('%Y%m%d')
 
+        # A股按区间缓存：1m/3m/1y 等请求共用同一份数据，落在已缓存区间内的直接切片
+        range_cached = market_type == 'A'
+        if range_cached:
+            cache_key = f"{stock_code}_{market_type}_price"
+            request_start, request_end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+            cached = self._get_price_range(cache_key)
+            if cached is not None:
+                cached_df, cached_start, cached_end = cached
+                if cached_start <= request_start and cached_end >= request_end:
+                    return self._slice_by_date(cached_df, request_start, request_end)
+                # 合并区间，下次更大范围的请求也能命中
+                start_date = min(cached_start, request_start).strftime('%Y%m%d')
+                end_date = max(cached_end, request_end).strftime('%Y%m%d')
+        else:
+            cache_key = f"{stock_code}_{market_type}_{start_date}_{end_date}_price"
+            cached = self.data_cache.get(cache_key)
+            if cached is not None:
+                return cached.copy()
+
         try:
             df = None
             if market_type == 'A':
@@ -89,11 +112,11 @@ class StockAnalyzer:
                 df = self.data_provider.get_stock_history(stock_code, start_date, end_date)
             elif market_type == 'HK':
                 # 港股暂时保留akshare直接调用（DataProvider暂不支持）
-                import akshare as ak
+                from app.core.akshare_client import ak
                 df = ak.stock_hk_daily(symbol=stock_code, adjust="qfq")
             elif market_type == 'US':
                 # 美股暂时保留akshare直接调用
-                import akshare as ak
+                from app.core.akshare_client import ak
                 df = ak.stock_us_hist(symbol=stock_code, start_date=start_date, end_date=end_date, adjust="qfq")
             else:
                 raise ValueError(f"不支持的市场类型: {market_type}")
@@ -101,36 +124,20 @@ class StockAnalyzer:
             if df is None or df.empty:
                 raise ValueError("数据源返回了空的DataFrame")
 
-            # 1. 标准化列名（DataProvider已统一，但保留兼容处理）
-            rename_map = {
-                "日期": "date", "开盘": "open", "收盘": "close", "最高": "high",
-                "最低": "low", "成交量": "volume", "成交额": "amount",
-                "trade_date": "date"
-            }
-            df.rename(columns=rename_map, inplace=True)
-
-            # 2. 验证关键列是否存在
-            essential_columns = ['date', 'open', 'close', 'high', 'low', 'volume']
-            missing_cols = [col for col in essential_columns if col not in df.columns]
-            if missing_cols:
-                raise ValueError(f"数据中缺少关键列: {', '.join(missing_cols)}. 可用列: {df.columns.tolist()}")
-
-            # 3. 数据清洗和类型转换
-            df['date'] = pd.to_datetime(df['date'], errors='coerce')
-            df.dropna(subset=['date'], inplace=True)
-
-            for col in ['open', 'close', 'high', 'low', 'volume']:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            df.dropna(subset=essential_columns, inplace=True)
-
-            if df.empty:
+            # A股经DataProvider拿到的已经是标准格式，直接用；港美股直接调akshare的在这里洗一遍
+            from app.core.bar_schema import normalize_bars
+            result, report = normalize_bars(df, f"market:{market_type}")
+            if result is None:
+                raise ValueError(f"数据中缺少关键列: {', '.join(report['missing'])}. 可用列: {df.columns.tolist()}")
+            if result.empty:
                 raise ValueError("数据清洗后DataFrame为空")
 
-            # 4. 排序并返回
-            result = df.sort_values('date').reset_index(drop=True)
-            self.data_cache[cache_key] = result.copy()
-            
+            if range_cached:
+                self._cache_price_range(cache_key, result, start_date, end_date)
+                return self._slice_by_date(result, request_start, request_end)
+
+            # 港美股不在A股日历里，按1小时过期
+            self.data_cache.set(cache_key, result.copy(), ttl=3600)
             return result
 
         except Exception as e:
@@ -138,10 +145,70 @@ class StockAnalyzer:
             # 返回一个空的DataFrame以避免下游崩溃
             return pd.DataFrame()
 
+    def get_stock_data_many(self, stock_codes, market_type='A', start_date=None, end_date=None):
+        """批量获取多只股票的K线，返回 {股票代码: DataFrame}，拿不到数据的不在结果里
+
+        A股先查区间缓存，没命中的交给 DataProvider.get_stock_history_many 一次批量拉完再写回缓存；
+        港美股没有批量接口，逐只走 get_stock_data。
+        """
+        if start_date is None:
+            start_date = (datetime.now() - timedelta(days=365)).strftime('%Y%m%d')
+        if end_date is None:
+            end_date = datetime.now().strftime('%Y%m%d')
+
+        if market_type != 'A':
+            frames = {code: self.get_stock_data(code, market_type, start_date, end_date) for code in stock_codes}
+            return {code: df for code, df in frames.items() if not df.empty}
+
+        from app.core.bar_schema import normalize_bars
+        request_start, request_end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        result, missing = {}, []
+        for code in stock_codes:
+            cached = self._get_price_range(f"{code}_{market_type}_price")
+            if cached is not None and cached[1] <= request_start and cached[2] >= request_end:
+                result[code] = self._slice_by_date(cached[0], request_start, request_end)
+            else:
+                missing.append(code)
+
+        if missing:
+            self.logger.info(f"批量获取 {len(missing)} 只股票K线（缓存命中 {len(result)} 只）")
+            for code, df in self.data_provider.get_stock_history_many(missing, start_date, end_date).items():
+                frame, _ = normalize_bars(df, f"market:{market_type}")
+                if frame is None or frame.empty:
+                    continue
+                self._cache_price_range(f"{code}_{market_type}_price", frame, start_date, end_date)
+                result[code] = self._slice_by_date(frame, request_start, request_end)
+        return {code: result[code] for code in stock_codes if code in result}
+
+    def _cache_price_range(self, cache_key, df, start_date, end_date):
+        """A股K线按区间写进缓存：截止日已收盘定型的区间不过期，含当天的按盘中TTL过期
+
+        直接缓存 DataFrame（共享缓存里走 Arrow 序列化），请求区间记在 attrs 里
+        """
+        frame = df.copy()
+        frame.attrs = {'range_start': pd.Timestamp(start_date).strftime('%Y%m%d'),
+                       'range_end': pd.Timestamp(end_date).strftime('%Y%m%d')}
+        self.data_cache.set(cache_key, frame, ttl=self.data_provider.calendar.cache_ttl(end_date))
+
+    def _get_price_range(self, cache_key):
+        """读区间缓存，返回 (K线, 区间起, 区间止)，没有或格式不对返回 None"""
+        cached = self.data_cache.get(cache_key)
+        if not isinstance(cached, pd.DataFrame) or 'range_start' not in cached.attrs:
+            return None
+        return cached, pd.Timestamp(cached.attrs['range_start']), pd.Timestamp(cached.attrs['range_end'])
+
+    def _slice_by_date(self, df, start, end):
+        """按日期区间切出K线副本"""
+        mask = (df['date'] >= start) & (df['date'] <= end + timedelta(days=1) - timedelta(microseconds=1))
+        sliced = df.loc[mask].reset_index(drop=True)
+        # 缓存区间只属于缓存里那份
+        sliced.attrs = {}
+        return sliced
+
     def get_north_flow_history(self, stock_code, start_date=None, end_date=None):
         """获取单个股票的北向资金历史持股数据"""
         try:
-            import akshare as ak
+            from app.core.akshare_client import ak
 
             # 获取历史持股数据
             if start_date is None and end_date is None:
@@ -276,11 +343,113 @@ class StockAnalyzer:
             self.logger.error(f"计算技术指标时出错: {str(e)}")
             raise
 
+    def update_realtime_indicators(self, stock_code, bar, final=False, market_type='A', history=None):
+        """增量刷新最新一根K线的技术指标，供看板盘中刷新、风险监控使用
+
+        Args:
+            bar: 最新K线字典（open/high/low/close/volume，可带 date，不带按今天算）
+            final: 这根K线是否已收盘，收盘后状态向前推进；盘中价格传 False，下次更新覆盖
+            history: 建状态用的历史K线，不传则取 get_stock_data 的默认区间。
+                EMA 跟起点有关，要和页面上其他K线的指标对得上，就传同一份历史
+
+        Returns:
+            最新一根K线的字段和指标，与把这根K线接到历史后调用 calculate_indicators 的最后一行相同
+        """
+        from app.analysis.incremental_indicators import IncrementalIndicators
+
+        trade_date = pd.Timestamp(bar.get('date') or datetime.now().date()).normalize()
+        history_start = None if history is None or history.empty else pd.Timestamp(history['date'].iloc[0])
+        key = (stock_code, market_type, trade_date, history_start)
+        with self._indicator_lock:
+            state = self._indicator_states.get(key)
+            if state is not None:
+                self._indicator_states.move_to_end(key)
+
+        if state is None:
+            # 拉历史、回放建状态都在锁外做，不挡其他股票
+            df = history if history is not None else self.get_stock_data(stock_code, market_type)
+            if 'date' in df.columns:
+                # 盘中数据源会返回当天未收盘的K线，只用它之前的历史建状态
+                df = df[pd.to_datetime(df['date']) < trade_date]
+            state = IncrementalIndicators.from_history(df, self.params)
+            with self._indicator_lock:
+                state = self._indicator_states.setdefault(key, state)
+                self._evict_indicator_states(trade_date)
+
+        with self._indicator_lock:
+            return state.update(bar, final=final)
+
+    def _evict_indicator_states(self, trade_date):
+        """淘汰之前交易日的状态，再按最久没用的淘汰到上限以内（调用方持有 _indicator_lock）"""
+        for key in [key for key in self._indicator_states if key[2] < trade_date]:
+            del self._indicator_states[key]
+        while len(self._indicator_states) > self.indicator_state_max:
+            self._indicator_states.popitem(last=False)
+
+    def apply_realtime_bar(self, stock_code, df, market_type='A'):
+        """盘中把全市场快照里的最新行情当作今天这根未收盘的K线，接到带指标的K线后面
+
+        指标用增量状态算，不重算整段历史；今天的K线定型后、非交易日、非A股或拿不到行情时原样返回
+
+        Args:
+            df: calculate_indicators 算好指标的K线
+        """
+        from app.core.trading_calendar import INTRADAY, POST_CLOSE
+
+        if market_type != 'A' or df is None or df.empty or 'date' not in df.columns:
+            return df
+        calendar = self.data_provider.calendar
+        today = pd.Timestamp(datetime.now().date())
+        if calendar.session_state() not in (INTRADAY, POST_CLOSE) or calendar.last_settled_day() >= today:
+            return df
+
+        try:
+            quote = self.data_provider.get_spot_quote(stock_code)
+            if not quote or not quote.get('price'):
+                return df
+            bar = {'date': today, 'close': quote['price']}
+            for field in ('open', 'high', 'low', 'volume', 'amount'):
+                value = quote.get(field)
+                bar[field] = quote['price'] if value is None and field in ('open', 'high', 'low') else value
+            if bar['volume'] is None:
+                return df
+
+            history = df[pd.to_datetime(df['date']) < today]
+            row = self.update_realtime_indicators(stock_code, bar, final=False, market_type=market_type,
+                                                  history=history[['date', 'open', 'high', 'low', 'close', 'volume']])
+        except Exception as e:
+            self.logger.warning(f"盘中刷新 {stock_code} 最新K线失败，使用历史K线: {e}")
+            return df
+        return pd.concat([history, pd.DataFrame([row])], ignore_index=True)
+
+    def calculate_indicators_batch(self, frames):
+        """批量计算技术指标，所有股票拼成面板一次算完
+
+        Args:
+            frames: {股票代码: K线DataFrame}，或以股票代码为第一层索引的 MultiIndex DataFrame
+
+        Returns:
+            {股票代码: 带指标的新DataFrame}，与逐只调用 calculate_indicators 结果相同，数据不完整的股票不在其中
+        """
+        from app.analysis.indicator_engine import calculate_panel_indicators
+        return calculate_panel_indicators(frames, self.params)
+
     def calculate_score(self, df, market_type='A'):
         """
         计算股票评分 - 使用时空共振交易系统增强
         根据不同的市场特征调整评分权重和标准
         """
+        score_details = self.calculate_score_details(df, market_type)
+        # 兼容旧用法：分项评分仍挂在实例上，并发场景请直接用 calculate_score_details 的返回值
+        self.score_details = score_details
+        return score_details['total']
+
+    def calculate_score_details(self, df, market_type='A'):
+        """计算股票评分及分项，不修改实例状态
+
+        Returns:
+            {'trend', 'volatility', 'technical', 'volume', 'momentum', 'total'}，出错时只有 total=50
+        """
         try:
             score = 0
             latest = df.iloc[-1]
@@ -474,8 +643,8 @@ class StockAnalyzer:
             # Ensure score remains within 0-100 range
             final_score = max(0, min(100, round(final_score)))
 
-            # Store sub-scores for display
-            self.score_details = {
+            # Sub-scores for display
+            return {
                 'trend': trend_score,
                 'volatility': volatility_score,
                 'technical': technical_score,
@@ -484,12 +653,34 @@ class StockAnalyzer:
                 'total': final_score
             }
 
-            return final_score
-
         except Exception as e:
             self.logger.error(f"Error calculating score: {str(e)}")
             # Return neutral score on error
-            return 50
+            return {'total': 50}
+
+    def calculate_score_batch(self, frames, market_type='A'):
+        """批量评分，规则与 calculate_score 相同
+
+        Args:
+            frames: {股票代码: 已计算指标的DataFrame}（如 calculate_indicators_batch 的结果）
+
+        Returns:
+            以股票代码为索引的 DataFrame，列为 total/trend/volatility/technical/volume/momentum
+        """
+        from app.analysis.score_engine import extract_tail, score_panel
+
+        codes, tail, lengths, has_field = extract_tail(frames)
+        adjustment = None
+        if market_type == 'HK':
+            # 港股按A股联动情况加减分
+            sentiment_adjust = 5 if self._get_mainland_market_sentiment() > 0 else -5
+            adjustment = np.array([sentiment_adjust if self._check_a_share_linkage(frames[code]) > 0.7 else 0
+                                   for code in codes])
+        scores = score_panel(tail, lengths, has_field, market_type,
+                             earnings_season=market_type == 'US' and self._is_earnings_season(),
+                             adjustment=adjustment)
+        return pd.DataFrame(scores, index=pd.Index(codes, name='stock_code'))[
+            ['total', 'trend', 'volatility', 'technical', 'volume', 'momentum']]
 
     def calculate_position_size(self, stock_code, risk_percent=2.0, stop_loss_percent=5.0):
         """
@@ -768,10 +959,10 @@ class StockAnalyzer:
 
             # 缓存键
             cache_key = f"{stock_code}_{market_type}_news"
-            if cache_key in self.data_cache and (
-                    datetime.now() - self.data_cache[cache_key]['timestamp']).seconds < 3600:
+            cached = self.data_cache.get(cache_key)
+            if cached is not None:
                 # 缓存1小时内的数据
-                return self.data_cache[cache_key]['data']
+                return cached
 
             # 获取股票基本信息
             stock_info = self.get_stock_info(stock_code)
@@ -878,7 +1069,7 @@ class StockAnalyzer:
             news_data['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
             # 缓存结果
-            self.data_cache[cache_key] = {'data': news_data, 'timestamp': datetime.now()}
+            self.data_cache.set(cache_key, news_data, ttl=3600)
             return news_data
 
         except Exception as e:
@@ -964,8 +1155,8 @@ class StockAnalyzer:
             news_data = self.get_stock_news(stock_code, market_type)
 
             # 6. 评分分解
-            score = self.calculate_score(df, market_type)
-            score_details = getattr(self, 'score_details', {'total': score})
+            score_details = self.calculate_score_details(df, market_type)
+            score = score_details['total']
 
             # 7. 获取投资建议
             tech_data = {
@@ -1140,50 +1331,33 @@ class StockAnalyzer:
             raise
 
     # 原有API：保持接口不变
-    def scan_market(self, stock_list, min_score=60, market_type='A'):
-        """扫描市场，寻找符合条件的股票"""
-        recommendations = []
-        total_stocks = len(stock_list)
-
-        self.logger.info(f"开始市场扫描，共 {total_stocks} 只股票")
-        start_time = time.time()
-        processed = 0
-
-        # 批量处理，减少日志输出
-        batch_size = 10
-        for i in range(0, total_stocks, batch_size):
-            batch = stock_list[i:i + batch_size]
-            batch_results = []
-
-            for stock_code in batch:
-                try:
-                    # 使用简化版分析以加快速度
-                    report = self.quick_analyze_stock(stock_code, market_type)
-                    if report['score'] >= min_score:
-                        batch_results.append(report)
-                except Exception as e:
-                    self.logger.error(f"分析股票 {stock_code} 时出错: {str(e)}")
-                    continue
-
-            # 添加批处理结果
-            recommendations.extend(batch_results)
-
-            # 更新处理进度
-            processed += len(batch)
-            elapsed = time.time() - start_time
-            remaining = (elapsed / processed) * (total_stocks - processed) if processed > 0 else 0
+    def scan_market(self, stock_list, min_score=60, market_type='A', progress_callback=None, should_stop=None,
+                    deadline=None):
+        """扫描市场，寻找符合条件的股票
+
+        Args:
+            progress_callback: 每处理完一只股票回调 (processed, total, stock_code, report, error)
+            should_stop: 返回True时中止扫描，已得到的结果照常返回
+            deadline: 最多等待的秒数，超时未完成的股票放弃
+        """
+        from app.analysis.scan_engine import ScanEngine
 
-            self.logger.info(
-                f"已处理 {processed}/{total_stocks} 只股票，耗时 {elapsed:.1f}秒，预计剩余 {remaining:.1f}秒")
+        engine = ScanEngine(self)
+        recommendations = engine.scan(stock_list, min_score=min_score, market_type=market_type,
+                                      progress_callback=progress_callback, should_stop=should_stop,
+                                      deadline=deadline)
 
         # 按得分排序
         recommendations.sort(key=lambda x: x['score'], reverse=True)
+        return recommendations
 
-        total_time = time.time() - start_time
-        self.logger.info(
-            f"市场扫描完成，共分析 {total_stocks} 只股票，找到 {len(recommendations)} 只符合条件的股票，总耗时 {total_time:.1f}秒")
+    def iter_scan_market(self, stock_list, market_type='A', should_stop=None, deadline=None):
+        """流式扫描市场，每只股票处理完就产出 (processed, total, stock_code, report, error)，
+        出错时 report 为 None；参数含义同 scan_market"""
+        from app.analysis.scan_engine import ScanEngine
 
-        return recommendations
+        return ScanEngine(self).iter_scan(stock_list, market_type=market_type, should_stop=should_stop,
+                                          deadline=deadline)
 
     # def quick_analyze_stock(self, stock_code, market_type='A'):
     #     """快速分析股票，用于市场扫描"""
@@ -1241,65 +1415,78 @@ class StockAnalyzer:
                 self.logger.warning(f"无法为 {stock_code} 获取有效数据，跳过分析。")
                 raise ValueError(f"股票 {stock_code} 的数据为空或无法处理")
 
-            # 计算技术指标
-            df = self.calculate_indicators(df)
-
-            # 简化评分计算
-            score = self.calculate_score(df)
-
-            # 获取最新数据
-            latest = df.iloc[-1]
-            prev = df.iloc[-2] if len(df) > 1 else latest
-
             # 先获取股票信息再生成报告
             try:
                 stock_info = self.get_stock_info(stock_code)
-                stock_name = stock_info.get('股票名称', '未知')
-                industry = stock_info.get('行业', '未知')
-
-                # 添加日志
-                self.logger.info(f"股票 {stock_code} 信息: 名称={stock_name}, 行业={industry}")
             except Exception as e:
                 self.logger.error(f"获取股票 {stock_code} 信息时出错: {str(e)}")
-                stock_name = '未知'
-                industry = '未知'
+                stock_info = {}
 
-            # 生成简化报告
-            report = {
-                'stock_code': stock_code,
-                'stock_name': stock_name,
-                'industry': industry,
-                'analysis_date': datetime.now().strftime('%Y-%m-%d'),
-                'score': score,
-                'price': float(latest['close']),
-                'price_change': float((latest['close'] - prev['close']) / prev['close'] * 100),
-                'ma_trend': 'UP' if latest['MA5'] > latest['MA20'] else 'DOWN',
-                'rsi': float(latest['RSI']),
-                'macd_signal': 'BUY' if latest['MACD'] > latest['Signal'] else 'SELL',
-                'volume_status': 'HIGH' if latest['Volume_Ratio'] > 1.5 else 'NORMAL',
-                'recommendation': self.get_recommendation(score)
-            }
-
-            return report
+            return self.build_quick_report(stock_code, df, stock_info, market_type)
         except Exception as e:
             self.logger.error(f"快速分析股票 {stock_code} 时出错: {str(e)}")
             raise
 
+    def build_quick_report(self, stock_code, df, stock_info=None, market_type='A', indicators_ready=False,
+                           score=None):
+        """根据已获取的K线和股票信息生成快速分析报告（纯计算，不访问数据源）
+
+        Args:
+            indicators_ready: df 已经算好技术指标（如 calculate_indicators_batch 的结果）
+            score: 已经算好的评分（如 calculate_score_batch 的结果）
+        """
+        if df is None or df.empty:
+            raise ValueError(f"股票 {stock_code} 的数据为空或无法处理")
+
+        # 计算技术指标
+        if not indicators_ready:
+            df = self.calculate_indicators(df)
+
+        # 简化评分计算
+        if score is None:
+            score = self.calculate_score_details(df)['total']
+
+        # 获取最新数据
+        latest = df.iloc[-1]
+        prev = df.iloc[-2] if len(df) > 1 else latest
+
+        stock_info = stock_info or {}
+        stock_name = stock_info.get('股票名称', '未知')
+        industry = stock_info.get('行业', '未知')
+
+        # 生成简化报告
+        return {
+            'stock_code': stock_code,
+            'stock_name': stock_name,
+            'industry': industry,
+            'analysis_date': datetime.now().strftime('%Y-%m-%d'),
+            'score': score,
+            'price': float(latest['close']),
+            'price_change': float((latest['close'] - prev['close']) / prev['close'] * 100),
+            'ma_trend': 'UP' if latest['MA5'] > latest['MA20'] else 'DOWN',
+            'rsi': float(latest['RSI']),
+            'macd_signal': 'BUY' if latest['MACD'] > latest['Signal'] else 'SELL',
+            'volume_status': 'HIGH' if latest['Volume_Ratio'] > 1.5 else 'NORMAL',
+            'recommendation': self.get_recommendation(score)
+        }
+
     # ======================== 新增功能 ========================#
 
     def get_stock_info(self, stock_code):
         """获取股票基本信息 - 使用DataProvider统一数据层"""
         cache_key = f"{stock_code}_info"
-        if cache_key in self.data_cache:
-            return self.data_cache[cache_key]
+        cached = self.data_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
         try:
             # 使用DataProvider获取股票信息（自动故障转移）
             info_dict = self.data_provider.get_stock_info(stock_code)
 
-            # 确保基本字段存在
+            # 确保基本字段存在，东财个股信息只有“股票简称”，再不行查全市场快照
             if '股票名称' not in info_dict:
-                info_dict['股票名称'] = info_dict.get('name', '未知')
+                info_dict['股票名称'] = (info_dict.get('name') or info_dict.get('股票简称')
+                                     or self.data_provider.get_stock_name(stock_code) or '未知')
             if '行业' not in info_dict:
                 info_dict['行业'] = info_dict.get('industry', '未知')
             if '地区' not in info_dict:
@@ -1491,19 +1678,42 @@ class StockAnalyzer:
             self.logger.error(f"错误详情: {traceback.format_exc()}")
             return {'total': 0, 'trend': 0, 'indicators': 0, 'support_resistance': 0, 'volatility_volume': 0}
 
-    def perform_enhanced_analysis(self, stock_code, market_type='A'):
-        """执行增强版分析"""
+    def calculate_technical_score_batch(self, frames):
+        """批量技术面评分，规则与 calculate_technical_score 相同
+
+        Returns:
+            以股票代码为索引的 DataFrame，列为 total/trend/indicators/support_resistance/volatility_volume
+        """
+        from app.analysis.score_engine import extract_tail, technical_score_panel
+
+        codes, tail, lengths, has_field = extract_tail(frames)
+        scores = technical_score_panel(tail, lengths, has_field)
+        return pd.DataFrame(scores, index=pd.Index(codes, name='stock_code'))[
+            ['total', 'trend', 'indicators', 'support_resistance', 'volatility_volume']]
+
+    def perform_enhanced_analysis(self, stock_code, market_type='A', progress_callback=None):
+        """执行增强版分析
+
+        Args:
+            progress_callback: 每进入一个分析步骤回调 (进度百分比, 步骤说明)，供任务推送分析进度
+        """
+        def report_step(progress, step):
+            if progress_callback:
+                progress_callback(progress, step)
+
         try:
             # 记录开始时间，便于性能分析
             start_time = time.time()
             self.logger.info(f"开始执行股票 {stock_code} 的增强分析")
 
             # 获取股票数据
+            report_step(10, '正在获取行情数据...')
             df = self.get_stock_data(stock_code, market_type)
             data_time = time.time()
             self.logger.info(f"获取股票数据耗时: {data_time - start_time:.2f}秒")
 
             # 计算技术指标
+            report_step(30, '正在计算技术指标...')
             df = self.calculate_indicators(df)
             indicator_time = time.time()
             self.logger.info(f"计算技术指标耗时: {indicator_time - data_time:.2f}秒")
@@ -1513,19 +1723,22 @@ class StockAnalyzer:
             prev = df.iloc[-2] if len(df) > 1 else latest
 
             # 获取支撑压力位
+            report_step(45, '正在评估支撑压力位和技术面评分...')
             sr_levels = self.identify_support_resistance(df)
 
             # 计算技术面评分
             technical_score = self.calculate_technical_score(df)
 
             # 获取股票信息
+            report_step(55, '正在获取股票信息...')
             stock_info = self.get_stock_info(stock_code)
 
             # 确保technical_score包含必要的字段
             if 'total' not in technical_score:
                 technical_score['total'] = 0
 
-            # 生成增强版报告
+            # 生成增强版报告（AI分析最慢）
+            report_step(60, '正在生成AI分析...')
             enhanced_report = {
                 'basic_info': {
                     'stock_code': stock_code,
@@ -1574,6 +1787,7 @@ class StockAnalyzer:
             }
 
             # 最后检查并修复报告结构
+            report_step(95, '正在整理分析报告...')
             self._validate_and_fix_report(enhanced_report)
 
             # 在函数结束时记录总耗时
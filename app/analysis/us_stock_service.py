@@ -5,7 +5,7 @@
 版本：v2.1.0
 """
 # us_stock_service.py
-import akshare as ak
+from app.core.akshare_client import ak
 import pandas as pd
 import logging
 
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+akshare 统一出口 - 老王说：东财、腾讯、雪球、同花顺、中证指数全在 akshare 后面，各个模块直接 ak.xxx() 猛调，
+一扫描就被上游封，最后报出来的是"所有数据源均不可用"！
+用法：把 `import akshare as ak` 换成 `from app.core.akshare_client import ak`，调用方式不变。
+每次调用先按接口名判断背后是哪个站点，取该站点的令牌（RATE_LIMIT_AKSHARE_<站点>，如 RATE_LIMIT_AKSHARE_EASTMONEY=6/12），
+个别接口还可以再单独限速（RATE_LIMIT_AK_<接口名>，如 RATE_LIMIT_AK_STOCK_ZH_A_SPOT_EM=0.2/1）；
+每个接口的耗时、返回行数、成败和排队时间记在指标里（metrics.py，来源为 akshare:<站点>）。
+"""
+import logging
+from functools import wraps
+from typing import Callable, Dict
+
+import akshare
+
+from .metrics import get_metrics
+from .rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# 没有站点后缀的接口对应的上游
+ENDPOINT_UPSTREAMS = {
+    'stock_zh_a_hist': 'eastmoney',
+    'stock_us_hist': 'eastmoney',
+    'stock_individual_fund_flow': 'eastmoney',
+    'stock_individual_fund_flow_rank': 'eastmoney',
+    'stock_fund_flow_industry': 'ths',
+    'stock_fund_flow_concept': 'ths',
+    'stock_financial_abstract': 'sina',
+    'stock_financial_analysis_indicator': 'sina',
+    'stock_hk_daily': 'sina',
+    'stock_zh_index_daily': 'sina',
+    'stock_info_global_cls': 'cls',
+}
+
+# 接口名后缀对应的上游
+SUFFIX_UPSTREAMS = (
+    ('_em', 'eastmoney'),
+    ('_tx', 'tencent'),
+    ('_xq', 'xueqiu'),
+    ('_ths', 'ths'),
+    ('_sina', 'sina'),
+    ('_csindex', 'csindex'),
+)
+
+
+def upstream_of(func_name: str) -> str:
+    """接口背后的上游站点，认不出来的归到 other"""
+    if func_name in ENDPOINT_UPSTREAMS:
+        return ENDPOINT_UPSTREAMS[func_name]
+    for suffix, upstream in SUFFIX_UPSTREAMS:
+        if func_name.endswith(suffix):
+            return upstream
+    return 'other'
+
+
+class AkshareClient:
+    """akshare 模块的代理：函数调用前先过上游站点和接口两级令牌桶，调用耗时和结果记到指标里"""
+
+    def __init__(self):
+        self._wrappers: Dict[str, Callable] = {}
+
+    def __getattr__(self, name: str):
+        attr = getattr(akshare, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        wrapper = self._wrappers.get(name)
+        if wrapper is None:
+            wrapper = self._wrap(name, attr)
+            self._wrappers[name] = wrapper
+        return wrapper
+
+    def _wrap(self, name: str, func: Callable) -> Callable:
+        source = f"akshare:{upstream_of(name)}"
+
+        @wraps(func)
+        def call(*args, **kwargs):
+            waited = self.throttle(name)
+            get_metrics().observe_queue(source, name, waited)
+            return get_metrics().call(source, name, func, *args, **kwargs)
+
+        return call
+
+    def throttle(self, func_name: str) -> float:
+        """按接口所属站点和接口本身取令牌，返回排队秒数"""
+        limiter = get_rate_limiter()
+        waited = limiter.acquire(f"akshare_{upstream_of(func_name)}")
+        waited += limiter.acquire(f"ak_{func_name}")
+        if waited > 5:
+            logger.info(f"akshare.{func_name} 限流排队 {waited:.1f} 秒")
+        return waited
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """各上游站点下每个接口的调用指标（含限流排队时间）"""
+        return get_metrics().snapshot('akshare:')
+
+
+# 全局单例，各模块 `from app.core.akshare_client import ak` 后当 akshare 用
+ak = AkshareClient()
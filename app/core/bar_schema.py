@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+K线统一格式 - 老王说：列名改一遍、日期转一遍、数字转一遍，每个请求都来一次，缓存命中了还要再洗一遍？
+数据一进门（适配器返回的地方）就洗成标准格式，后面的代码看到标准格式直接用：
+    列：date, open, high, low, close, volume, amount，顺序固定，其他列丢掉
+    类型：date 为 datetime64[ns]（归一到当天0点），其余全是 float64
+    单位：成交量为股，成交额为元（东财日K的成交量是手，适配器里用 volume_to_shares 换算）
+    行：按日期升序、同一天只留最后一条，日期或关键价格缺失的行去掉
+date 仍然是普通列不做索引，指标计算、本地K线仓库、按日期切片和前端都按列来用。
+每次清洗出一份报告（改了哪些列名、丢了多少行、有没有乱序和重复日期），有问题的计入指标。
+适配器在 DataFrame.attrs['source'] 里记下数据是哪个接口给的，本地K线仓库写进元数据。
+"""
+import logging
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# 统一的K线列
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'amount']
+# 必须齐全的列，缺了整份数据不可用
+ESSENTIAL_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+CANONICAL_COLUMNS = ['date'] + BAR_COLUMNS
+
+DATE_DTYPE = np.dtype('datetime64[ns]')
+
+# 兼容各数据源的列名
+RENAME_MAP = {
+    "日期": "date", "开盘": "open", "收盘": "close", "最高": "high",
+    "最低": "low", "成交量": "volume", "成交额": "amount",
+    "trade_date": "date"
+}
+
+# 报告里计入指标的问题
+REPORT_ISSUES = ('invalid_rows', 'duplicates', 'unsorted')
+
+# 一手多少股
+LOT_SIZE = 100
+# 成交均价（成交额/成交量）是收盘价的多少倍时认为成交量单位是手 / 股；只看最近几根，复权对价格影响最小
+LOT_PRICE_RATIO = (50, 200)
+SHARE_PRICE_RATIO = (0.5, 2)
+UNIT_CHECK_BARS = 20
+
+
+def empty_bars() -> pd.DataFrame:
+    """空的标准格式K线"""
+    return pd.DataFrame({'date': np.empty(0, dtype=DATE_DTYPE),
+                         **{col: np.empty(0, dtype='f8') for col in BAR_COLUMNS}})
+
+
+def is_canonical(df: pd.DataFrame) -> bool:
+    """是否已经是标准格式（列、类型、日期升序且不重复），是的话不用再洗"""
+    if list(df.columns) != CANONICAL_COLUMNS or df['date'].dtype != DATE_DTYPE:
+        return False
+    if any(df[col].dtype != np.float64 for col in BAR_COLUMNS):
+        return False
+    return df['date'].is_monotonic_increasing and df['date'].is_unique
+
+
+def normalize_bars(df: Optional[pd.DataFrame],
+                   source: Optional[str] = None) -> Tuple[Optional[pd.DataFrame], Dict]:
+    """把数据源返回的K线洗成标准格式
+
+    Args:
+        df: 数据源返回的原始K线
+        source: 指标里的来源名（如 adapter:akshare），给了就把清洗出的问题计入指标
+
+    Returns:
+        (标准格式K线，关键列缺失时为 None；清洗报告)
+    """
+    report = {'rows_in': 0 if df is None else len(df), 'rows_out': 0, 'renamed': [], 'missing': [],
+              'invalid_rows': 0, 'duplicates': 0, 'unsorted': False}
+    if df is None or df.empty:
+        return empty_bars(), report
+    if is_canonical(df):
+        report['rows_out'] = len(df)
+        return df, report
+
+    renamed = {col: RENAME_MAP[col] for col in df.columns if col in RENAME_MAP}
+    if renamed:
+        df = df.rename(columns=renamed)
+        report['renamed'] = list(renamed)
+    missing = [col for col in ['date'] + ESSENTIAL_COLUMNS if col not in df.columns]
+    if missing:
+        report['missing'] = missing
+        _record(source, report)
+        return None, report
+
+    data = {'date': pd.to_datetime(df['date'], errors='coerce').dt.normalize().to_numpy(dtype=DATE_DTYPE)}
+    for col in BAR_COLUMNS:
+        if col in df.columns:
+            data[col] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype='f8', na_value=np.nan)
+        else:
+            data[col] = np.full(len(df), np.nan)
+    frame = pd.DataFrame(data)
+
+    valid = frame[['date'] + ESSENTIAL_COLUMNS].notna().all(axis=1)
+    report['invalid_rows'] = int((~valid).sum())
+    if report['invalid_rows']:
+        frame = frame[valid]
+    if not frame['date'].is_monotonic_increasing:
+        report['unsorted'] = True
+        frame = frame.sort_values('date', kind='stable')
+    duplicated = frame['date'].duplicated(keep='last')
+    report['duplicates'] = int(duplicated.sum())
+    if report['duplicates']:
+        frame = frame[~duplicated]
+
+    frame = frame.reset_index(drop=True)
+    report['rows_out'] = len(frame)
+    _record(source, report)
+    return frame, report
+
+
+def volume_in_lots(df: pd.DataFrame) -> Optional[bool]:
+    """按成交均价和收盘价的比值判断标准格式K线的成交量单位：True 为手，False 为股，没有成交额等判断不了时返回 None"""
+    tail = df.tail(UNIT_CHECK_BARS)
+    valid = (tail['volume'] > 0) & (tail['amount'] > 0) & (tail['close'] > 0)
+    if not valid.any():
+        return None
+    tail = tail[valid]
+    ratio = float(np.median(tail['amount'] / tail['volume'] / tail['close']))
+    if LOT_PRICE_RATIO[0] <= ratio <= LOT_PRICE_RATIO[1]:
+        return True
+    if SHARE_PRICE_RATIO[0] <= ratio <= SHARE_PRICE_RATIO[1]:
+        return False
+    return None
+
+
+def volume_to_shares(df: pd.DataFrame, lots: bool, source: Optional[str] = None) -> pd.DataFrame:
+    """把标准格式K线的成交量统一成股
+
+    Args:
+        df: 标准格式K线
+        lots: 数据源声明的成交量单位是不是手；成交额能判断出单位时以判断结果为准（akshare 不同版本换算不一致）
+        source: 指标里的来源名，判断结果和声明不一致时计入指标
+    """
+    if df is None or df.empty:
+        return df
+    detected = volume_in_lots(df)
+    if detected is not None and detected != lots:
+        if source:
+            get_metrics().record_event(source, 'bar_schema', 'volume_unit_mismatch')
+        lots = detected
+    return df.assign(volume=df['volume'] * LOT_SIZE) if lots else df
+
+
+def _record(source: Optional[str], report: Dict):
+    if not source:
+        return
+    issues = {key: int(report[key]) for key in REPORT_ISSUES if report[key]}
+    if report['missing']:
+        issues['missing_columns'] = 1
+    if not issues:
+        return
+    metrics = get_metrics()
+    for key, count in issues.items():
+        metrics.record_event(source, 'bar_schema', key, count)
+    logger.debug(f"{source} K线清洗: {report}")
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+本地K线仓库 - 老王说：下过一次的K线就别再去网上扒了！
+每个 (复权类型, 股票代码) 一个列式文件（numpy结构化数组 .npy），读取时内存映射，
+旁边的 .json 元数据记录已覆盖的日期区间和数据来源，DataProvider 只向数据源要缺的那一段。
+多个gunicorn worker、进程重启都共享同一份磁盘数据。
+"""
+import os
+import json
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .bar_schema import BAR_COLUMNS, empty_bars, normalize_bars
+from .trading_calendar import TradingCalendar
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有fcntl，只做进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BAR_DTYPE = np.dtype([('date', 'datetime64[ns]')] + [(col, 'f8') for col in BAR_COLUMNS])
+
+
+def to_timestamp(value) -> pd.Timestamp:
+    """日期统一转为当天0点的Timestamp，支持 20240101 / 2024-01-01 / datetime"""
+    return pd.Timestamp(value).normalize()
+
+
+def format_date(value) -> str:
+    """转为数据源使用的 YYYYMMDD 格式"""
+    return to_timestamp(value).strftime('%Y%m%d')
+
+
+class BarStore:
+    """本地列式K线仓库"""
+
+    def __init__(self, root_dir: Optional[str] = None, calendar=None):
+        """
+        Args:
+            root_dir: 仓库根目录，默认读取环境变量 BAR_STORE_DIR（data/bars）
+            calendar: TradingCalendar，用于判断缺口里有没有交易日；不传则按工作日估算
+        """
+        self.root_dir = Path(root_dir or os.getenv('BAR_STORE_DIR', 'data/bars'))
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.calendar = calendar
+        self._lock = threading.Lock()
+
+    # ========== 路径与元数据 ==========
+
+    @staticmethod
+    def normalize_code(code: str) -> str:
+        """000001.SZ / sz000001 -> 000001"""
+        digits = ''.join(ch for ch in str(code) if ch.isdigit())
+        return digits or str(code)
+
+    def _adjust_dir(self, adjust: str) -> Path:
+        return self.root_dir / (adjust or 'none')
+
+    def _meta_path(self, code: str, adjust: str) -> Path:
+        return self._adjust_dir(adjust) / f"{self.normalize_code(code)}.json"
+
+    def load_meta(self, code: str, adjust: str) -> Optional[dict]:
+        """读取元数据：{'file': 数据文件名, 'start': 覆盖起点, 'end': 覆盖终点, 'rows': 行数,
+        'source': 最近一次写入的数据来源, 'sources': 写入过的所有来源}"""
+        path = self._meta_path(code, adjust)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"K线仓库元数据损坏，忽略: {path} ({e})")
+            return None
+
+    # 数据文件被并发的 write() 换掉时，重新读元数据的次数
+    LOAD_RETRIES = 3
+
+    def _load_array(self, code: str, adjust: str, meta: Optional[dict] = None) -> Optional[np.ndarray]:
+        """内存映射读取数据文件
+
+        没传 meta 时读元数据和打开数据文件之间不加锁，其他线程/进程的 write() 可能正好换了新文件、删了旧文件，
+        这时重新读元数据再打开新文件
+        """
+        reload_meta = meta is None
+        meta = meta or self.load_meta(code, adjust)
+        for _ in range(self.LOAD_RETRIES):
+            if not meta:
+                return None
+            data_path = self._adjust_dir(adjust) / meta['file']
+            try:
+                return np.load(data_path, mmap_mode='r', allow_pickle=False)
+            except FileNotFoundError as e:
+                latest = self.load_meta(code, adjust) if reload_meta else None
+                if not latest or latest.get('file') == meta['file']:
+                    logger.warning(f"K线仓库数据文件不存在，忽略: {data_path} ({e})")
+                    return None
+                meta = latest
+            except (OSError, ValueError) as e:
+                logger.warning(f"K线仓库数据文件读取失败，忽略: {data_path} ({e})")
+                return None
+        return None
+
+    @contextmanager
+    def _write_lock(self, code: str, adjust: str):
+        """进程内 + 跨进程（fcntl）写锁"""
+        lock_dir = self._adjust_dir(adjust)
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            lock_path = lock_dir / f"{self.normalize_code(code)}.lock"
+            with open(lock_path, 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ========== 读 ==========
+
+    def has_data(self, code: str, adjust: str) -> bool:
+        meta = self.load_meta(code, adjust)
+        return bool(meta and meta.get('rows'))
+
+    def coverage(self, code: str, adjust: str) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """已覆盖的日期区间"""
+        meta = self.load_meta(code, adjust)
+        if not meta or not meta.get('start'):
+            return None
+        return to_timestamp(meta['start']), to_timestamp(meta['end'])
+
+    def last_bar_date(self, code: str, adjust: str) -> Optional[pd.Timestamp]:
+        """仓库里最后一根K线的日期"""
+        arr = self._load_array(code, adjust)
+        if arr is None or len(arr) == 0:
+            return None
+        return pd.Timestamp(arr['date'][-1])
+
+    def conflicts(self, code: str, adjust: str, df: pd.DataFrame, rtol: float = 1e-4,
+                  volume_rtol: float = 0.02) -> bool:
+        """新抓的K线与仓库里同日期的数据对不上：收盘价不同（复权因子变了），
+        或者成交量/成交额整体差了倍数（换了数据源，单位不一致）"""
+        new_arr = self.to_bar_array(df)
+        old_arr = self._load_array(code, adjust)
+        if new_arr is None or old_arr is None or not len(new_arr) or not len(old_arr):
+            return False
+
+        _, old_idx, new_idx = np.intersect1d(old_arr['date'], new_arr['date'], return_indices=True)
+        if not len(old_idx):
+            return False
+        old_close = np.asarray(old_arr['close'][old_idx])
+        new_close = new_arr['close'][new_idx]
+        if not np.allclose(old_close, new_close, rtol=rtol, atol=0):
+            return True
+
+        # 成交量、成交额各数据源之间有零头差异，只看同日期比值的中位数
+        for col in ('volume', 'amount'):
+            old_values = np.asarray(old_arr[col][old_idx])
+            new_values = new_arr[col][new_idx]
+            valid = (old_values > 0) & (new_values > 0)
+            if valid.any() and abs(np.median(new_values[valid] / old_values[valid]) - 1) > volume_rtol:
+                return True
+        return False
+
+    def read(self, code: str, adjust: str, start_date=None, end_date=None) -> pd.DataFrame:
+        """按日期区间读取K线，返回标准格式（见 bar_schema.py）"""
+        arr = self._load_array(code, adjust)
+        if arr is None or len(arr) == 0:
+            return empty_bars()
+
+        dates = arr['date']
+        lo = 0 if start_date is None else int(np.searchsorted(dates, to_timestamp(start_date).to_datetime64(), 'left'))
+        hi = len(arr) if end_date is None else int(np.searchsorted(dates, to_timestamp(end_date).to_datetime64(), 'right'))
+        sub = arr[lo:hi]
+
+        return pd.DataFrame({name: np.array(sub[name]) for name in BAR_DTYPE.names})
+
+    def missing_ranges(self, code: str, adjust: str, start_date, end_date) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """计算请求区间里仓库还没覆盖的部分（最多头尾两段），缺口收缩到首尾交易日，不含交易日的缺口忽略"""
+        start, end = to_timestamp(start_date), to_timestamp(end_date)
+        if start > end:
+            return []
+
+        meta = self.load_meta(code, adjust)
+        if not meta or not meta.get('start'):
+            gaps = [(start, end)]
+        else:
+            cov_start, cov_end = to_timestamp(meta['start']), to_timestamp(meta['end'])
+            gaps = []
+            if start < cov_start:
+                gaps.append((start, min(end, cov_start - timedelta(days=1))))
+            if end > cov_end:
+                gaps.append((max(start, cov_end + timedelta(days=1)), end))
+
+        result = []
+        for s, e in gaps:
+            if s > e:
+                continue
+            if self.calendar is not None:
+                days = self.calendar.trading_days(s, e)
+            else:
+                days = pd.bdate_range(s, e)
+            if len(days):
+                result.append((days[0], days[-1]))
+        return result
+
+    # ========== 写 ==========
+
+    def _final_date_limit(self) -> pd.Timestamp:
+        """已定型K线的最晚日期：定型时间（DATA_SETTLE_TIME）之前当天的K线还会变，不能算作已覆盖"""
+        if self.calendar is not None:
+            return self.calendar.last_settled_day()
+        now = datetime.now()
+        today = pd.Timestamp(now.date())
+        if today.dayofweek < 5 and now.time() >= TradingCalendar.SETTLE_TIME:
+            return today
+        return today - pd.offsets.BDay(1)
+
+    def _adjacent(self, left_end: pd.Timestamp, right_start: pd.Timestamp) -> bool:
+        """两个区间之间没有交易日（重叠、相邻或只隔着周末节假日）"""
+        if right_start <= left_end + timedelta(days=1):
+            return True
+        between_start, between_end = left_end + timedelta(days=1), right_start - timedelta(days=1)
+        if self.calendar is not None:
+            return len(self.calendar.trading_days(between_start, between_end)) == 0
+        return len(pd.bdate_range(between_start, between_end)) == 0
+
+    @staticmethod
+    def to_bar_array(df: pd.DataFrame) -> Optional[np.ndarray]:
+        """把数据源返回的DataFrame转换为结构化数组，关键列不全时返回None"""
+        # 适配器返回的已经是标准格式，这里直接搬过去
+        frame, _ = normalize_bars(df)
+        if frame is None:
+            return None
+
+        arr = np.empty(len(frame), dtype=BAR_DTYPE)
+        arr['date'] = frame['date'].to_numpy()
+        for col in BAR_COLUMNS:
+            arr[col] = frame[col].to_numpy()
+        return arr
+
+    def write(self, code: str, adjust: str, df: pd.DataFrame, start_date, end_date) -> bool:
+        """把 [start_date, end_date] 区间抓到的K线合并进仓库
+
+        Returns:
+            False 表示数据不可用（关键列缺失），调用方应直接使用原始数据
+        """
+        new_arr = self.to_bar_array(df)
+        if new_arr is None:
+            logger.warning(f"{code} K线缺少关键列，不写入仓库: {list(df.columns)}")
+            return False
+
+        start, end = to_timestamp(start_date), to_timestamp(end_date)
+        covered_end = min(end, self._final_date_limit())
+
+        with self._write_lock(code, adjust):
+            meta = self.load_meta(code, adjust)
+            old_arr = self._load_array(code, adjust, meta)
+
+            if old_arr is not None and len(old_arr):
+                # 新数据覆盖同日期旧数据
+                keep = ~np.isin(old_arr['date'], new_arr['date'])
+                merged = np.concatenate([np.array(old_arr[keep]), new_arr])
+            else:
+                merged = new_arr
+            merged = merged[np.argsort(merged['date'], kind='stable')]
+
+            # 覆盖区间只在与已有区间相连时合并，避免中间留洞被当成已覆盖
+            if meta and meta.get('start'):
+                cov_start, cov_end = to_timestamp(meta['start']), to_timestamp(meta['end'])
+                if self._adjacent(cov_end, start) and self._adjacent(covered_end, cov_start):
+                    cov_start, cov_end = min(cov_start, start), max(cov_end, covered_end)
+            else:
+                cov_start, cov_end = start, covered_end
+
+            adjust_dir = self._adjust_dir(adjust)
+            file_name = f"{self.normalize_code(code)}.{uuid.uuid4().hex[:12]}.npy"
+            np.save(adjust_dir / file_name, merged, allow_pickle=False)
+
+            has_coverage = cov_start <= cov_end
+            source = df.attrs.get('source')
+            sources = set((meta or {}).get('sources') or [])
+            if source:
+                sources.add(source)
+            new_meta = {
+                'file': file_name,
+                'start': cov_start.strftime('%Y-%m-%d') if has_coverage else None,
+                'end': cov_end.strftime('%Y-%m-%d') if has_coverage else None,
+                'rows': int(len(merged)),
+                'source': source or (meta or {}).get('source'),
+                'sources': sorted(sources),
+                'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            meta_path = self._meta_path(code, adjust)
+            tmp_path = meta_path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(new_meta, f)
+            os.replace(tmp_path, meta_path)
+
+            # 旧文件可能还被其他进程映射着，删不掉就算了
+            if meta and meta.get('file') != file_name:
+                try:
+                    (adjust_dir / meta['file']).unlink()
+                except OSError:
+                    pass
+
+        return True
+
+    def invalidate(self, code: str, adjust: str):
+        """删除某只股票的本地K线（例如复权因子变化后）"""
+        with self._write_lock(code, adjust):
+            meta = self.load_meta(code, adjust)
+            try:
+                self._meta_path(code, adjust).unlink()
+            except OSError:
+                pass
+            if meta:
+                try:
+                    (self._adjust_dir(adjust) / meta['file']).unlink()
+                except OSError:
+                    pass
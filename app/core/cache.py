@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+进程内缓存 - 老王说：每个分析器自己攒一个 dict，查过的股票全往里塞，跑一个月内存就炸了！
+全进程共用一个有上限的缓存：
+    - 按最近最少使用（LRU）淘汰，同时限制条目数和内存字节数（DataFrame 按 memory_usage(deep=True) 算）
+    - 每个命名空间有自己的默认过期时间，写入时也可以单独指定
+    - 线程安全，按命名空间统计命中/未命中/淘汰次数
+分析器通过 get_cache().namespace(...) 拿到一个类 dict 的视图，用法和原来的 data_cache 差不多。
+标了 shared 的命名空间还会读写二级共享缓存（见 shared_cache.py），一个 worker 拉过的数据其他 worker 直接命中。
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .shared_cache import SharedCache, create_shared_cache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """估算对象占用的字节数（只往下看几层，够用就行）"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        size = value.memory_usage(deep=True, index=True)
+        return int(size.sum()) if isinstance(size, pd.Series) else int(size)
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    size = sys.getsizeof(value)
+    if _depth >= 3:
+        return size
+    if isinstance(value, dict):
+        return size + sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return size + sum(estimate_size(item, _depth + 1) for item in value)
+    return size
+
+
+class Cache:
+    """有上限、带过期时间的线程安全 LRU 缓存"""
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 shared: Optional[SharedCache] = None):
+        """
+        Args:
+            max_entries: 最多条目数，默认读 CACHE_MAX_ENTRIES
+            max_bytes: 内存上限（字节），默认读 CACHE_MAX_MB（兆）
+            shared: 二级共享缓存，None 表示只用进程内缓存
+        """
+        self.max_entries = max_entries or int(os.getenv('CACHE_MAX_ENTRIES', '20000'))
+        self.max_bytes = max_bytes or int(float(os.getenv('CACHE_MAX_MB', '512')) * 1024 * 1024)
+        # (命名空间, 键) -> (值, 过期时间戳或None, 字节数)
+        self._data: "OrderedDict[Tuple[str, Hashable], Tuple[Any, Optional[float], int]]" = OrderedDict()
+        self._bytes = 0
+        self._ttls: Dict[str, Optional[float]] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.RLock()
+        self.shared = shared
+        self._shared_namespaces: Set[str] = set()
+
+    def namespace(self, name: str, ttl: Optional[float] = None, shared: bool = False) -> 'CacheNamespace':
+        """获取命名空间视图
+
+        Args:
+            name: 命名空间
+            ttl: 默认过期秒数（None 不过期），可用 CACHE_TTL_<NAME> 覆盖
+            shared: 是否同时读写二级共享缓存
+        """
+        env_ttl = os.getenv(f'CACHE_TTL_{name.upper()}')
+        if env_ttl:
+            ttl = float(env_ttl)
+        with self._lock:
+            self._ttls[name] = ttl
+            self._ns_stats(name)
+            if shared and self.shared is not None:
+                self._shared_namespaces.add(name)
+        return CacheNamespace(self, name)
+
+    # ========== 读写 ==========
+
+    def get(self, namespace: str, key: Hashable, default: Any = None) -> Any:
+        value = self._get_local(namespace, key)
+        if value is not _MISSING:
+            return value
+
+        if namespace in self._shared_namespaces:
+            # 本进程没有，查共享缓存，命中了按剩余有效期回填到本进程
+            value, remaining = self.shared.get(namespace, key)
+            if value is not None:
+                with self._lock:
+                    self._ns_stats(namespace)['shared_hits'] += 1
+                self._set_local(namespace, key, value, remaining)
+                return value
+        return default
+
+    def _get_local(self, namespace: str, key: Hashable) -> Any:
+        with self._lock:
+            stats = self._ns_stats(namespace)
+            entry = self._data.get((namespace, key))
+            if entry is None:
+                stats['misses'] += 1
+                return _MISSING
+            value, expires_at, _ = entry
+            if expires_at is not None and time.time() >= expires_at:
+                self._remove((namespace, key))
+                stats['expirations'] += 1
+                stats['misses'] += 1
+                return _MISSING
+            self._data.move_to_end((namespace, key))
+            stats['hits'] += 1
+            return value
+
+    def set(self, namespace: str, key: Hashable, value: Any, ttl: Optional[float] = _MISSING):
+        """写入；ttl 不传用命名空间默认值，传 None 表示不过期"""
+        if ttl is _MISSING:
+            ttl = self._ttls.get(namespace)
+        self._set_local(namespace, key, value, ttl)
+        if namespace in self._shared_namespaces:
+            self.shared.set(namespace, key, value, ttl)
+
+    def _set_local(self, namespace: str, key: Hashable, value: Any, ttl: Optional[float]):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            logger.debug(f"缓存对象 {namespace}:{key} 大小 {size} 超过上限，不缓存")
+            return
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            full_key = (namespace, key)
+            if full_key in self._data:
+                self._remove(full_key)
+            self._data[full_key] = (value, expires_at, size)
+            self._bytes += size
+            self._evict()
+
+    def contains(self, namespace: str, key: Hashable) -> bool:
+        """是否有未过期的条目（不计入命中统计，也不刷新LRU顺序）"""
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            return entry is not None and (entry[1] is None or time.time() < entry[1])
+
+    def delete(self, namespace: str, key: Hashable) -> bool:
+        if namespace in self._shared_namespaces:
+            self.shared.delete(namespace, key)
+        with self._lock:
+            if (namespace, key) in self._data:
+                self._remove((namespace, key))
+                return True
+            return False
+
+    def clear(self, namespace: Optional[str] = None):
+        """清空某个命名空间（共享缓存里的也一起清），不传则清空全部"""
+        namespaces = list(self._shared_namespaces) if namespace is None else [namespace]
+        for name in namespaces:
+            if name in self._shared_namespaces:
+                self.shared.clear(name)
+        with self._lock:
+            if namespace is None:
+                self._data.clear()
+                self._bytes = 0
+                return
+            for full_key in [k for k in self._data if k[0] == namespace]:
+                self._remove(full_key)
+
+    def keys(self, namespace: str):
+        with self._lock:
+            return [k[1] for k in self._data if k[0] == namespace]
+
+    # ========== 淘汰 ==========
+
+    def _remove(self, full_key):
+        _, _, size = self._data.pop(full_key)
+        self._bytes -= size
+
+    def _evict(self):
+        """超出条目数或内存上限时，先清过期的，再按LRU淘汰"""
+        if len(self._data) <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+        now = time.time()
+        for full_key in [k for k, (_, exp, _) in self._data.items() if exp is not None and now >= exp]:
+            self._remove(full_key)
+            self._ns_stats(full_key[0])['expirations'] += 1
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            full_key = next(iter(self._data))
+            self._remove(full_key)
+            self._ns_stats(full_key[0])['evictions'] += 1
+
+    # ========== 统计 ==========
+
+    def _ns_stats(self, namespace: str) -> Dict[str, int]:
+        return self._stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'shared_hits': 0,
+                                                  'evictions': 0, 'expirations': 0})
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            namespaces = {}
+            for name, stats in self._stats.items():
+                lookups = stats['hits'] + stats['misses']
+                namespaces[name] = {
+                    **stats,
+                    'hit_rate': round(stats['hits'] / lookups, 3) if lookups else None,
+                    'entries': 0,
+                    'bytes': 0,
+                }
+            for (name, _), (_, _, size) in self._data.items():
+                ns = namespaces.setdefault(name, {'entries': 0, 'bytes': 0})
+                ns['entries'] += 1
+                ns['bytes'] += size
+            return {
+                'shared_backend': self.shared.backend.name if self.shared is not None else None,
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'namespaces': namespaces,
+            }
+
+
+class CacheNamespace:
+    """某个命名空间的类 dict 视图"""
+
+    def __init__(self, cache: Cache, name: str):
+        self.cache = cache
+        self.name = name
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self.cache.get(self.name, key, default)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = _MISSING):
+        self.cache.set(self.name, key, value, ttl)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        value = self.cache.get(self.name, key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.cache.delete(self.name, key)
+        return value
+
+    def clear(self):
+        self.cache.clear(self.name)
+
+    def keys(self):
+        return self.cache.keys(self.name)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.cache.contains(self.name, key)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.cache.get(self.name, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.cache.set(self.name, key, value)
+
+    def __delitem__(self, key: Hashable):
+        if not self.cache.delete(self.name, key):
+            raise KeyError(key)
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+
+# 全局单例
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Cache:
+    """获取进程内缓存单例"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = Cache(shared=create_shared_cache())
+    return _cache
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+熔断器 - 老王说：接口挂了还一个劲往上撞，线程全卡死在那儿等超时！
+每个 适配器+方法 一个熔断器：
+    closed    正常放行，连续失败达到阈值就熔断
+    open      直接拒绝，冷却时间到了转半开；冷却时间按熔断次数指数增长并加随机抖动
+    half_open 只放一个探测请求，成功恢复 closed，失败重新 open
+接口正常返回但没数据（新股上市前、停牌）单独计数，不算失败，也不会触发熔断，半开时也不算恢复；
+适配器内部的接口全都报错时要抛异常，不能返回空结果，否则熔断器看不到故障。
+同时记录最近（数量和时间都有上限）的耗时和成败，给路由挑最快最稳的数据源用。
+"""
+import os
+import time
+import random
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """单个 适配器+方法 的熔断器"""
+
+    # 统计只看最近这么多秒内的请求，旧的成败自然过期
+    STATS_WINDOW = 300
+
+    def __init__(self, failure_threshold: Optional[int] = None, recovery_timeout: Optional[float] = None,
+                 max_recovery_timeout: Optional[float] = None, window: int = 50):
+        """
+        Args:
+            failure_threshold: 连续失败多少次熔断，默认读 CIRCUIT_FAILURE_THRESHOLD
+            recovery_timeout: 第一次熔断的冷却秒数，默认读 CIRCUIT_RECOVERY_TIMEOUT
+            max_recovery_timeout: 冷却秒数上限，默认读 CIRCUIT_MAX_RECOVERY_TIMEOUT
+            window: 统计耗时和成功率的最近请求数
+        """
+        self.failure_threshold = failure_threshold or int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+        self.recovery_timeout = recovery_timeout or float(os.getenv('CIRCUIT_RECOVERY_TIMEOUT', '30'))
+        self.max_recovery_timeout = max_recovery_timeout or float(os.getenv('CIRCUIT_MAX_RECOVERY_TIMEOUT', '600'))
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.open_count = 0          # 连续熔断次数，决定冷却时间
+        self.open_until = 0.0
+        self._probe_in_flight = False
+        # 正常返回但没数据的次数（新股上市前、停牌），不算故障
+        self.empty_results = 0
+        # 最近请求 (时间, 是否成功, 耗时)
+        self._history = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """是否放行本次请求（半开时只放一个探测）"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.time() < self.open_until:
+                    return False
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self._history.append((time.time(), True, latency))
+            self.consecutive_failures = 0
+            self.open_count = 0
+            self.state = CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._history.append((time.time(), False, None))
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self._trip()
+
+    def record_empty(self):
+        """数据源正常返回了，只是没有数据：不累计连续失败、不进成败统计
+
+        半开时空结果证明不了数据源已经恢复，保持半开，只放掉探测名额，下一个请求接着探测
+        """
+        with self._lock:
+            self.empty_results += 1
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """放行的请求最后没有执行（比如对冲输掉、排队时被取消），交还半开的探测名额，不然再也没有请求能探测"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _trip(self):
+        """熔断：冷却时间指数退避，乘上 0.8~1.2 的抖动，避免多个 worker 同一时刻一起探测"""
+        self.open_count += 1
+        timeout = min(self.max_recovery_timeout, self.recovery_timeout * (2 ** (self.open_count - 1)))
+        self.open_until = time.time() + timeout * random.uniform(0.8, 1.2)
+        self.state = OPEN
+        self._probe_in_flight = False
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.open_count = 0
+            self.open_until = 0.0
+            self._probe_in_flight = False
+            self.empty_results = 0
+            self._history.clear()
+
+    # ========== 统计 ==========
+
+    def _recent(self):
+        cutoff = time.time() - self.STATS_WINDOW
+        return [item for item in list(self._history) if item[0] >= cutoff]
+
+    @property
+    def samples(self) -> int:
+        return len(self._recent())
+
+    def success_rate(self) -> float:
+        recent = self._recent()
+        return sum(1 for _, ok, _ in recent if ok) / len(recent) if recent else 1.0
+
+    def latency_percentile(self, percentile: float = 50) -> Optional[float]:
+        latencies = [latency for _, ok, latency in self._recent() if ok]
+        return float(np.percentile(latencies, percentile)) if latencies else None
+
+    def cost(self) -> float:
+        """路由用的期望代价：中位耗时 / 成功率，越小越好"""
+        p50 = self.latency_percentile(50)
+        if p50 is None:
+            return float('inf')
+        return p50 / max(self.success_rate(), 0.05)
+
+    def snapshot(self) -> Dict:
+        p50 = self.latency_percentile(50)
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'empty_results': self.empty_results,
+            'retry_in': max(0.0, round(self.open_until - time.time(), 1)) if self.state == OPEN else 0.0,
+            'success_rate': round(self.success_rate(), 3),
+            'p50_latency': round(p50, 3) if p50 is not None else None,
+            'samples': self.samples,
+        }
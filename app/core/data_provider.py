@@ -2,13 +2,26 @@
 """
 统一数据提供层 - 老王说：调数据就找我，别管底下用的啥！
 单例模式，全局共享
+同时提供 asyncio 接口（aget_stock_history、aget_many 等）：阻塞调用丢到有上限的线程池里跑，
+按数据源用信号量控制同时在途的请求数，几十只股票并发拉也不会失控。
 """
+import os
+import asyncio
 import logging
-from typing import List, Dict, Optional
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterable, List, Dict, Optional
 import pandas as pd
 
 from .fallback_manager import FallbackManager
+from .rate_limiter import get_rate_limiter
+from .single_flight import SingleFlight
+from .bar_store import BarStore, format_date
+from .trading_calendar import TradingCalendar
 from ..adapters.akshare_adapter import AkshareAdapter
+from ..adapters.base_adapter import UpstreamError
 from ..adapters.baostock_adapter import BaostockAdapter
 
 logger = logging.getLogger(__name__)
@@ -42,54 +55,274 @@ class DataProvider:
             self.baostock,
         ])
 
+        # 请求合并：同一只股票同样参数的并发请求只打一次数据源
+        self.single_flight = SingleFlight()
+
+        # 交易日历：判断缺口里有没有交易日
+        calendar_path = os.path.join(os.getenv('BAR_STORE_DIR', 'data/bars'), 'trade_dates.json')
+        self.calendar = TradingCalendar(self.get_trade_dates, calendar_path)
+
+        # 本地K线仓库：先读本地，只向数据源要缺的交易日
+        self.bar_store = None
+        if os.getenv('USE_BAR_STORE', 'True').lower() == 'true':
+            try:
+                self.bar_store = BarStore(calendar=self.calendar)
+            except OSError as e:
+                logger.warning(f"本地K线仓库不可用，直接走数据源: {e}")
+
+        # asyncio 接口用的线程池和每个事件循环各自的信号量
+        self._async_executor: Optional[ThreadPoolExecutor] = None
+        self._async_lock = threading.Lock()
+        self._semaphores = weakref.WeakKeyDictionary()
+
         logger.info("DataProvider初始化完成，数据源: akshare(主), baostock(备)")
 
     def get_stock_history(self, code: str, start_date: str, end_date: str,
                           adjust: str = "qfq") -> pd.DataFrame:
-        """获取股票历史K线"""
-        return self.fallback.execute('get_stock_history', code, start_date, end_date, adjust)
+        """获取股票历史K线 - 本地仓库优先，只增量抓缺失的交易日；并发的相同请求合并成一次"""
+        return self.single_flight.do(('get_stock_history', code, start_date, end_date, adjust),
+                                     self._get_stock_history, code, start_date, end_date, adjust)
+
+    def _get_stock_history(self, code: str, start_date: str, end_date: str,
+                           adjust: str = "qfq", fetch: Optional[Callable] = None) -> pd.DataFrame:
+        """get_stock_history 的实际实现
+
+        fetch(code, start_date, end_date, adjust) 用来向数据源要数据，默认走故障转移；
+        批量接口传进来的 fetch 会先用批量拉好的结果
+        """
+        fetch = fetch or partial(self.fallback.execute, 'get_stock_history')
+        if self.bar_store is None:
+            return fetch(code, start_date, end_date, adjust)
+
+        gaps = self.bar_store.missing_ranges(code, adjust, start_date, end_date)
+        for gap_start, gap_end in gaps:
+            fetch_start = self._gap_fetch_start(code, adjust, gap_start)
+            try:
+                df = fetch(code, format_date(fetch_start), format_date(gap_end), adjust)
+            except Exception as e:
+                # 仓库里什么都没有时保持原来的报错行为，有旧数据就先用着
+                if not self.bar_store.has_data(code, adjust):
+                    raise
+                logger.warning(f"{code} 补齐 {format_date(gap_start)}-{format_date(gap_end)} 失败，使用本地数据: {e}")
+                continue
+
+            if fetch_start < gap_start and self.bar_store.conflicts(code, adjust, df):
+                # 除权除息后前复权价格整体变了，或者成交量单位和本地不一致，本地数据作废重新全量抓
+                logger.info(f"{code} 复权价格或成交量与本地K线不一致，重建本地K线")
+                self.bar_store.invalidate(code, adjust)
+                df = self.fallback.execute('get_stock_history', code, start_date, end_date, adjust)
+                if self.bar_store.write(code, adjust, df, start_date, end_date):
+                    break
+                return df
+
+            if not self.bar_store.write(code, adjust, df, fetch_start, gap_end):
+                # 数据格式不认识，退回到不经仓库的老路子
+                if not self.bar_store.has_data(code, adjust) and len(gaps) == 1:
+                    return df
+                return self.fallback.execute('get_stock_history', code, start_date, end_date, adjust)
+
+        df = self.bar_store.read(code, adjust, start_date, end_date)
+        if df.empty:
+            raise Exception(f"{code} 在 {start_date}-{end_date} 没有K线数据")
+        return df
+
+    def _gap_fetch_start(self, code: str, adjust: str, gap_start: pd.Timestamp) -> pd.Timestamp:
+        """缺口实际从哪天开始抓：尾部增量从仓库最后一根K线开始，多出的一根用来核对复权价格有没有变"""
+        coverage = self.bar_store.coverage(code, adjust)
+        if coverage and gap_start > coverage[1]:
+            last_date = self.bar_store.last_bar_date(code, adjust)
+            if last_date is not None and last_date < gap_start:
+                return last_date
+        return gap_start
+
+    def get_stock_history_many(self, codes: Iterable[str], start_date: str, end_date: str,
+                               adjust: str = "qfq") -> Dict[str, pd.DataFrame]:
+        """批量获取多只股票的历史K线
+
+        本地仓库已覆盖的直接读；要向数据源要的按抓取区间分组，每组交给首选数据源的批量接口一次拉完
+        （baostock 一个会话连续查，akshare 有上限的线程池并发拉），批量里没拿到的再逐只走故障转移。
+        结果可以直接交给 calculate_panel_indicators / calculate_indicators_batch 拼面板计算。
+
+        Returns:
+            {股票代码: DataFrame}，顺序同 codes，拿不到数据的股票不在结果里
+        """
+        codes = list(dict.fromkeys(str(code).strip() for code in codes if str(code).strip()))
+
+        # 每只股票要向数据源要的区间，只有一段缺口的才能参与批量（头尾都缺的少见，逐只处理）
+        groups: Dict[tuple, List[str]] = {}
+        for code in codes:
+            if self.bar_store is None:
+                groups.setdefault((start_date, end_date), []).append(code)
+                continue
+            gaps = self.bar_store.missing_ranges(code, adjust, start_date, end_date)
+            if len(gaps) == 1:
+                gap_start, gap_end = gaps[0]
+                fetch_range = (format_date(self._gap_fetch_start(code, adjust, gap_start)), format_date(gap_end))
+                groups.setdefault(fetch_range, []).append(code)
+
+        prefetched: Dict[tuple, pd.DataFrame] = {}
+        for (fetch_start, fetch_end), group in groups.items():
+            try:
+                frames = self.fallback.execute('get_stock_history_many', group, fetch_start, fetch_end, adjust)
+            except Exception as e:
+                logger.warning(f"批量获取 {len(group)} 只股票K线失败，改为逐只获取: {e}")
+                continue
+            for code, df in frames.items():
+                prefetched[(code, fetch_start, fetch_end)] = df
+        if groups:
+            logger.info(f"批量获取K线：{sum(len(g) for g in groups.values())} 只需要向数据源请求，"
+                        f"批量拿到 {len(prefetched)} 只")
+
+        def fetch(code, fetch_start, fetch_end, fetch_adjust):
+            df = prefetched.pop((code, fetch_start, fetch_end), None)
+            if df is not None:
+                return df
+            return self.fallback.execute('get_stock_history', code, fetch_start, fetch_end, fetch_adjust)
+
+        result = {}
+        for code in codes:
+            try:
+                result[code] = self.single_flight.do(('get_stock_history', code, start_date, end_date, adjust),
+                                                     self._get_stock_history, code, start_date, end_date,
+                                                     adjust, fetch)
+            except Exception as e:
+                logger.warning(f"获取 {code} K线失败: {e}")
+        return result
+
+    def get_trade_dates(self) -> List[str]:
+        """获取交易日列表"""
+        return self.fallback.execute('get_trade_dates')
 
     def get_index_stocks(self, index_code: str) -> List[str]:
         """获取指数成分股"""
-        return self.fallback.execute('get_index_stocks', index_code)
+        return self.single_flight.do(('get_index_stocks', index_code), self.fallback.execute, 'get_index_stocks', index_code)
 
     def get_stock_info(self, code: str) -> Dict:
         """获取股票基本信息"""
-        return self.fallback.execute('get_stock_info', code)
+        return self.single_flight.do(('get_stock_info', code), self.fallback.execute, 'get_stock_info', code)
 
     def get_financial_data(self, code: str) -> Dict:
         """获取财务数据"""
-        return self.fallback.execute('get_financial_data', code)
+        return self.single_flight.do(('get_financial_data', code), self.fallback.execute, 'get_financial_data', code)
 
     # ========== akshare专有方法（无baostock备用）==========
 
+    def _akshare_only(self, method_name: str, empty, *args):
+        """没有备用源、不走故障转移的 akshare 方法：上游全挂时记一条警告，按原来的约定返回空值"""
+        try:
+            return getattr(self.akshare, method_name)(*args)
+        except UpstreamError as e:
+            logger.warning(f"akshare {method_name} 失败: {e}")
+            return empty
+
     def get_board_stocks(self, board: str) -> List[str]:
         """获取板块股票列表（仅akshare支持）"""
-        return self.akshare.get_board_stocks(board)
+        return self._akshare_only('get_board_stocks', [], board)
 
     def get_industry_list(self) -> pd.DataFrame:
         """获取行业板块列表（仅akshare支持）"""
-        return self.akshare.get_industry_list()
+        return self._akshare_only('get_industry_list', pd.DataFrame())
 
     def get_industry_stocks(self, industry: str) -> List[str]:
         """获取行业成分股（仅akshare支持）"""
-        return self.akshare.get_industry_stocks(industry)
+        return self.single_flight.do(('get_industry_stocks', industry), self._akshare_only,
+                                     'get_industry_stocks', [], industry)
 
     def get_concept_stocks(self, concept: str) -> List[str]:
         """获取概念板块成分股代码列表"""
-        return self.akshare.get_concept_stocks(concept)
+        return self._akshare_only('get_concept_stocks', [], concept)
 
     def get_concept_stocks_detail(self, concept: str) -> List[Dict]:
         """获取概念板块成分股详细信息（含名称、价格等）"""
-        return self.akshare.get_concept_stocks_detail(concept)
+        return self._akshare_only('get_concept_stocks_detail', [], concept)
+
+    def get_spot_quote(self, code: str) -> Dict:
+        """获取实时行情（全市场快照，仅akshare支持）"""
+        return self.akshare.get_spot_quote(code)
+
+    def get_stock_name(self, code: str) -> Optional[str]:
+        """按代码查股票名称（全市场快照，仅akshare支持）"""
+        return self.akshare.get_stock_name(code)
+
+    def get_latest_price(self, code: str) -> Optional[float]:
+        """按代码查最新价（全市场快照，仅akshare支持）"""
+        return self.akshare.get_latest_price(code)
 
     def get_capital_flow(self, code: str) -> Dict:
         """获取资金流向（仅akshare支持）"""
-        return self.akshare.get_capital_flow(code)
+        return self.single_flight.do(('get_capital_flow', code), self._akshare_only,
+                                     'get_capital_flow', {}, code)
 
     def get_north_flow(self) -> pd.DataFrame:
         """获取北向资金（仅akshare支持）"""
-        return self.akshare.get_north_flow()
+        return self._akshare_only('get_north_flow', pd.DataFrame())
+
+    # ========== asyncio 接口 ==========
+
+    def _get_async_executor(self) -> ThreadPoolExecutor:
+        if self._async_executor is None:
+            with self._async_lock:
+                if self._async_executor is None:
+                    self._async_executor = ThreadPoolExecutor(
+                        max_workers=int(os.getenv('ASYNC_MAX_WORKERS', '16')),
+                        thread_name_prefix='data-async')
+        return self._async_executor
+
+    def _get_semaphore(self, source: str) -> asyncio.Semaphore:
+        """当前事件循环里该数据源的信号量，并发上限读 ASYNC_CONCURRENCY_<数据源>，默认8"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            semaphores = self._semaphores.setdefault(loop, {})
+            if source not in semaphores:
+                limit = int(os.getenv(f'ASYNC_CONCURRENCY_{source.upper()}', '8'))
+                semaphores[source] = asyncio.Semaphore(limit)
+            return semaphores[source]
+
+    def _source_of(self, method_name: str) -> str:
+        """方法实际会打到哪个数据源：有备用的看当前路由，否则就是 akshare"""
+        if hasattr(self.baostock, method_name):
+            return self.fallback.preferred_adapter(method_name) or self.akshare.name
+        return self.akshare.name
+
+    async def arun(self, func: Callable, *args, source: str = 'akshare', **kwargs) -> Any:
+        """在线程池里执行任意阻塞函数，受 source 数据源的并发上限约束"""
+        async with self._get_semaphore(source):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_async_executor(), partial(func, *args, **kwargs))
+
+    async def acall(self, method_name: str, *args, **kwargs) -> Any:
+        """异步调用 DataProvider 的同名方法"""
+        return await self.arun(getattr(self, method_name), *args, source=self._source_of(method_name), **kwargs)
+
+    async def aget_stock_history(self, code: str, start_date: str, end_date: str,
+                                 adjust: str = "qfq") -> pd.DataFrame:
+        """异步获取股票历史K线"""
+        return await self.acall('get_stock_history', code, start_date, end_date, adjust)
+
+    async def aget_stock_info(self, code: str) -> Dict:
+        """异步获取股票基本信息"""
+        return await self.acall('get_stock_info', code)
+
+    async def aget_many(self, method_name: str, arg_list: Iterable, return_exceptions: bool = True) -> List:
+        """并发调用同一个方法，结果顺序与 arg_list 一致
+
+        Args:
+            method_name: DataProvider 方法名，如 'get_stock_history'
+            arg_list: 每次调用的参数，元组按位置参数展开，其他值当作唯一参数
+            return_exceptions: True 时单个失败以异常对象放在结果里，不影响其他调用
+        """
+        calls = [self.acall(method_name, *(args if isinstance(args, tuple) else (args,))) for args in arg_list]
+        return await asyncio.gather(*calls, return_exceptions=return_exceptions)
+
+    @staticmethod
+    def run_coroutine(coro) -> Any:
+        """在同步代码里跑协程；已经身处事件循环中时换一个线程跑，避免嵌套报错"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coro).result()
 
     # ========== 状态管理 ==========
 
@@ -102,7 +335,11 @@ class DataProvider:
 
     def get_status(self) -> Dict:
         """获取数据源状态"""
-        return self.fallback.get_status()
+        status = self.fallback.get_status()
+        status['single_flight'] = self.single_flight.get_stats()
+        status['baostock_session'] = self.baostock.session.get_stats()
+        status['rate_limits'] = get_rate_limiter().get_stats()
+        return status
 
     def reset_status(self):
         """重置数据源状态"""
@@ -1,32 +1,114 @@
 # -*- coding: utf-8 -*-
 """
 故障转移管理器 - 老王说：接口挂了？自动给你换一个！
+每个 适配器+方法 有自己的熔断器，挂掉的直接跳过，冷却后放一个探测请求试水；
+谁最近又快又稳就先用谁（带滞回，不会来回抖）。
+开启对冲请求（HEDGE_REQUESTS）后，只读方法的首选数据源超过它自己的 p95 耗时还没回来，
+就把同样的请求发给备用源，谁先返回有效结果用谁，慢的那个结果直接丢掉。
 """
+import os
 import time
+import random
 import logging
-from typing import List, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Any, Dict, Tuple, Optional
+
 import pandas as pd
 
+from .rate_limiter import get_rate_limiter
+from .metrics import OUTCOME_EMPTY, OUTCOME_ERROR, OUTCOME_SUCCESS, get_metrics, result_rows
+from .circuit_breaker import CircuitBreaker, OPEN
+
 logger = logging.getLogger(__name__)
 
 
+class EmptyResultError(ValueError):
+    """数据源正常返回但没有数据，换下一个数据源试，不计入熔断"""
+
+
 class FallbackManager:
     """故障转移管理器，支持多数据源自动切换"""
 
+    # 至少有这么多次样本才参与按耗时路由
+    MIN_ROUTING_SAMPLES = 5
+    # 备用源的期望代价要低于当前首选的这个比例才换位，避免来回切换
+    ROUTING_HYSTERESIS = 0.7
+    # 单次调用内重试等待的上限（秒）
+    MAX_RETRY_DELAY = 2.0
+
     def __init__(self, adapters: List, max_retries: int = 2, retry_delay: float = 0.5):
         """
         Args:
             adapters: 按优先级排序的适配器列表
             max_retries: 每个适配器最大重试次数
-            retry_delay: 重试间隔（秒）
+            retry_delay: 首次重试间隔（秒），之后指数增长并加抖动
         """
         self.adapters = adapters
         self.max_retries = max_retries
         self.retry_delay = retry_delay
-        # 适配器健康状态
-        self._adapter_status = {a.name: True for a in adapters}
-        # 失败计数
-        self._fail_count = {a.name: 0 for a in adapters}
+        # (适配器名, 方法名) -> 熔断器
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._breakers_lock = threading.Lock()
+        # 每个方法当前的首选适配器（路由滞回用）
+        self._preferred: Dict[str, str] = {}
+
+        # 对冲请求：只对只读、可重复调用的方法开启
+        self.hedge_enabled = os.getenv('HEDGE_REQUESTS', 'False').lower() == 'true'
+        self.hedge_methods = {m.strip() for m in os.getenv(
+            'HEDGE_METHODS', 'get_stock_history,get_stock_info').split(',') if m.strip()}
+        self.hedge_percentile = float(os.getenv('HEDGE_PERCENTILE', '95'))
+        # 样本不够算分位数时的截止时间，以及截止时间的下限（秒）
+        self.hedge_default_delay = float(os.getenv('HEDGE_DEFAULT_DELAY', '3'))
+        self.hedge_min_delay = float(os.getenv('HEDGE_MIN_DELAY', '0.3'))
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._hedge_stats = {'calls': 0, 'hedged': 0, 'hedge_wins': 0}
+
+    def _get_breaker(self, adapter_name: str, method_name: str) -> CircuitBreaker:
+        key = (adapter_name, method_name)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._breakers_lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker())
+        return breaker
+
+    def _route(self, method_name: str) -> List:
+        """按最近表现排序候选适配器：默认按配置优先级，明显更快更稳的才提到前面"""
+        candidates = [a for a in self.adapters if hasattr(a, method_name)]
+        if len(candidates) < 2:
+            return candidates
+
+        by_name = {a.name: a for a in candidates}
+        primary = candidates[0]
+        best = by_name.get(self._preferred.get(method_name), primary)
+        if best is not primary and \
+                self._get_breaker(primary.name, method_name).samples < self.MIN_ROUTING_SAMPLES:
+            # 主数据源的统计已经过期，回到主数据源重新试，不能因为一次故障永远降级
+            best = primary
+        best_breaker = self._get_breaker(best.name, method_name)
+        for adapter in candidates:
+            if adapter is best:
+                continue
+            breaker = self._get_breaker(adapter.name, method_name)
+            if breaker.samples < self.MIN_ROUTING_SAMPLES or best_breaker.samples < self.MIN_ROUTING_SAMPLES:
+                continue
+            if breaker.cost() < best_breaker.cost() * self.ROUTING_HYSTERESIS:
+                best, best_breaker = adapter, breaker
+
+        if self._preferred.get(method_name) not in (None, best.name):
+            logger.info(f"{method_name} 首选数据源切换为 {best.name}")
+        self._preferred[method_name] = best.name
+        return [best] + [a for a in candidates if a is not best]
+
+    def preferred_adapter(self, method_name: str) -> Optional[str]:
+        """当前路由下该方法会先用哪个适配器"""
+        candidates = self._route(method_name)
+        return candidates[0].name if candidates else None
+
+    def _backoff(self, retry: int) -> float:
+        """第 retry 次重试前的等待：指数退避 + 抖动"""
+        delay = min(self.MAX_RETRY_DELAY, self.retry_delay * (2 ** retry))
+        return delay * random.uniform(0.5, 1.0)
 
     def execute(self, method_name: str, *args, **kwargs) -> Any:
         """执行方法，自动故障转移
@@ -41,51 +123,175 @@ class FallbackManager:
         Raises:
             Exception: 所有数据源均不可用时抛出
         """
+        if self._should_hedge(method_name):
+            try:
+                return self._execute_hedged(method_name, args, kwargs)
+            except Exception as e:
+                # 对冲的两路都失败了，走下面的逐个重试流程（熔断器会挡掉已经挂掉的源）
+                logger.warning(f"{method_name} 对冲请求失败，改为逐个重试: {e}")
+
         last_error = None
         tried_adapters = []
+        skipped_adapters = []
 
-        for adapter in self.adapters:
+        for adapter in self._route(method_name):
             adapter_name = adapter.name
-
-            # 跳过已标记为不可用的适配器（但失败次数超过阈值才跳过）
-            if self._fail_count.get(adapter_name, 0) >= 5:
-                continue
-
-            # 检查适配器是否有该方法
-            if not hasattr(adapter, method_name):
-                continue
-
-            tried_adapters.append(adapter_name)
+            breaker = self._get_breaker(adapter_name, method_name)
 
             for retry in range(self.max_retries):
-                try:
-                    method = getattr(adapter, method_name)
-                    result = method(*args, **kwargs)
-
-                    # 检查结果是否有效
-                    if self._is_valid_result(result):
-                        # 成功，重置失败计数
-                        self._fail_count[adapter_name] = 0
-                        self._adapter_status[adapter_name] = True
-                        return result
+                # 熔断中的直接跳过，不再占着线程干等
+                if not breaker.allow_request():
+                    if retry == 0:
+                        skipped_adapters.append(adapter_name)
+                    break
+                if retry == 0:
+                    tried_adapters.append(adapter_name)
 
+                try:
+                    return self._invoke(adapter, breaker, method_name, args, kwargs)
+                except EmptyResultError as e:
+                    # 没数据重试也还是没数据，直接换下一个数据源
+                    last_error = e
+                    logger.debug(f"[{adapter_name}] {method_name} 返回空结果")
+                    break
                 except Exception as e:
                     last_error = e
                     logger.warning(f"[{adapter_name}] {method_name} 失败(重试{retry+1}/{self.max_retries}): {e}")
 
-                    if retry < self.max_retries - 1:
-                        time.sleep(self.retry_delay)
-
-            # 该适配器所有重试都失败了
-            self._fail_count[adapter_name] = self._fail_count.get(adapter_name, 0) + 1
-            logger.warning(f"[{adapter_name}] 失败次数: {self._fail_count[adapter_name]}")
+                if breaker.state == OPEN:
+                    logger.warning(f"[{adapter_name}] {method_name} 连续失败，熔断 {breaker.snapshot()['retry_in']} 秒")
+                    break
+                if retry < self.max_retries - 1:
+                    time.sleep(self._backoff(retry))
 
         # 所有适配器都失败了
-        error_msg = f"所有数据源均不可用 (尝试了: {tried_adapters})"
+        error_msg = f"所有数据源均不可用 (尝试了: {tried_adapters}"
+        if skipped_adapters:
+            error_msg += f", 熔断跳过: {skipped_adapters}"
+        error_msg += ")"
         if last_error:
             error_msg += f", 最后错误: {last_error}"
         raise Exception(error_msg)
 
+    def _invoke(self, adapter, breaker: CircuitBreaker, method_name: str, args: tuple, kwargs: dict) -> Any:
+        """调用一次适配器并记录成败和耗时，结果无效时抛异常"""
+        metrics = get_metrics()
+        source = f"adapter:{adapter.name}"
+        start = time.time()
+        try:
+            # 按数据源限流，并发扫描时不至于把接口打挂
+            metrics.observe_queue(source, method_name, get_rate_limiter().acquire(adapter.name))
+            start = time.time()
+            result = getattr(adapter, method_name)(*args, **kwargs)
+        except Exception as e:
+            breaker.record_failure()
+            metrics.observe(source, method_name, time.time() - start, OUTCOME_ERROR, error=e)
+            raise
+        elapsed = time.time() - start
+        if not self._is_valid_result(result):
+            # 新股上市前、停牌期间本来就没数据，跟接口故障分开计数，不能因此熔断
+            breaker.record_empty()
+            metrics.observe(source, method_name, elapsed, OUTCOME_EMPTY, rows=result_rows(result))
+            raise EmptyResultError(f"{method_name} 返回空结果")
+        breaker.record_success(elapsed)
+        metrics.observe(source, method_name, elapsed, OUTCOME_SUCCESS, rows=result_rows(result))
+        return result
+
+    # ========== 对冲请求 ==========
+
+    def _should_hedge(self, method_name: str) -> bool:
+        if not self.hedge_enabled or method_name not in self.hedge_methods:
+            return False
+        return sum(1 for a in self.adapters if hasattr(a, method_name)) >= 2
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        if self._hedge_executor is None:
+            with self._breakers_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=int(os.getenv('HEDGE_WORKERS', '16')),
+                        thread_name_prefix='hedge')
+        return self._hedge_executor
+
+    def _count_hedge(self, key: str):
+        # 对冲统计在多个请求线程里同时累加，跟熔断器表共用一把锁
+        with self._breakers_lock:
+            self._hedge_stats[key] += 1
+
+    def _hedge_delay(self, adapter_name: str, method_name: str) -> float:
+        """首选源的对冲截止时间：它最近成功请求耗时的 HEDGE_PERCENTILE 分位数"""
+        breaker = self._get_breaker(adapter_name, method_name)
+        delay = None
+        if breaker.samples >= self.MIN_ROUTING_SAMPLES:
+            delay = breaker.latency_percentile(self.hedge_percentile)
+        if delay is None:
+            delay = self.hedge_default_delay
+        return max(self.hedge_min_delay, delay)
+
+    def _execute_hedged(self, method_name: str, args: tuple, kwargs: dict) -> Any:
+        """先发首选源，超过截止时间没回来（或者直接失败）再发备用源，先到的有效结果胜出
+
+        只对冲一次，正常情况下不会多打一倍请求；输掉的请求线程停不下来，结果直接丢弃，
+        但它的耗时和成败照样记进熔断器，给路由和下次的截止时间当样本。
+        """
+        candidates = self._route(method_name)
+        pending = {}
+        launched = []
+
+        def launch() -> bool:
+            while candidates:
+                adapter = candidates.pop(0)
+                breaker = self._get_breaker(adapter.name, method_name)
+                if breaker.allow_request():
+                    future = self._get_hedge_executor().submit(
+                        self._invoke, adapter, breaker, method_name, args, kwargs)
+                    # 还在排队就被取消的请求不会走到 _invoke，得把半开的探测名额还回去
+                    future.add_done_callback(lambda f, b=breaker: b.release_probe() if f.cancelled() else None)
+                    pending[future] = adapter.name
+                    launched.append(adapter.name)
+                    return True
+            return False
+
+        if not launch():
+            raise Exception("所有数据源均在熔断中")
+        self._count_hedge('calls')
+        hedge_at = time.time() + self._hedge_delay(launched[0], method_name)
+        hedged = False
+        last_error = None
+
+        while pending:
+            timeout = None if hedged else max(0.0, hedge_at - time.time())
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # 首选源超过截止时间还没回来，把同样的请求发给备用源
+                hedged = True
+                if launch():
+                    self._count_hedge('hedged')
+                    logger.debug(f"{method_name} {launched[0]} 超时未返回，对冲到 {launched[-1]}")
+                continue
+
+            for future in done:
+                adapter_name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"[{adapter_name}] {method_name} 失败: {e}")
+                    if not hedged:
+                        # 首选源直接失败了，不用等截止时间
+                        hedged = True
+                        if launch():
+                            self._count_hedge('hedged')
+                    continue
+
+                for other in pending:
+                    other.cancel()
+                if adapter_name != launched[0]:
+                    self._count_hedge('hedge_wins')
+                return result
+
+        raise Exception(f"对冲请求均失败 (尝试了: {launched}), 最后错误: {last_error}")
+
     def _is_valid_result(self, result: Any) -> bool:
         """检查结果是否有效"""
         if result is None:
@@ -98,13 +304,34 @@ class FallbackManager:
 
     def reset_status(self):
         """重置所有适配器状态"""
-        for adapter in self.adapters:
-            self._adapter_status[adapter.name] = True
-            self._fail_count[adapter.name] = 0
+        for breaker in list(self._breakers.values()):
+            breaker.reset()
+        self._preferred.clear()
 
     def get_status(self) -> dict:
-        """获取适配器状态"""
+        """获取适配器状态
+
+        status/fail_count 保持原来的含义（按适配器汇总），breakers 为每个方法的熔断和耗时明细
+        """
+        status = {a.name: True for a in self.adapters}
+        fail_count = {a.name: 0 for a in self.adapters}
+        breakers = {}
+        for (adapter_name, method_name), breaker in list(self._breakers.items()):
+            snapshot = breaker.snapshot()
+            breakers[f"{adapter_name}.{method_name}"] = snapshot
+            if snapshot['state'] == OPEN:
+                status[adapter_name] = False
+            fail_count[adapter_name] = max(fail_count.get(adapter_name, 0), snapshot['consecutive_failures'])
+        with self._breakers_lock:
+            hedge_stats = dict(self._hedge_stats)
         return {
-            'status': self._adapter_status.copy(),
-            'fail_count': self._fail_count.copy()
+            'status': status,
+            'fail_count': fail_count,
+            'breakers': breakers,
+            'preferred': dict(self._preferred),
+            'hedge': {
+                'enabled': self.hedge_enabled,
+                'methods': sorted(self.hedge_methods),
+                **hedge_stats,
+            },
         }
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+数据源调用指标 - 老王说：页面慢了光看日志猜是哪个接口拖的？直接看直方图！
+按 来源 + 方法 记录每次调用：
+    耗时直方图（含 p50/p95/p99 估算）、返回行数直方图
+    结果分类：success / empty / error（错误按异常类型计数）
+    内部兜底走的是哪条路（如 akshare 的K线是东财还是腾讯返回的）
+    限流排队时间
+    其他计数事件（如K线清洗时丢掉的行、重复日期，方法名为 bar_schema）
+来源命名：adapter:<适配器>（FallbackManager 调的适配器方法）、akshare:<上游站点>（每个 ak.* 函数）、
+baostock:session（会话线程里的每个查询）、market:<市场>（港美股直接拉的K线清洗情况）。
+每个进程各记各的，gunicorn 多 worker 时 start_publishing() 定期把本进程的原始计数写进 SQLite（METRICS_DB_PATH），
+/api/data_source/metrics 查看时把同一台机器上所有 worker 的计数合并起来；多台机器各看各的。
+worker 重启后旧进程的计数在 METRICS_WORKER_TTL 秒内仍计入合计，之后丢掉。
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 耗时分桶上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 返回行数分桶上限
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000)
+
+OUTCOME_SUCCESS = 'success'
+OUTCOME_EMPTY = 'empty'
+OUTCOME_ERROR = 'error'
+
+
+class Histogram:
+    """固定分桶直方图，分位数按所在分桶的上限估算"""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= target:
+                # 落在最后一个桶（超过最大上限）就用观测到的最大值
+                return round(min(self.bounds[i], self.max) if i < len(self.bounds) else self.max, 4)
+        return round(self.max, 4)
+
+    def snapshot(self) -> Dict:
+        labels = [f"le_{b:g}" for b in self.bounds] + ['inf']
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 3),
+            'avg': round(self.sum / self.count, 4) if self.count else None,
+            'max': round(self.max, 4),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+    def export(self) -> Dict:
+        """原始计数，用来跨进程合并"""
+        return {'counts': list(self.counts), 'count': self.count, 'sum': self.sum, 'max': self.max}
+
+    def merge(self, state: Dict):
+        """合并另一个进程 export() 出来的计数（分桶不同的丢掉）"""
+        if len(state['counts']) != len(self.counts):
+            return
+        self.counts = [a + b for a, b in zip(self.counts, state['counts'])]
+        self.count += state['count']
+        self.sum += state['sum']
+        self.max = max(self.max, state['max'])
+
+
+class CallMetrics:
+    """一个 来源+方法 的全部指标"""
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.rows = Histogram(ROW_BUCKETS)
+        self.queue = Histogram(LATENCY_BUCKETS)
+        self.outcomes = Counter()
+        self.errors = Counter()
+        self.paths = Counter()
+        self.events = Counter()
+        self.last_error: Optional[str] = None
+        self.last_call: Optional[float] = None
+
+    def snapshot(self) -> Dict:
+        result = {'calls': self.latency.count}
+        if self.latency.count:
+            result['outcomes'] = dict(self.outcomes)
+            result['latency'] = self.latency.snapshot()
+        if self.rows.count:
+            result['rows'] = self.rows.snapshot()
+        if self.queue.count:
+            result['queue'] = self.queue.snapshot()
+        if self.errors:
+            result['errors'] = dict(self.errors)
+            result['last_error'] = self.last_error
+        if self.paths:
+            result['paths'] = dict(self.paths)
+        if self.events:
+            result['events'] = dict(self.events)
+        if self.last_call:
+            result['last_call'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.last_call))
+        return result
+
+    def export(self) -> Dict:
+        return {
+            'latency': self.latency.export(), 'rows': self.rows.export(), 'queue': self.queue.export(),
+            'outcomes': dict(self.outcomes), 'errors': dict(self.errors), 'paths': dict(self.paths),
+            'events': dict(self.events), 'last_error': self.last_error, 'last_call': self.last_call,
+        }
+
+    def merge(self, state: Dict):
+        self.latency.merge(state['latency'])
+        self.rows.merge(state['rows'])
+        self.queue.merge(state['queue'])
+        self.outcomes.update(state['outcomes'])
+        self.errors.update(state['errors'])
+        self.paths.update(state['paths'])
+        self.events.update(state['events'])
+        # 最后一次调用和错误取最新的那个进程的
+        if state['last_call'] and (not self.last_call or state['last_call'] > self.last_call):
+            self.last_call = state['last_call']
+            if state['last_error']:
+                self.last_error = state['last_error']
+        elif not self.last_error:
+            self.last_error = state['last_error']
+
+
+def result_rows(result: Any) -> Optional[int]:
+    """返回值的行数，不是表格/列表的返回 None"""
+    if isinstance(result, (pd.DataFrame, pd.Series, list, tuple, dict)):
+        return len(result)
+    rows = getattr(result, 'rows', None)
+    return len(rows) if isinstance(rows, list) else None
+
+
+def outcome_of(result: Any) -> str:
+    """按返回值判断成功还是空结果"""
+    if result is None:
+        return OUTCOME_EMPTY
+    rows = result_rows(result)
+    return OUTCOME_EMPTY if rows == 0 else OUTCOME_SUCCESS
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS worker_metrics (
+    owner TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    state TEXT NOT NULL
+);
+"""
+
+
+class MetricsRegistry:
+    """进程内的调用指标表，可以定期发布到 SQLite 和其他 worker 的合并"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Args:
+            db_path: 多 worker 共用的 SQLite 文件，默认读 METRICS_DB_PATH
+        """
+        self._metrics: Dict[tuple, CallMetrics] = {}
+        self._lock = threading.Lock()
+        self.db_path = Path(db_path or os.getenv('METRICS_DB_PATH', 'data/metrics.db'))
+        self.publish_interval = float(os.getenv('METRICS_PUBLISH_INTERVAL', '15'))
+        self.worker_ttl = float(os.getenv('METRICS_WORKER_TTL', '3600'))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._publisher: Optional[threading.Thread] = None
+        self._schema_ready = False
+
+    def _get(self, source: str, method: str) -> CallMetrics:
+        key = (source, method)
+        metrics = self._metrics.get(key)
+        if metrics is None:
+            metrics = self._metrics[key] = CallMetrics()
+        return metrics
+
+    def observe(self, source: str, method: str, seconds: float, outcome: str,
+                rows: Optional[int] = None, error: Optional[BaseException] = None):
+        """记录一次调用"""
+        with self._lock:
+            metrics = self._get(source, method)
+            metrics.latency.observe(seconds)
+            metrics.outcomes[outcome] += 1
+            metrics.last_call = time.time()
+            if rows is not None:
+                metrics.rows.observe(rows)
+            if error is not None:
+                metrics.errors[type(error).__name__] += 1
+                metrics.last_error = str(error)[:200]
+
+    def observe_result(self, source: str, method: str, seconds: float, result: Any):
+        """按返回值记录一次成功返回的调用（空结果记为 empty）"""
+        self.observe(source, method, seconds, outcome_of(result), rows=result_rows(result))
+
+    def observe_queue(self, source: str, method: str, seconds: float):
+        """记录一次限流/排队等待"""
+        with self._lock:
+            self._get(source, method).queue.observe(seconds)
+
+    def record_path(self, source: str, method: str, path: str):
+        """记录内部兜底最终走的是哪条路"""
+        with self._lock:
+            self._get(source, method).paths[path] += 1
+
+    def record_event(self, source: str, method: str, event: str, count: int = 1):
+        """记录其他需要计数的事件（如K线清洗丢掉的行数）"""
+        with self._lock:
+            self._get(source, method).events[event] += count
+
+    def call(self, source: str, method: str, func, *args, **kwargs) -> Any:
+        """调用 func 并按返回值或异常记录指标"""
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self.observe(source, method, time.monotonic() - start, OUTCOME_ERROR, error=e)
+            raise
+        self.observe_result(source, method, time.monotonic() - start, result)
+        return result
+
+    def snapshot(self, source_prefix: Optional[str] = None) -> Dict[str, Dict[str, Dict]]:
+        """本进程的 {来源: {方法: 指标}}，source_prefix 只看某一类来源（如 akshare:）"""
+        with self._lock:
+            items = [(key, metrics.snapshot()) for key, metrics in self._metrics.items()
+                     if not source_prefix or key[0].startswith(source_prefix)]
+        return _group(items)
+
+    def export(self) -> List[Dict]:
+        """本进程的原始计数 [{'source', 'method', 各项计数}]"""
+        with self._lock:
+            return [{'source': source, 'method': method, **metrics.export()}
+                    for (source, method), metrics in self._metrics.items()]
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    # ========== 多 worker 合并 ==========
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._schema_ready:
+            # 目录不存在时 sqlite3.connect 直接报 unable to open database file
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path), timeout=10)
+        if not self._schema_ready:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def publish(self):
+        """把本进程的原始计数写进共用的 SQLite，顺便删掉早就不更新的 worker"""
+        state = json.dumps(self.export())
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO worker_metrics (owner, updated_at, state) VALUES (?, ?, ?)",
+                             (self.owner, now, state))
+                conn.execute("DELETE FROM worker_metrics WHERE updated_at < ?", (now - self.worker_ttl,))
+        finally:
+            conn.close()
+
+    def start_publishing(self):
+        """启动后台线程，每 METRICS_PUBLISH_INTERVAL 秒发布一次本进程的计数"""
+        if self._publisher is not None or self.publish_interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.publish_interval)
+                try:
+                    self.publish()
+                except Exception as e:
+                    logger.warning(f"发布调用指标失败: {e}")
+
+        self._publisher = threading.Thread(target=run, daemon=True, name='metrics-publisher')
+        self._publisher.start()
+
+    def aggregate(self, source_prefix: Optional[str] = None) -> Dict:
+        """本机所有 worker 合并后的指标
+
+        Returns:
+            {'metrics': {来源: {方法: 指标}}, 'workers': [{'owner', 'updated_at'}], 'owner': 本进程}
+        """
+        self.publish()
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT owner, updated_at, state FROM worker_metrics WHERE updated_at >= ? "
+                                "ORDER BY owner", (time.time() - self.worker_ttl,)).fetchall()
+        finally:
+            conn.close()
+
+        merged: Dict[tuple, CallMetrics] = {}
+        workers = []
+        for owner, updated_at, state in rows:
+            workers.append({'owner': owner,
+                            'updated_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(updated_at))})
+            for item in json.loads(state):
+                if source_prefix and not item['source'].startswith(source_prefix):
+                    continue
+                key = (item['source'], item['method'])
+                merged.setdefault(key, CallMetrics()).merge(item)
+        return {
+            'metrics': _group([(key, metrics.snapshot()) for key, metrics in merged.items()]),
+            'workers': workers,
+            'owner': self.owner,
+        }
+
+
+def _group(items) -> Dict[str, Dict[str, Dict]]:
+    result: Dict[str, Dict[str, Dict]] = {}
+    for (source, method), snapshot in sorted(items):
+        result.setdefault(source, {})[method] = snapshot
+    return result
+
+
+# 全局单例
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """获取全局指标表"""
+    return _metrics
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+限流器 - 老王说：数据源不是你家的，使劲薅会被封IP！
+令牌桶，按数据源名分桶，配置格式：RATE_LIMIT_<名称>=每秒请求数/突发上限，如 RATE_LIMIT_BAOSTOCK=20/20
+akshare 背后的各个站点分别限速（akshare_<站点>，见 akshare_client.py），RATE_LIMIT_AKSHARE 只是可选的总上限。
+"""
+import os
+import time
+import threading
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认限速（每秒请求数, 突发上限），未配置的数据源不限速
+DEFAULT_LIMITS = {
+    'baostock': (20.0, 20),
+    # akshare 背后的上游站点
+    'akshare_eastmoney': (6.0, 12),
+    'akshare_tencent': (8.0, 16),
+    'akshare_sina': (4.0, 8),
+    'akshare_ths': (2.0, 4),
+    'akshare_xueqiu': (2.0, 4),
+    'akshare_csindex': (2.0, 4),
+    'akshare_cls': (1.0, 2),
+    'akshare_other': (4.0, 8),
+}
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            burst: 桶容量（允许的突发请求数）
+        """
+        self.rate = rate
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        # 统计：拿到令牌的次数和累计排队秒数
+        self.acquired = 0
+        self.waited = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> float:
+        """取令牌，不够就排队等
+
+        Returns:
+            排队等待的秒数
+
+        Raises:
+            TimeoutError: 超过timeout仍拿不到令牌
+        """
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    self.acquired += 1
+                    self.waited += now - start
+                    return now - start
+                wait = (tokens - self._tokens) / self.rate
+
+            if timeout is not None and now - start + wait > timeout:
+                raise TimeoutError(f"限流排队超时({timeout}秒)")
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """按名称分桶的限流器"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Optional[TokenBucket]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_limit(name: str) -> Optional[Tuple[float, int]]:
+        """读取某个数据源的限速配置"""
+        env_value = os.getenv(f"RATE_LIMIT_{name.upper()}")
+        if env_value:
+            try:
+                rate, _, burst = env_value.partition('/')
+                rate = float(rate)
+                return (rate, int(burst) if burst else max(1, int(rate))) if rate > 0 else None
+            except ValueError:
+                logger.warning(f"限流配置格式错误，忽略: RATE_LIMIT_{name.upper()}={env_value}")
+        return DEFAULT_LIMITS.get(name)
+
+    def _get_bucket(self, name: str) -> Optional[TokenBucket]:
+        if name not in self._buckets:
+            with self._lock:
+                if name not in self._buckets:
+                    limit = self._load_limit(name)
+                    self._buckets[name] = TokenBucket(*limit) if limit else None
+        return self._buckets[name]
+
+    def configure(self, name: str, rate: float, burst: int):
+        """手动设置限速，rate<=0 表示不限速"""
+        with self._lock:
+            self._buckets[name] = TokenBucket(rate, burst) if rate > 0 else None
+
+    def acquire(self, name: str, timeout: Optional[float] = None) -> float:
+        """按名称取令牌，返回排队秒数；未限速的直接返回0"""
+        bucket = self._get_bucket(name)
+        if bucket is None:
+            return 0.0
+        return bucket.acquire(timeout=timeout)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """各个限速桶的配置、放行次数和排队时间"""
+        with self._lock:
+            buckets = {name: bucket for name, bucket in self._buckets.items() if bucket is not None}
+        return {name: {'rate': bucket.rate, 'burst': bucket.burst, 'acquired': bucket.acquired,
+                       'queue_seconds': round(bucket.waited, 3),
+                       'avg_queue_seconds': round(bucket.waited / bucket.acquired, 3) if bucket.acquired else 0.0}
+                for name, bucket in buckets.items()}
+
+
+# 全局单例
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """获取RateLimiter单例"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+    return _rate_limiter
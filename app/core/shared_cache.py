@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+跨进程共享缓存（二级缓存）- 老王说：gunicorn 起了4个 worker，同一只股票每个 worker 各拉一遍，数据源能不封你？
+进程内缓存没命中时再查这一层，所有 worker 共用：
+    redis  配了 USE_REDIS_CACHE + REDIS_URL 就用 Redis
+    file   本机多进程共用一个目录（SHARED_CACHE_DIR），不装 Redis 也能用，没配 Redis 时默认用它
+DataFrame 优先用 Arrow IPC（zstd 压缩）序列化（DataFrame.attrs 存在 schema 元数据里，值要能转 JSON），
+没装 pyarrow 退回 pickle，其余对象都用 pickle。
+file 后端的过期文件除了读到时删，每隔 SHARED_CACHE_SWEEP_INTERVAL 秒还会在后台扫一遍，
+目录总大小超过 SHARED_CACHE_MAX_MB 时从最久没写的文件删起。
+"""
+import os
+import io
+import json
+import time
+import struct
+import pickle
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow 是可选依赖
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# 序列化格式标记
+_FORMAT_ARROW = b'A'
+_FORMAT_PICKLE = b'P'
+# Arrow schema 元数据里保存 DataFrame.attrs 的键
+_ATTRS_METADATA_KEY = b'stockanal.attrs'
+
+
+def dumps(value: Any) -> bytes:
+    """序列化：DataFrame 走 Arrow IPC，其他走 pickle"""
+    if pa is not None and isinstance(value, pd.DataFrame):
+        try:
+            table = pa.Table.from_pandas(value, preserve_index=True)
+            if value.attrs:
+                metadata = dict(table.schema.metadata or {})
+                metadata[_ATTRS_METADATA_KEY] = json.dumps(value.attrs).encode('utf-8')
+                table = table.replace_schema_metadata(metadata)
+            sink = io.BytesIO()
+            options = pa.ipc.IpcWriteOptions(compression='zstd')
+            with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+            return _FORMAT_ARROW + sink.getvalue()
+        except (pa.ArrowException, TypeError, ValueError):
+            # 混合类型的 object 列 Arrow 不认、attrs 转不了 JSON，都退回 pickle
+            pass
+    return _FORMAT_PICKLE + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data: bytes) -> Any:
+    fmt, payload = data[:1], data[1:]
+    if fmt == _FORMAT_ARROW:
+        if pa is None:
+            raise ValueError("缓存数据是 Arrow 格式，但没有安装 pyarrow")
+        with pa.ipc.open_stream(payload) as reader:
+            attrs = (reader.schema.metadata or {}).get(_ATTRS_METADATA_KEY)
+            df = reader.read_pandas()
+        if attrs:
+            df.attrs = json.loads(attrs)
+        return df
+    if fmt == _FORMAT_PICKLE:
+        return pickle.loads(payload)
+    raise ValueError(f"未知的缓存数据格式: {fmt!r}")
+
+
+class SharedCacheBackend:
+    """共享缓存后端接口：只存取字节串"""
+
+    name = 'base'
+
+    def get(self, key: str) -> Tuple[Optional[bytes], Optional[float]]:
+        """返回 (数据, 剩余有效秒数)，没有时数据为 None，不过期时剩余秒数为 None"""
+        raise NotImplementedError
+
+    def set(self, key: str, data: bytes, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def clear(self, prefix: str):
+        """删除所有以 prefix 开头的键"""
+        raise NotImplementedError
+
+
+class RedisBackend(SharedCacheBackend):
+    """Redis 后端"""
+
+    name = 'redis'
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+
+    def get(self, key: str) -> Tuple[Optional[bytes], Optional[float]]:
+        pipe = self.client.pipeline()
+        pipe.get(key)
+        pipe.pttl(key)
+        data, pttl = pipe.execute()
+        return data, (pttl / 1000.0 if pttl is not None and pttl > 0 else None)
+
+    def set(self, key: str, data: bytes, ttl: Optional[float] = None):
+        if ttl is not None:
+            self.client.set(key, data, px=max(1, int(ttl * 1000)))
+        else:
+            self.client.set(key, data)
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def clear(self, prefix: str):
+        batch = []
+        for key in self.client.scan_iter(match=f"{prefix}*", count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                self.client.delete(*batch)
+                batch = []
+        if batch:
+            self.client.delete(*batch)
+
+
+class FileBackend(SharedCacheBackend):
+    """本地目录后端：同一台机器上的多个 worker 共用
+
+    每个键一个文件，文件头8字节是过期时间戳（0表示不过期），写入先写临时文件再原子替换。
+    写入时顺便检查要不要清理，到点了起一个后台线程 sweep()：删过期文件和残留的临时文件，
+    总大小超过上限时按修改时间从旧到新删到上限的 90%
+    """
+
+    name = 'file'
+    _HEADER = struct.Struct('<d')
+    # 残留多久的临时文件算写入中途崩掉的（秒）
+    STALE_TMP_SECONDS = 3600
+
+    def __init__(self, directory: str, sweep_interval: Optional[float] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            directory: 缓存目录
+            sweep_interval: 后台清理间隔（秒），默认读 SHARED_CACHE_SWEEP_INTERVAL，0 表示不清理
+            max_bytes: 目录总大小上限，默认读 SHARED_CACHE_MAX_MB
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.sweep_interval = float(os.getenv('SHARED_CACHE_SWEEP_INTERVAL', '600')) \
+            if sweep_interval is None else sweep_interval
+        self.max_bytes = max_bytes or int(float(os.getenv('SHARED_CACHE_MAX_MB', '2048')) * 1024 * 1024)
+        # 启动后第一次写入就清理一遍
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        self.last_sweep: Dict = {}
+
+    def _path(self, key: str) -> Path:
+        # 前缀（命名空间）做子目录，方便整体清理
+        app_prefix, namespace, rest = key.split(':', 2)
+        digest = hashlib.sha1(rest.encode('utf-8')).hexdigest()
+        return self.directory / f"{app_prefix}_{namespace}" / f"{digest}.bin"
+
+    def get(self, key: str) -> Tuple[Optional[bytes], Optional[float]]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, None
+        (expires_at,) = self._HEADER.unpack_from(data)
+        if not expires_at:
+            return data[self._HEADER.size:], None
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            path.unlink(missing_ok=True)
+            return None, None
+        return data[self._HEADER.size:], remaining
+
+    def set(self, key: str, data: bytes, ttl: Optional[float] = None):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        expires_at = time.time() + ttl if ttl is not None else 0.0
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(self._HEADER.pack(expires_at))
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._maybe_sweep()
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def clear(self, prefix: str):
+        # 只支持按 “前缀:命名空间:” 整体清理
+        sub = self.directory / prefix.rstrip(':').replace(':', '_')
+        for path in sub.glob('*.bin'):
+            path.unlink(missing_ok=True)
+
+    # ========== 清理 ==========
+
+    def _maybe_sweep(self):
+        if not self.sweep_interval or time.time() < self._next_sweep:
+            return
+        with self._sweep_lock:
+            if time.time() < self._next_sweep:
+                return
+            self._next_sweep = time.time() + self.sweep_interval
+        threading.Thread(target=self.sweep, daemon=True, name='shared-cache-sweep').start()
+
+    def sweep(self) -> Dict:
+        """删过期文件和残留临时文件，总大小超限时从最旧的删起，返回清理统计
+
+        多个 worker 同时清理也没关系，删除都是 missing_ok
+        """
+        now = time.time()
+        stats = {'expired': 0, 'stale_tmp': 0, 'evicted': 0, 'files': 0, 'bytes': 0}
+        alive = []
+        try:
+            for path in self.directory.glob('*/*'):
+                try:
+                    st = path.stat()
+                    if path.suffix == '.tmp':
+                        if now - st.st_mtime > self.STALE_TMP_SECONDS:
+                            path.unlink(missing_ok=True)
+                            stats['stale_tmp'] += 1
+                        continue
+                    with open(path, 'rb') as f:
+                        header = f.read(self._HEADER.size)
+                except FileNotFoundError:
+                    continue
+                (expires_at,) = self._HEADER.unpack(header) if len(header) == self._HEADER.size else (1.0,)
+                if expires_at and expires_at <= now:
+                    path.unlink(missing_ok=True)
+                    stats['expired'] += 1
+                    continue
+                alive.append((st.st_mtime, st.st_size, path))
+
+            total = sum(size for _, size, _ in alive)
+            if total > self.max_bytes:
+                target = self.max_bytes * 0.9
+                for _, size, path in sorted(alive, key=lambda item: item[0]):
+                    if total <= target:
+                        break
+                    path.unlink(missing_ok=True)
+                    total -= size
+                    stats['evicted'] += 1
+            stats['files'] = len(alive) - stats['evicted']
+            stats['bytes'] = total
+        except OSError as e:
+            logger.warning(f"清理共享缓存目录失败: {e}")
+        stats['elapsed'] = round(time.time() - now, 3)
+        self.last_sweep = stats
+        if stats['expired'] or stats['evicted'] or stats['stale_tmp']:
+            logger.info(f"共享缓存清理完成: {stats}")
+        return stats
+
+
+class SharedCache:
+    """带序列化和容错的共享缓存：后端出错一律当未命中，绝不影响主流程"""
+
+    def __init__(self, backend: SharedCacheBackend, key_prefix: str = 'stockanal',
+                 max_ttl: Optional[float] = None):
+        """
+        Args:
+            backend: 存储后端
+            key_prefix: 键前缀，多个应用共用一个 Redis 时区分开
+            max_ttl: 共享层最长保存秒数，默认读 SHARED_CACHE_MAX_TTL，不过期的条目也按它算
+        """
+        self.backend = backend
+        self.key_prefix = key_prefix
+        self.max_ttl = max_ttl or float(os.getenv('SHARED_CACHE_MAX_TTL', '86400'))
+
+    def _key(self, namespace: str, key: Any) -> str:
+        return f"{self.key_prefix}:{namespace}:{key}"
+
+    def get(self, namespace: str, key: Any) -> Tuple[Any, Optional[float]]:
+        """返回 (缓存值, 剩余有效秒数)，没有或出错时缓存值为 None"""
+        try:
+            data, remaining = self.backend.get(self._key(namespace, key))
+            return (loads(data), remaining) if data is not None else (None, None)
+        except Exception as e:
+            logger.debug(f"读取共享缓存 {namespace}:{key} 失败: {e}")
+            return None, None
+
+    def set(self, namespace: str, key: Any, value: Any, ttl: Optional[float] = None):
+        ttl = self.max_ttl if ttl is None else min(ttl, self.max_ttl)
+        try:
+            self.backend.set(self._key(namespace, key), dumps(value), ttl)
+        except Exception as e:
+            logger.debug(f"写入共享缓存 {namespace}:{key} 失败: {e}")
+
+    def delete(self, namespace: str, key: Any):
+        try:
+            self.backend.delete(self._key(namespace, key))
+        except Exception as e:
+            logger.debug(f"删除共享缓存 {namespace}:{key} 失败: {e}")
+
+    def clear(self, namespace: str):
+        try:
+            self.backend.clear(f"{self.key_prefix}:{namespace}:")
+        except Exception as e:
+            logger.warning(f"清理共享缓存 {namespace} 失败: {e}")
+
+
+def create_shared_cache() -> Optional[SharedCache]:
+    """按配置创建共享缓存，SHARED_CACHE_BACKEND 为 redis/file/none；
+    未配置时启用了 Redis 缓存就用 Redis，否则用本机目录（gunicorn 多 worker 默认就能共享），none 才关闭"""
+    backend_name = os.getenv('SHARED_CACHE_BACKEND', '').lower()
+    if not backend_name:
+        use_redis = os.getenv('USE_REDIS_CACHE', 'False').lower() == 'true' and os.getenv('REDIS_URL')
+        backend_name = 'redis' if use_redis else 'file'
+
+    try:
+        if backend_name == 'redis':
+            backend = RedisBackend(os.getenv('REDIS_URL', 'redis://localhost:6379'))
+        elif backend_name == 'file':
+            backend = FileBackend(os.getenv('SHARED_CACHE_DIR', 'data/cache'))
+        else:
+            return None
+    except Exception as e:
+        logger.warning(f"共享缓存({backend_name})不可用，只使用进程内缓存: {e}")
+        return None
+
+    logger.info(f"共享缓存已启用: {backend.name}")
+    return SharedCache(backend)
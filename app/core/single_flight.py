@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+请求合并（single-flight）- 老王说：一千个线程同时要同一只股票的K线，你就给数据源打一千次？
+同一个 key 同一时刻只放一个请求出去，其余调用方等着共享它的结果（异常也一起共享）。
+请求结束就把 key 摘掉，不做缓存，下一次调用照样重新取。
+"""
+import copy
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """按 key 合并并发的相同调用"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """执行 fn(*args, **kwargs)；已有相同 key 在途时直接等它的结果
+
+        跟随者拿到的是结果的副本（DataFrame/dict/list），各自改列、改字段互不影响
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self._stats['shared'] += 1
+
+        if not leader:
+            return self._copy(future.result())
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, 'in_flight': len(self._calls)}
+
+    @staticmethod
+    def _copy(result: Any) -> Any:
+        if isinstance(result, pd.DataFrame):
+            return result.copy()
+        if isinstance(result, (dict, list)):
+            return copy.copy(result)
+        return result
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+全市场行情快照 - 老王说：五千多行的全市场快照，谁要谁下一遍，数据源不封你封谁！
+整张表在内存里放一份，过期（SPOT_SNAPSHOT_TTL 秒）才重新拉，
+板块列表、股票名称、最新价都从这里查，按代码建好索引，查询不用再扫表。
+东财快照的成交量单位是手，get_quote 换算成股，和日K线（bar_schema.py）口径一致。
+"""
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from .bar_schema import LOT_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 板块 -> 代码前缀（与东财分板块行情接口的口径一致）
+BOARD_PREFIXES = {
+    'sh': ('60', '68'),
+    'sz': ('00', '30'),
+    'bj': ('4', '8', '92'),
+    'cyb': ('300', '301'),
+    'kcb': ('688', '689'),
+}
+
+# 快照字段 -> 统一字段名
+QUOTE_FIELDS = {
+    '名称': 'name', '最新价': 'price', '涨跌幅': 'change_percent', '涨跌额': 'change',
+    '成交量': 'volume', '成交额': 'amount', '最高': 'high', '最低': 'low',
+    '今开': 'open', '昨收': 'pre_close', '换手率': 'turnover_rate', '量比': 'volume_ratio',
+    '市盈率-动态': 'pe', '市净率': 'pb', '总市值': 'total_mv', '流通市值': 'circ_mv',
+}
+
+
+class SpotSnapshot:
+    """带过期时间的全市场行情快照"""
+
+    def __init__(self, loader: Callable[[], pd.DataFrame], ttl: Optional[float] = None):
+        """
+        Args:
+            loader: 拉取全市场快照的函数（如 ak.stock_zh_a_spot_em）
+            ttl: 快照有效期（秒），默认读 SPOT_SNAPSHOT_TTL，未配置为60秒
+        """
+        self.loader = loader
+        self.ttl = ttl if ttl is not None else float(os.getenv('SPOT_SNAPSHOT_TTL', '60'))
+        self._table: Optional[pd.DataFrame] = None
+        self._names: Dict[str, str] = {}
+        self._prices: Dict[str, float] = {}
+        self._boards: Dict[str, List[str]] = {}
+        self._updated_at = 0.0
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+
+    # ========== 刷新 ==========
+
+    def _is_fresh(self) -> bool:
+        return self._table is not None and time.time() - self._updated_at < self.ttl
+
+    def _build(self, df: pd.DataFrame):
+        """建索引：代码 -> 行、名称、最新价，以及各板块的代码列表"""
+        df = df.copy()
+        df['代码'] = df['代码'].astype(str).str.zfill(6)
+        df = df.drop_duplicates('代码', keep='last').set_index('代码')
+        codes = df.index.tolist()
+
+        self._table = df
+        self._names = dict(zip(codes, df['名称'].astype(str))) if '名称' in df.columns else {}
+        self._prices = dict(zip(codes, pd.to_numeric(df['最新价'], errors='coerce'))) if '最新价' in df.columns else {}
+        self._boards = {'all': codes}
+        for board, prefixes in BOARD_PREFIXES.items():
+            self._boards[board] = [code for code in codes if code.startswith(prefixes)]
+        self._updated_at = time.time()
+
+    def refresh(self, force: bool = False) -> bool:
+        """过期了就重新拉取，返回当前是否有可用快照
+
+        拉取失败时继续用旧快照；一个TTL内只重试一次，避免故障时每次查询都去撞数据源
+        """
+        if not force and self._is_fresh():
+            return True
+
+        with self._lock:
+            if not force and self._is_fresh():
+                return True
+            if not force and self._table is not None and time.time() - self._last_attempt < self.ttl:
+                return True
+
+            self._last_attempt = time.time()
+            try:
+                df = self.loader()
+                if df is None or df.empty or '代码' not in df.columns:
+                    raise ValueError("快照为空或缺少代码列")
+                self._build(df)
+                logger.info(f"全市场行情快照已刷新，共 {len(self._table)} 只")
+            except Exception as e:
+                if self._table is None:
+                    logger.warning(f"获取全市场行情快照失败: {e}")
+                    return False
+                logger.warning(f"刷新全市场行情快照失败，继续使用 {self.age():.0f} 秒前的快照: {e}")
+            return True
+
+    def age(self) -> float:
+        """快照已存在的秒数，没有快照时返回 inf"""
+        return time.time() - self._updated_at if self._table is not None else float('inf')
+
+    # ========== 查询 ==========
+
+    def get_table(self) -> pd.DataFrame:
+        """整张快照（以6位代码为索引），不可用时返回空表"""
+        if not self.refresh():
+            return pd.DataFrame()
+        return self._table
+
+    def get_board_codes(self, board: str = 'all') -> List[str]:
+        """板块股票代码列表，板块见 BOARD_PREFIXES，'all' 为全部A股"""
+        if not self.refresh():
+            return []
+        return list(self._boards.get(board, []))
+
+    def get_name(self, code: str) -> Optional[str]:
+        if not self.refresh():
+            return None
+        return self._names.get(self._normalize(code))
+
+    def get_price(self, code: str) -> Optional[float]:
+        if not self.refresh():
+            return None
+        price = self._prices.get(self._normalize(code))
+        return None if price is None or pd.isna(price) else float(price)
+
+    def get_quote(self, code: str) -> Dict:
+        """单只股票的实时行情（统一字段名，成交量为股），没有时返回空字典"""
+        if not self.refresh():
+            return {}
+        code = self._normalize(code)
+        table = self._table
+        if code not in table.index:
+            return {}
+        row = table.loc[code]
+        quote = {'code': code}
+        for field, key in QUOTE_FIELDS.items():
+            if field in row.index:
+                value = row[field]
+                if key == 'name':
+                    quote[key] = str(value)
+                else:
+                    value = pd.to_numeric(value, errors='coerce')
+                    quote[key] = None if pd.isna(value) else float(value)
+        if quote.get('volume') is not None:
+            quote['volume'] *= LOT_SIZE
+        return quote
+
+    @staticmethod
+    def _normalize(code: str) -> str:
+        return ''.join(ch for ch in str(code) if ch.isdigit()).zfill(6)
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""
+持久化任务队列 - 老王说：一个请求起一个线程，任务状态放在进程内的 dict 里，
+gunicorn 换个 worker 查状态就 404，重启一次跑了一半的任务全没了！
+任务统一写进 SQLite（TASK_DB_PATH，同一台机器上的所有 worker 共用一个文件）：
+    - 每个进程起固定数量的工作线程（TASK_WORKERS）抢任务，按优先级、提交时间排队，单类任务还能限并发
+    - 同一个任务键（比如同一只股票）排队中/运行中/已完成的任务直接复用，不重复跑
+    - 失败按类型配置的次数延迟重试；进程挂了，心跳超时的任务由其他 worker 接手重跑
+    - 取消只是在库里打个标记，处理函数通过 TaskContext.cancelled() 在任何进程里都能看到
+    - 处理函数可以随时 emit 中间结果（扫描命中的股票、分析步骤），按自增ID追加到事件表，供流式接口增量推送
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+TASK_PENDING = 'pending'
+TASK_RUNNING = 'running'
+TASK_COMPLETED = 'completed'
+TASK_FAILED = 'failed'
+TASK_CANCELLED = 'cancelled'
+
+ACTIVE_STATUSES = (TASK_PENDING, TASK_RUNNING)
+
+# 表里的固定列，其他字段（total/processed/current_stock 等）放在 extra 里
+_COLUMNS = ['id', 'type', 'key', 'status', 'priority', 'progress', 'params', 'result', 'error', 'extra',
+            'attempts', 'max_retries', 'cancel_requested', 'owner', 'available_at', 'heartbeat_at',
+            'created_at', 'updated_at', 'started_at', 'finished_at']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    key TEXT,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    progress INTEGER NOT NULL DEFAULT 0,
+    params TEXT,
+    result TEXT,
+    error TEXT,
+    extra TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_retries INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    available_at REAL NOT NULL DEFAULT 0,
+    heartbeat_at REAL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_queue ON tasks (status, priority, available_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_key ON tasks (type, key);
+CREATE TABLE IF NOT EXISTS task_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_task_events ON task_events (task_id, id);
+"""
+
+
+class TaskCancelledException(Exception):
+    """任务被取消，处理函数抛出它即可安静退出"""
+    pass
+
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class TaskContext:
+    """传给处理函数的任务上下文"""
+
+    # 取消标记的本地缓存时间（秒），扫描每只股票都会查一次，不用每次都读库
+    CANCEL_CHECK_INTERVAL = 1.0
+
+    def __init__(self, queue: 'TaskQueue', task: Dict):
+        self.queue = queue
+        self.task_id = task['id']
+        self.task_type = task['type']
+        self.params = task.get('params') or {}
+        self.attempt = task.get('attempts', 1)
+        self._cancelled = False
+        self._checked_at = 0.0
+
+    def update(self, progress: Optional[int] = None, result: Any = None, **fields):
+        """更新进度/中间结果/其他状态字段"""
+        self.queue.update(self.task_id, progress=progress, result=result, **fields)
+
+    def emit(self, event: str, data: Any = None):
+        """追加一条中间结果事件"""
+        self.queue.emit(self.task_id, event, data)
+
+    def cancelled(self) -> bool:
+        if not self._cancelled and time.time() - self._checked_at >= self.CANCEL_CHECK_INTERVAL:
+            self._checked_at = time.time()
+            self._cancelled = self.queue.is_cancelled(self.task_id)
+        return self._cancelled
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise TaskCancelledException(f"任务 {self.task_id} 已被用户取消")
+
+
+class TaskQueue:
+    """SQLite 持久化任务队列 + 进程内工作线程池"""
+
+    # 没有任务时多久查一次库（其他 worker 提交的任务靠轮询发现）
+    POLL_INTERVAL = 1.0
+    # 心跳间隔（秒）
+    HEARTBEAT_INTERVAL = 30
+
+    def __init__(self, db_path: Optional[str] = None, max_workers: Optional[int] = None,
+                 json_encoder: Optional[type] = None):
+        """
+        Args:
+            db_path: SQLite 文件，默认读 TASK_DB_PATH
+            max_workers: 本进程的工作线程数，默认读 TASK_WORKERS
+            json_encoder: 序列化参数和结果用的 JSONEncoder（结果里可能有 numpy 类型）
+        """
+        self.db_path = Path(db_path or os.getenv('TASK_DB_PATH', 'data/tasks.db'))
+        self.max_workers = max(1, max_workers or int(os.getenv('TASK_WORKERS', '4')))
+        self.default_retries = int(os.getenv('TASK_MAX_RETRIES', '1'))
+        self.retry_delay = float(os.getenv('TASK_RETRY_DELAY', '30'))
+        self.stale_seconds = float(os.getenv('TASK_STALE_SECONDS', '300'))
+        self.json_encoder = json_encoder
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        # 任务类型 -> {'handler', 'priority', 'max_retries', 'concurrency'}
+        self._handlers: Dict[str, Dict] = {}
+        self._running: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        try:
+            # WAL 模式下读写互不阻塞，多个 worker 轮询状态不会卡住写入
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    # ========== 存储 ==========
+
+    @contextmanager
+    def _connect(self, immediate: bool = False):
+        """每次操作一个连接；immediate 时先拿写锁，读-改-写在多进程下也是原子的"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def _dumps(self, value: Any) -> Optional[str]:
+        if value is None:
+            return None
+        return json.dumps(value, ensure_ascii=False, cls=self.json_encoder)
+
+    @staticmethod
+    def _loads(text: Optional[str]) -> Any:
+        return json.loads(text) if text else None
+
+    def _to_task(self, row: sqlite3.Row) -> Dict:
+        task = self._loads(row['extra']) or {}
+        task.update({
+            'id': row['id'],
+            'key': row['key'],
+            'type': row['type'],
+            'status': row['status'],
+            'priority': row['priority'],
+            'progress': row['progress'],
+            'params': self._loads(row['params']) or {},
+            'attempts': row['attempts'],
+            'cancelled': bool(row['cancel_requested']),
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+        })
+        if 'result' in row.keys() and row['result'] is not None:
+            task['result'] = self._loads(row['result'])
+        if row['error'] is not None:
+            task['error'] = row['error']
+        return task
+
+    # ========== 注册与提交 ==========
+
+    def register(self, task_type: str, handler: Callable[[TaskContext], Any], priority: int = 0,
+                 max_retries: Optional[int] = None, concurrency: Optional[int] = None):
+        """注册任务类型
+
+        Args:
+            handler: 处理函数，参数为 TaskContext，返回值作为任务结果（dict 会合并进已有结果）
+            priority: 默认优先级，越大越先执行
+            max_retries: 失败重试次数，默认读 TASK_MAX_RETRIES
+            concurrency: 本进程同时最多跑几个，默认不单独限制，可用 TASK_CONCURRENCY_<TYPE> 覆盖
+        """
+        env_concurrency = os.getenv(f'TASK_CONCURRENCY_{task_type.upper()}')
+        if env_concurrency:
+            concurrency = int(env_concurrency)
+        self._handlers[task_type] = {
+            'handler': handler,
+            'priority': priority,
+            'max_retries': self.default_retries if max_retries is None else max_retries,
+            'concurrency': concurrency,
+        }
+        self._running.setdefault(task_type, 0)
+
+    def submit(self, task_type: str, params: Optional[Dict] = None, key: Optional[str] = None,
+               priority: Optional[int] = None, reuse_completed: bool = True, **fields) -> Tuple[Dict, bool]:
+        """提交任务
+
+        Args:
+            key: 任务键，同类型同键的排队中/运行中任务（reuse_completed 时还有已完成的）直接复用
+            fields: 写进任务的其他状态字段
+
+        Returns:
+            (任务, 是否新建)
+        """
+        options = self._handlers.get(task_type, {})
+        priority = options.get('priority', 0) if priority is None else priority
+        with self._connect(immediate=True) as conn:
+            if key is not None:
+                statuses = ACTIVE_STATUSES + ((TASK_COMPLETED,) if reuse_completed else ())
+                row = conn.execute(
+                    f"SELECT * FROM tasks WHERE type = ? AND key = ? AND status IN ({','.join('?' * len(statuses))}) "
+                    f"AND (status != ? OR result IS NOT NULL) ORDER BY created_at DESC LIMIT 1",
+                    (task_type, key, *statuses, TASK_COMPLETED)).fetchone()
+                if row is not None:
+                    return self._to_task(row), False
+
+            now = _now()
+            task_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO tasks (id, type, key, status, priority, params, extra, max_retries, available_at, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (task_id, task_type, key, TASK_PENDING, priority, self._dumps(params or {}),
+                 self._dumps(fields), options.get('max_retries', self.default_retries), 0, now, now))
+            row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        self._wakeup.set()
+        return self._to_task(row), True
+
+    # ========== 查询与更新 ==========
+
+    def get(self, task_id: str, with_result: bool = True) -> Optional[Dict]:
+        """按ID取任务；with_result=False 时不读结果，轮询进度时省掉大结果的反序列化"""
+        columns = '*' if with_result else ', '.join(c for c in _COLUMNS if c != 'result')
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {columns} FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return self._to_task(row) if row is not None else None
+
+    def emit(self, task_id: str, event: str, data: Any = None):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO task_events (task_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+                         (task_id, event, self._dumps(data), time.time()))
+
+    def get_events(self, task_id: str, after_id: int = 0, limit: int = 500) -> List[Dict]:
+        """取 after_id 之后的事件，按产生顺序返回 [{'id', 'event', 'data'}]"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, event, data FROM task_events WHERE task_id = ? AND id > ? "
+                                "ORDER BY id LIMIT ?", (task_id, after_id, limit)).fetchall()
+        return [{'id': row['id'], 'event': row['event'], 'data': self._loads(row['data'])} for row in rows]
+
+    def list(self, task_type: Optional[str] = None, statuses: Optional[List[str]] = None) -> List[Dict]:
+        """按创建时间倒序列出任务"""
+        sql, args = "SELECT * FROM tasks WHERE 1 = 1", []
+        if task_type:
+            sql += " AND type = ?"
+            args.append(task_type)
+        if statuses:
+            sql += f" AND status IN ({','.join('?' * len(statuses))})"
+            args.extend(statuses)
+        with self._connect() as conn:
+            rows = conn.execute(sql + " ORDER BY created_at DESC", args).fetchall()
+        return [self._to_task(row) for row in rows]
+
+    def update(self, task_id: str, status: Optional[str] = None, progress: Optional[int] = None,
+               result: Any = None, error: Optional[str] = None, **fields) -> bool:
+        """更新任务；dict 结果合并进已有结果，其他结果直接替换。已取消的任务不会被改回其他状态"""
+        with self._connect(immediate=True) as conn:
+            row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if row is None:
+                return False
+            sets, args = ["updated_at = ?"], [_now()]
+            if status is not None and not row['cancel_requested']:
+                sets.append("status = ?")
+                args.append(status)
+            if progress is not None:
+                sets.append("progress = ?")
+                args.append(int(progress))
+            if result is not None:
+                current = self._loads(row['result'])
+                if isinstance(result, dict) and isinstance(current, dict):
+                    result = {**current, **result}
+                sets.append("result = ?")
+                args.append(self._dumps(result))
+            if error is not None:
+                sets.append("error = ?")
+                args.append(error)
+            if fields:
+                sets.append("extra = ?")
+                args.append(self._dumps({**(self._loads(row['extra']) or {}), **fields}))
+            conn.execute(f"UPDATE tasks SET {', '.join(sets)} WHERE id = ?", (*args, task_id))
+        return True
+
+    def is_cancelled(self, task_id: str) -> bool:
+        """任务被取消或已经被删除"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return row is None or bool(row['cancel_requested'])
+
+    def cancel(self, task_id: str, error: str = '用户取消任务', status: str = TASK_FAILED) -> bool:
+        """取消排队中或运行中的任务，运行中的由处理函数自己检查取消标记后退出
+
+        前端只认识 failed，默认把取消的任务标成失败并附上原因
+        """
+        now = _now()
+        with self._connect(immediate=True) as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET cancel_requested = 1, status = ?, error = ?, updated_at = ?, finished_at = ? "
+                "WHERE id = ? AND status IN (?, ?)", (status, error, now, now, task_id, *ACTIVE_STATUSES))
+        return cursor.rowcount > 0
+
+    def delete(self, task_id: str) -> bool:
+        """删除任务，运行中的任务会看到取消标记（查不到任务也算取消）"""
+        with self._connect(immediate=True) as conn:
+            cursor = conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+            conn.execute("DELETE FROM task_events WHERE task_id = ?", (task_id,))
+        return cursor.rowcount > 0
+
+    def restore(self, task: Dict) -> bool:
+        """按原样导入一个任务（迁移旧数据用），id 已存在则跳过"""
+        extra = {k: v for k, v in task.items() if k not in _COLUMNS}
+        now = _now()
+        with self._connect(immediate=True) as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO tasks (id, type, key, status, progress, params, result, error, extra, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (task['id'], task['type'], task.get('key'), task.get('status', TASK_FAILED),
+                 int(task.get('progress') or 0), self._dumps(task.get('params') or {}),
+                 self._dumps(task.get('result')), task.get('error'), self._dumps(extra),
+                 task.get('created_at') or now, task.get('updated_at') or now))
+        return cursor.rowcount > 0
+
+    def purge(self, task_type: str, statuses: List[str], older_than: float = 0) -> int:
+        """删除指定状态、且超过 older_than 秒没更新的任务，返回删除数"""
+        cutoff = datetime.fromtimestamp(time.time() - older_than).strftime('%Y-%m-%d %H:%M:%S')
+        with self._connect(immediate=True) as conn:
+            cursor = conn.execute(
+                f"DELETE FROM tasks WHERE type = ? AND status IN ({','.join('?' * len(statuses))}) "
+                f"AND updated_at <= ?", (task_type, *statuses, cutoff))
+            if cursor.rowcount:
+                conn.execute("DELETE FROM task_events WHERE task_id NOT IN (SELECT id FROM tasks)")
+        return cursor.rowcount
+
+    # ========== 执行 ==========
+
+    def _claim(self) -> Optional[Dict]:
+        """抢一个可执行的任务，只抢本进程注册过、且没到并发上限的类型"""
+        with self._lock:
+            types = [t for t, opt in self._handlers.items()
+                     if opt['concurrency'] is None or self._running[t] < opt['concurrency']]
+            if not types:
+                return None
+            with self._connect(immediate=True) as conn:
+                row = conn.execute(
+                    f"SELECT id FROM tasks WHERE status = ? AND available_at <= ? "
+                    f"AND type IN ({','.join('?' * len(types))}) ORDER BY priority DESC, created_at, rowid LIMIT 1",
+                    (TASK_PENDING, time.time(), *types)).fetchone()
+                if row is None:
+                    return None
+                now = _now()
+                conn.execute(
+                    "UPDATE tasks SET status = ?, owner = ?, attempts = attempts + 1, heartbeat_at = ?, "
+                    "started_at = ?, updated_at = ? WHERE id = ?",
+                    (TASK_RUNNING, self.owner, time.time(), now, now, row['id']))
+                task = self._to_task(conn.execute("SELECT * FROM tasks WHERE id = ?", (row['id'],)).fetchone())
+                if task['attempts'] > 1:
+                    # 重跑时丢掉上一次的中间结果
+                    conn.execute("DELETE FROM task_events WHERE task_id = ?", (task['id'],))
+            self._running[task['type']] += 1
+            return task
+
+    def _finish(self, task: Dict, status: str, result: Any = None, error: Optional[str] = None,
+                retry_at: Optional[float] = None):
+        """收尾：只改自己还持有的任务，取消或被其他 worker 接手的不动"""
+        now = _now()
+        with self._connect(immediate=True) as conn:
+            row = conn.execute("SELECT result FROM tasks WHERE id = ? AND owner = ? AND status = ? "
+                               "AND cancel_requested = 0", (task['id'], self.owner, TASK_RUNNING)).fetchone()
+            if row is None:
+                return
+            if retry_at is not None:
+                conn.execute("UPDATE tasks SET status = ?, owner = NULL, available_at = ?, error = ?, updated_at = ? "
+                             "WHERE id = ?", (TASK_PENDING, retry_at, error, now, task['id']))
+                return
+            if result is not None:
+                current = self._loads(row['result'])
+                if isinstance(result, dict) and isinstance(current, dict):
+                    result = {**current, **result}
+            conn.execute(
+                "UPDATE tasks SET status = ?, progress = CASE WHEN ? THEN 100 ELSE progress END, "
+                "result = COALESCE(?, result), error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                (status, status == TASK_COMPLETED, self._dumps(result), error, now, now, task['id']))
+
+    def _execute(self, task: Dict):
+        options = self._handlers[task['type']]
+        try:
+            result = options['handler'](TaskContext(self, task))
+            self._finish(task, TASK_COMPLETED, result=result)
+            logger.info(f"任务 {task['type']}:{task['id']} 完成")
+        except TaskCancelledException as e:
+            logger.info(str(e))
+        except Exception as e:
+            if task['attempts'] <= options['max_retries']:
+                delay = self.retry_delay * task['attempts']
+                logger.warning(f"任务 {task['type']}:{task['id']} 第 {task['attempts']} 次执行失败，"
+                               f"{delay:.0f} 秒后重试: {e}")
+                self._finish(task, TASK_PENDING, error=str(e), retry_at=time.time() + delay)
+            else:
+                logger.error(f"任务 {task['type']}:{task['id']} 失败: {e}", exc_info=True)
+                self._finish(task, TASK_FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._running[task['type']] -= 1
+            # 可能有因为并发上限没抢的任务，叫醒其他线程
+            self._wakeup.set()
+
+    def _worker_loop(self):
+        while True:
+            try:
+                task = self._claim()
+            except Exception as e:
+                logger.error(f"领取任务出错: {e}")
+                task = None
+            if task is None:
+                self._wakeup.wait(self.POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._execute(task)
+
+    def heartbeat(self) -> int:
+        """续一次心跳并回收心跳超时的任务（进程挂了）：还能重试的放回队列，否则标记失败，返回回收数"""
+        now = time.time()
+        with self._connect(immediate=True) as conn:
+            conn.execute("UPDATE tasks SET heartbeat_at = ? WHERE owner = ? AND status = ?",
+                         (now, self.owner, TASK_RUNNING))
+            stale = conn.execute("SELECT id, attempts, max_retries FROM tasks WHERE status = ? "
+                                 "AND heartbeat_at < ?", (TASK_RUNNING, now - self.stale_seconds)).fetchall()
+            for row in stale:
+                if row['attempts'] <= row['max_retries']:
+                    conn.execute("UPDATE tasks SET status = ?, owner = NULL, available_at = ?, updated_at = ? "
+                                 "WHERE id = ?", (TASK_PENDING, now, _now(), row['id']))
+                else:
+                    conn.execute("UPDATE tasks SET status = ?, error = ?, updated_at = ?, finished_at = ? "
+                                 "WHERE id = ?", (TASK_FAILED, '任务因服务器重启或超时而中止',
+                                                  _now(), _now(), row['id']))
+        if stale:
+            logger.warning(f"回收了 {len(stale)} 个心跳超时的任务")
+            self._wakeup.set()
+        return len(stale)
+
+    def _maintain(self):
+        """心跳线程：每 HEARTBEAT_INTERVAL 秒调一次 heartbeat()"""
+        while True:
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"任务心跳出错: {e}")
+            time.sleep(self.HEARTBEAT_INTERVAL)
+
+    def start(self):
+        """启动工作线程和心跳线程（注册完任务类型后调用）"""
+        if self._threads:
+            return
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self._worker_loop, daemon=True, name=f'task-worker-{i}')
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, daemon=True, name='task-heartbeat')
+        thread.start()
+        self._threads.append(thread)
+        logger.info(f"任务队列已启动: {self.db_path}，工作线程 {self.max_workers} 个")
+
+    def get_stats(self) -> Dict:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT type, status, COUNT(*) AS n FROM tasks GROUP BY type, status").fetchall()
+        counts: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            counts.setdefault(row['type'], {})[row['status']] = row['n']
+        with self._lock:
+            running_here = dict(self._running)
+        return {'owner': self.owner, 'workers': self.max_workers, 'running_here': running_here, 'counts': counts}
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+交易日历 - 老王说：周末节假日没K线，别傻乎乎地去数据源要！
+交易日列表从数据源拉一次落盘缓存，拉不到时退化为周一到周五。
+另外按交易时段给缓存算有效期：已经收盘定型的K线永不过期，只有当前交易日的数据按盘中TTL过期。
+"""
+import os
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, time as dt_time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 交易时段
+PRE_OPEN = 'pre_open'       # 交易日开盘前
+INTRADAY = 'intraday'       # 交易日盘中（含集合竞价和午休）
+POST_CLOSE = 'post_close'   # 交易日收盘后
+HOLIDAY = 'holiday'         # 非交易日
+
+SESSION_OPEN = dt_time(9, 15)
+SESSION_CLOSE = dt_time(15, 0)
+
+
+def parse_time(value: str) -> dt_time:
+    """'HH:MM' -> time"""
+    hour, minute = value.split(':')
+    return dt_time(int(hour), int(minute))
+
+
+class TradingCalendar:
+    """A股交易日历"""
+
+    # 拉取失败后多久再试（秒）
+    RETRY_INTERVAL = 600
+    # 收盘后数据源的日K线多久才定型（之前每天 16:30 清缓存就是这个原因）
+    SETTLE_TIME = parse_time(os.getenv('DATA_SETTLE_TIME', '16:30'))
+    # 盘中（及收盘后未定型前）数据的缓存秒数
+    INTRADAY_TTL = float(os.getenv('CACHE_INTRADAY_TTL', '300'))
+
+    def __init__(self, loader: Optional[Callable[[], List[str]]] = None, cache_path: Optional[str] = None):
+        """
+        Args:
+            loader: 返回交易日字符串列表的函数（如 DataProvider 的 get_trade_dates）
+            cache_path: 交易日列表的本地缓存文件
+        """
+        self.loader = loader
+        self.cache_path = Path(cache_path) if cache_path else None
+        self._days: Optional[pd.DatetimeIndex] = None
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+
+    # ========== 加载 ==========
+
+    def _load_from_file(self) -> Optional[pd.DatetimeIndex]:
+        if not self.cache_path or not self.cache_path.exists():
+            return None
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return pd.DatetimeIndex(pd.to_datetime(json.load(f)))
+        except (OSError, ValueError) as e:
+            logger.warning(f"交易日历缓存读取失败: {e}")
+            return None
+
+    def _save_to_file(self, days: pd.DatetimeIndex):
+        if not self.cache_path:
+            return
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([d.strftime('%Y-%m-%d') for d in days], f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"交易日历缓存写入失败: {e}")
+
+    @staticmethod
+    def _covers_today(days: Optional[pd.DatetimeIndex]) -> bool:
+        return days is not None and len(days) > 0 and days[-1] >= pd.Timestamp(datetime.now().date())
+
+    def _ensure_loaded(self) -> Optional[pd.DatetimeIndex]:
+        """返回交易日索引，None 表示只能按工作日估算"""
+        if self._covers_today(self._days):
+            return self._days
+
+        with self._lock:
+            if self._covers_today(self._days):
+                return self._days
+
+            if self._days is None:
+                days = self._load_from_file()
+                if self._covers_today(days):
+                    self._days = days
+                    return self._days
+
+            if self.loader and time.time() - self._last_attempt >= self.RETRY_INTERVAL:
+                self._last_attempt = time.time()
+                try:
+                    raw = self.loader()
+                    days = pd.DatetimeIndex(pd.to_datetime(list(raw))).normalize().unique().sort_values()
+                    if len(days):
+                        self._days = days
+                        self._save_to_file(days)
+                        logger.info(f"交易日历已更新，共 {len(days)} 个交易日，截至 {days[-1].date()}")
+                except Exception as e:
+                    logger.warning(f"获取交易日历失败，按工作日估算: {e}")
+
+            return self._days if self._covers_today(self._days) else None
+
+    # ========== 查询 ==========
+
+    def trading_days(self, start_date, end_date) -> pd.DatetimeIndex:
+        """[start_date, end_date] 内的交易日"""
+        start = pd.Timestamp(start_date).normalize()
+        end = pd.Timestamp(end_date).normalize()
+        if start > end:
+            return pd.DatetimeIndex([])
+
+        days = self._ensure_loaded()
+        if days is None or end > days[-1]:
+            return pd.bdate_range(start, end)
+        return days[(days >= start) & (days <= end)]
+
+    def is_trading_day(self, day) -> bool:
+        return len(self.trading_days(day, day)) > 0
+
+    def last_trading_day(self, day=None) -> pd.Timestamp:
+        """不晚于 day 的最近一个交易日"""
+        day = pd.Timestamp(day or datetime.now().date()).normalize()
+        days = self.trading_days(day - timedelta(days=30), day)
+        return days[-1] if len(days) else day
+
+    def previous_trading_day(self, day=None) -> pd.Timestamp:
+        """严格早于 day 的最近一个交易日"""
+        day = pd.Timestamp(day or datetime.now().date()).normalize()
+        return self.last_trading_day(day - timedelta(days=1))
+
+    def next_trading_day(self, day=None) -> pd.Timestamp:
+        """严格晚于 day 的最近一个交易日"""
+        day = pd.Timestamp(day or datetime.now().date()).normalize()
+        days = self.trading_days(day + timedelta(days=1), day + timedelta(days=30))
+        return days[0] if len(days) else day + timedelta(days=1)
+
+    # ========== 交易时段与缓存有效期 ==========
+
+    def session_state(self, now: Optional[datetime] = None) -> str:
+        """当前所处时段：pre_open / intraday / post_close / holiday"""
+        now = now or datetime.now()
+        if not self.is_trading_day(now.date()):
+            return HOLIDAY
+        if now.time() < SESSION_OPEN:
+            return PRE_OPEN
+        if now.time() < SESSION_CLOSE:
+            return INTRADAY
+        return POST_CLOSE
+
+    def last_settled_day(self, now: Optional[datetime] = None) -> pd.Timestamp:
+        """K线已经定型的最近一个交易日：今天收盘且过了定型时间算今天，否则算上一个交易日"""
+        now = now or datetime.now()
+        today = pd.Timestamp(now.date())
+        if self.is_trading_day(today) and now.time() >= self.SETTLE_TIME:
+            return today
+        return self.previous_trading_day(today)
+
+    def seconds_until_stale(self, now: Optional[datetime] = None) -> float:
+        """当前交易日的数据还能用多少秒
+
+        盘中和收盘后未定型前按 INTRADAY_TTL；开盘前、定型后和非交易日一直用到下一次开盘
+        """
+        now = now or datetime.now()
+        state = self.session_state(now)
+        if state == INTRADAY:
+            return self.INTRADAY_TTL
+        if state == POST_CLOSE and now.time() < self.SETTLE_TIME:
+            settle_at = datetime.combine(now.date(), self.SETTLE_TIME)
+            return max(1.0, min(self.INTRADAY_TTL, (settle_at - now).total_seconds()))
+        if state == PRE_OPEN:
+            next_open = datetime.combine(now.date(), SESSION_OPEN)
+        else:
+            next_open = datetime.combine(self.next_trading_day(now.date()).date(), SESSION_OPEN)
+        return max(1.0, (next_open - now).total_seconds())
+
+    def cache_ttl(self, end_date=None, now: Optional[datetime] = None) -> Optional[float]:
+        """截止到 end_date 的行情数据的缓存秒数，None 表示已经定型、不会再变"""
+        now = now or datetime.now()
+        if end_date is not None and pd.Timestamp(end_date).normalize() <= self.last_settled_day(now):
+            return None
+        return self.seconds_until_stale(now)
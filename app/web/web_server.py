@@ -8,7 +8,7 @@
 
 import numpy as np
 import pandas as pd
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for
 from app.analysis.stock_analyzer import StockAnalyzer
 from app.analysis.us_stock_service import USStockService
 import threading
@@ -26,6 +26,10 @@ import threading
 import sys
 from flask_swagger_ui import get_swaggerui_blueprint
 from app.core.database import get_session, StockInfo, AnalysisResult, Portfolio, USE_DATABASE
+from app.core.trading_calendar import TradingCalendar
+from app.core.metrics import get_metrics
+from app.core.task_queue import (TaskQueue, TaskCancelledException, TASK_PENDING, TASK_RUNNING,
+                                 TASK_COMPLETED, TASK_FAILED, TASK_CANCELLED)
 from dotenv import load_dotenv
 from app.analysis.industry_analyzer import IndustryAnalyzer
 from app.analysis.fundamental_analyzer import FundamentalAnalyzer
@@ -36,6 +40,8 @@ from app.analysis.risk_monitor import RiskMonitor
 from app.analysis.index_industry_analyzer import IndexIndustryAnalyzer
 from app.analysis.news_fetcher import news_fetcher, start_news_scheduler
 from app.analysis.etf_analyzer import EtfAnalyzer
+from app.analysis.cache_warmer import CacheWarmer
+from app.analysis.scan_engine import TopK
 
 import sys
 import os
@@ -82,7 +88,7 @@ if os.getenv('USE_REDIS_CACHE', 'False').lower() == 'true' and os.getenv('REDIS_
         'CACHE_DEFAULT_TIMEOUT': 300
     }
 
-cache = Cache(config={'CACHE_TYPE': 'SimpleCache'})
+cache = Cache(config=cache_config)
 cache.init_app(app)
 
 app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
@@ -107,8 +113,11 @@ stock_qa = StockQA(analyzer, os.getenv('OPENAI_API_KEY'))
 risk_monitor = RiskMonitor(analyzer)
 index_industry_analyzer = IndexIndustryAnalyzer(analyzer)
 industry_analyzer = IndustryAnalyzer()
+cache_warmer = CacheWarmer(analyzer, capital_flow_analyzer)
 
 start_news_scheduler()
+if os.getenv('CACHE_WARM_ENABLED', 'True').lower() == 'true':
+    cache_warmer.start_scheduler()
 
 # 线程本地存储
 thread_local = threading.local()
@@ -165,203 +174,9 @@ logging.getLogger('werkzeug').setLevel(log_level)
 app.logger.info(f"日志系统已初始化，级别: {log_level}, 文件: {log_file}")
 
 
-# 扩展任务管理系统以支持不同类型的任务
-task_types = {
-    'scan': 'market_scan',  # 市场扫描任务
-    'analysis': 'stock_analysis',  # 个股分析任务
-    'agent_analysis': 'agent_analysis', # 智能体分析任务
-    'etf_analysis': 'etf_analysis' # ETF分析任务
-}
-
-# 任务数据存储
-tasks = {
-    'market_scan': {},
-    'stock_analysis': {},
-    'etf_analysis': {},
-}
-
-
-
-def get_task_store(task_type):
-    """获取指定类型的任务存储"""
-    return tasks.get(task_type, {})
-
-
-def generate_task_key(task_type, **params):
-    """生成任务键"""
-    if task_type == 'stock_analysis':
-        # 对于个股分析，使用股票代码和市场类型作为键
-        return f"{params.get('stock_code')}_{params.get('market_type', 'A')}"
-    if task_type == 'etf_analysis':
-        return f"{params.get('etf_code')}"
-    return None  # 其他任务类型不使用预生成的键
-
-
-def get_or_create_task(task_type, **params):
-    """获取或创建任务"""
-    store = get_task_store(task_type)
-    task_key = generate_task_key(task_type, **params)
-
-    # 检查是否有现有任务
-    if task_key and task_key in store:
-        task = store[task_key]
-        # 检查任务是否仍然有效
-        if task['status'] in [TASK_PENDING, TASK_RUNNING]:
-            return task['id'], task, False
-        if task['status'] == TASK_COMPLETED and 'result' in task:
-            # 任务已完成且有结果，重用它
-            return task['id'], task, False
-
-    # 创建新任务
-    task_id = generate_task_id()
-    task = {
-        'id': task_id,
-        'key': task_key,  # 存储任务键以便以后查找
-        'type': task_type,
-        'status': TASK_PENDING,
-        'progress': 0,
-        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'params': params
-    }
-
-    with task_lock:
-        if task_key:
-            store[task_key] = task
-        store[task_id] = task
-
-    return task_id, task, True
-
-
-# 添加到web_server.py顶部
-# 任务管理系统
-scan_tasks = {}  # 存储扫描任务的状态和结果
-task_lock = threading.Lock()  # 用于线程安全操作
-
-
-# 自定义异常，用于任务取消
-class TaskCancelledException(Exception):
-    pass
-
-# 任务状态常量
-TASK_PENDING = 'pending'
-TASK_RUNNING = 'running'
-TASK_COMPLETED = 'completed'
-TASK_FAILED = 'failed'
-TASK_CANCELLED = 'cancelled'
-
-
-def generate_task_id():
-    """生成唯一的任务ID"""
-    import uuid
-    return str(uuid.uuid4())
-
-
-def start_market_scan_task_status(task_id, status, progress=None, result=None, error=None):
-    """更新任务状态 - 保持原有签名"""
-    with task_lock:
-        if task_id in scan_tasks:
-            task = scan_tasks[task_id]
-            task['status'] = status
-            if progress is not None:
-                task['progress'] = progress
-            if result is not None:
-                task['result'] = result
-            if error is not None:
-                task['error'] = error
-            task['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-
-def update_task_status(task_type, task_id, status, progress=None, result=None, error=None):
-    """更新任务状态"""
-    with task_lock:
-        task = None
-        if task_type == 'agent_analysis':
-            task = agent_session_manager.load_task(task_id)
-        else:
-            store = get_task_store(task_type)
-            if task_id in store:
-                task = store.get(task_id)
-
-        if not task:
-            app.logger.warning(f"更新任务状态时未找到任务: {task_id} (类型: {task_type})")
-            return
-
-        # 更新任务属性
-        task['status'] = status
-        if progress is not None:
-            task['progress'] = progress
-        if result is not None:
-            if 'result' not in task or not isinstance(task['result'], dict):
-                task['result'] = {}
-            task['result'].update(result)
-        if error is not None:
-            task['error'] = error
-        task['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        # 保存更新后的任务
-        if task_type == 'agent_analysis':
-            agent_session_manager.save_task(task)
-        else:
-            # 更新键索引的任务 (如果适用)
-            store = get_task_store(task_type)
-            if 'key' in task and task.get('key') and task['key'] in store:
-                store[task['key']] = task
-            store[task_id] = task # also save by id
-
-
-analysis_tasks = {}
-
-
-def get_or_create_analysis_task(stock_code, market_type='A'):
-    """获取或创建个股分析任务"""
-    # 创建一个键，用于查找现有任务
-    task_key = f"{stock_code}_{market_type}"
-
-    with task_lock:
-        # 检查是否有现有任务
-        for task_id, task in analysis_tasks.items():
-            if task.get('key') == task_key:
-                # 检查任务是否仍然有效
-                if task['status'] in [TASK_PENDING, TASK_RUNNING]:
-                    return task_id, task, False
-                if task['status'] == TASK_COMPLETED and 'result' in task:
-                    # 任务已完成且有结果，重用它
-                    return task_id, task, False
-
-        # 创建新任务
-        task_id = generate_task_id()
-        task = {
-            'id': task_id,
-            'key': task_key,
-            'status': TASK_PENDING,
-            'progress': 0,
-            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'params': {
-                'stock_code': stock_code,
-                'market_type': market_type
-            }
-        }
-
-        analysis_tasks[task_id] = task
-
-        return task_id, task, True
-
-
-def update_analysis_task(task_id, status, progress=None, result=None, error=None):
-    """更新个股分析任务状态"""
-    with task_lock:
-        if task_id in analysis_tasks:
-            task = analysis_tasks[task_id]
-            task['status'] = status
-            if progress is not None:
-                task['progress'] = progress
-            if result is not None:
-                task['result'] = result
-            if error is not None:
-                task['error'] = error
-            task['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+# 任务管理：个股/ETF/智能体分析和市场扫描都进持久化任务队列（见 app/core/task_queue.py），
+# 由固定数量的工作线程执行，任意 worker 都能查到状态，重启后排队中的任务继续跑
+# 任务队列在 NumpyJSONEncoder 定义之后创建，处理函数在各自的路由旁边注册
 
 
 # 定义自定义JSON编码器
@@ -512,6 +327,127 @@ def custom_jsonify(data):
     )
 
 
+# 持久化任务队列，结果里的 numpy 类型、LangChain 消息用同一个编码器落库
+task_queue = TaskQueue(json_encoder=NumpyJSONEncoder)
+
+
+def get_task_of_type(task_id, task_type):
+    """按ID取任务，类型不符当作不存在"""
+    task = task_queue.get(task_id)
+    return task if task and task['type'] == task_type else None
+
+
+def task_status_response(task, *fields):
+    """任务状态的公共部分，fields 为额外返回的字段"""
+    status = {
+        'id': task['id'],
+        'status': task['status'],
+        'progress': task.get('progress', 0),
+        'created_at': task['created_at'],
+        'updated_at': task['updated_at']
+    }
+    for field in fields:
+        status[field] = task.get(field)
+
+    # 如果任务完成，包含结果
+    if task['status'] == TASK_COMPLETED and 'result' in task:
+        status['result'] = task['result']
+
+    # 如果任务失败，包含错误信息
+    if task['status'] == TASK_FAILED and 'error' in task:
+        status['error'] = task['error']
+    return status
+
+
+def cancel_task(task_id, task_type, not_found_message):
+    """取消排队中或运行中的任务"""
+    task = get_task_of_type(task_id, task_type)
+    if not task:
+        return jsonify({'error': not_found_message}), 404
+
+    if task['status'] in [TASK_COMPLETED, TASK_FAILED]:
+        return jsonify({'message': '任务已完成或失败，无法取消'})
+
+    task_queue.cancel(task_id)
+    return jsonify({'message': '任务已取消'})
+
+
+# 流式进度：服务端按这个间隔查库，只把变化推给前端
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', '0.5'))
+# 单个连接最长保持多久（秒），到点断开，EventSource 会带着 Last-Event-ID 自动重连。
+# 要比 gunicorn 的 worker 超时（默认30秒）短得多，一个连接不能长时间占着 worker
+SSE_MAX_SECONDS = float(os.getenv('SSE_MAX_SECONDS', '20'))
+# 断开后浏览器多久重连（毫秒）
+SSE_RETRY_MS = 1000
+SSE_KEEPALIVE_SECONDS = 15
+# progress 事件里不带的字段：参数，以及扫描的前K名（partial，命中的股票已经逐条以 hit 推过了，每只股票都重发一遍太大）
+SSE_PROGRESS_EXCLUDED = ('params', 'partial')
+
+
+def sse_message(event, data, event_id=None):
+    """格式化一条 Server-Sent Events 消息"""
+    payload = json.dumps(convert_numpy_types(data), cls=NumpyJSONEncoder, ensure_ascii=False)
+    head = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{head}event: {event}\ndata: {payload}\n\n"
+
+
+@app.route('/api/task_stream/<task_id>', methods=['GET'])
+def stream_task(task_id):
+    """以 Server-Sent Events 推送任务进度，适用于所有类型的任务
+
+    事件：
+        progress  状态/进度/计数等有变化时推送（不含参数、结果和扫描的 partial）
+        hit/step  处理函数产生的中间结果，如扫描命中的股票、智能体分析步骤，带自增 id，断线重连不重复
+        done      任务结束，带最终状态、结果或错误，随后断开
+    """
+    if task_queue.get(task_id, with_result=False) is None:
+        return jsonify({'error': '找不到指定的任务'}), 404
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        last_event_id = 0
+
+    def generate():
+        event_id = last_event_id
+        last_progress = None
+        started = last_sent = time.time()
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        while True:
+            # 先取状态再取事件：任务结束前产生的事件一定能在 done 之前发出去
+            task = task_queue.get(task_id, with_result=False)
+            if task is None:
+                yield sse_message('done', {'status': TASK_FAILED, 'error': '任务不存在或已被删除'})
+                return
+
+            for event in task_queue.get_events(task_id, event_id):
+                event_id = event['id']
+                last_sent = time.time()
+                yield sse_message(event['event'], event['data'], event_id)
+
+            progress = {k: v for k, v in task.items() if k not in SSE_PROGRESS_EXCLUDED}
+            if progress != last_progress:
+                last_progress = progress
+                last_sent = time.time()
+                yield sse_message('progress', progress)
+
+            if task['status'] not in [TASK_PENDING, TASK_RUNNING]:
+                final = task_queue.get(task_id) or task
+                yield sse_message('done', {'status': final['status'], 'result': final.get('result'),
+                                           'error': final.get('error')})
+                return
+
+            now = time.time()
+            if now - started > SSE_MAX_SECONDS:
+                return
+            if now - last_sent > SSE_KEEPALIVE_SECONDS:
+                last_sent = now
+                yield ": keep-alive\n\n"
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 # 保持API兼容的路由
 @app.route('/')
 def index():
@@ -697,6 +633,38 @@ def make_cache_key_with_stock():
         return path
 
 
+def task_step_reporter(ctx):
+    """分析步骤回调：进度写回任务（current_step 供轮询查看），同时推一条 step 事件给 /api/task_stream"""
+    def report_step(progress, step):
+        ctx.update(progress=progress, current_step=step)
+        ctx.emit('step', {'progress': progress, 'step': step})
+    return report_step
+
+
+def run_stock_analysis(ctx):
+    """个股分析任务"""
+    return analyzer.perform_enhanced_analysis(ctx.params['stock_code'], ctx.params.get('market_type', 'A'),
+                                              progress_callback=task_step_reporter(ctx))
+
+
+def run_etf_analysis(ctx):
+    """ETF分析任务"""
+    # 使用一个新的 EtfAnalyzer 实例, 并传入stock_analyzer
+    etf_analyzer_instance = EtfAnalyzer(ctx.params['etf_code'], analyzer)
+    return etf_analyzer_instance.run_analysis(progress_callback=task_step_reporter(ctx))
+
+
+# 页面上等着看的个股/ETF分析排在扫描前面；用户在页面上干等，失败了直接报错让他重试，不排30秒后的自动重试
+task_queue.register('stock_analysis', run_stock_analysis, priority=10, max_retries=0)
+task_queue.register('etf_analysis', run_etf_analysis, priority=10, max_retries=0)
+
+
+def submit_stock_analysis(stock_code, market_type='A'):
+    """提交个股分析任务，同一只股票排队中/运行中/已完成的任务直接复用"""
+    return task_queue.submit('stock_analysis', {'stock_code': stock_code, 'market_type': market_type},
+                             key=f"{stock_code}_{market_type}")
+
+
 @app.route('/api/start_stock_analysis', methods=['POST'])
 def start_stock_analysis():
     """启动个股分析任务"""
@@ -711,47 +679,21 @@ def start_stock_analysis():
         app.logger.info(f"准备分析股票: {stock_code}")
 
         # 获取或创建任务
-        task_id, task, is_new = get_or_create_task(
-            'stock_analysis',
-            stock_code=stock_code,
-            market_type=market_type
-        )
+        task, is_new = submit_stock_analysis(stock_code, market_type)
+        task_id = task['id']
 
         # 如果是已完成的任务，直接返回结果
         if task['status'] == TASK_COMPLETED and 'result' in task:
             app.logger.info(f"使用缓存的分析结果: {stock_code}")
-            return jsonify({
+            return custom_jsonify({
                 'task_id': task_id,
                 'status': task['status'],
                 'result': task['result']
             })
 
-        # 如果是新创建的任务，启动后台处理
         if is_new:
             app.logger.info(f"创建新的分析任务: {task_id}")
 
-            # 启动后台线程执行分析
-            def run_analysis():
-                try:
-                    update_task_status('stock_analysis', task_id, TASK_RUNNING, progress=10)
-
-                    # 执行分析
-                    result = analyzer.perform_enhanced_analysis(stock_code, market_type)
-
-                    # 更新任务状态为完成
-                    update_task_status('stock_analysis', task_id, TASK_COMPLETED, progress=100, result=result)
-                    app.logger.info(f"分析任务 {task_id} 完成")
-
-                except Exception as e:
-                    app.logger.error(f"分析任务 {task_id} 失败: {str(e)}")
-                    app.logger.error(traceback.format_exc())
-                    update_task_status('stock_analysis', task_id, TASK_FAILED, error=str(e))
-
-            # 启动后台线程
-            thread = threading.Thread(target=run_analysis)
-            thread.daemon = True
-            thread.start()
-
         # 返回任务ID和状态
         return jsonify({
             'task_id': task_id,
@@ -767,56 +709,17 @@ def start_stock_analysis():
 @app.route('/api/analysis_status/<task_id>', methods=['GET'])
 def get_analysis_status(task_id):
     """获取个股分析任务状态"""
-    store = get_task_store('stock_analysis')
-    with task_lock:
-        if task_id not in store:
-            return jsonify({'error': '找不到指定的分析任务'}), 404
-
-        task = store[task_id]
-
-        # 基本状态信息
-        status = {
-            'id': task['id'],
-            'status': task['status'],
-            'progress': task.get('progress', 0),
-            'created_at': task['created_at'],
-            'updated_at': task['updated_at']
-        }
-
-        # 如果任务完成，包含结果
-        if task['status'] == TASK_COMPLETED and 'result' in task:
-            status['result'] = task['result']
-
-        # 如果任务失败，包含错误信息
-        if task['status'] == TASK_FAILED and 'error' in task:
-            status['error'] = task['error']
+    task = get_task_of_type(task_id, 'stock_analysis')
+    if not task:
+        return jsonify({'error': '找不到指定的分析任务'}), 404
 
-        return custom_jsonify(status)
+    return custom_jsonify(task_status_response(task, 'current_step'))
 
 
 @app.route('/api/cancel_analysis/<task_id>', methods=['POST'])
 def cancel_analysis(task_id):
     """取消个股分析任务"""
-    store = get_task_store('stock_analysis')
-    with task_lock:
-        if task_id not in store:
-            return jsonify({'error': '找不到指定的分析任务'}), 404
-
-        task = store[task_id]
-
-        if task['status'] in [TASK_COMPLETED, TASK_FAILED]:
-            return jsonify({'message': '任务已完成或失败，无法取消'})
-
-        # 更新状态为失败
-        task['status'] = TASK_FAILED
-        task['error'] = '用户取消任务'
-        task['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        # 更新键索引的任务
-        if 'key' in task and task['key'] in store:
-            store[task['key']] = task
-
-        return jsonify({'message': '任务已取消'})
+    return cancel_task(task_id, 'stock_analysis', '找不到指定的分析任务')
 
 
 # ETF 分析路由
@@ -832,14 +735,12 @@ def start_etf_analysis():
 
         app.logger.info(f"准备分析ETF: {etf_code}")
 
-        task_id, task, is_new = get_or_create_task(
-            'etf_analysis',
-            etf_code=etf_code
-        )
+        task, is_new = task_queue.submit('etf_analysis', {'etf_code': etf_code}, key=str(etf_code))
+        task_id = task['id']
 
         if task['status'] == TASK_COMPLETED and 'result' in task:
             app.logger.info(f"使用缓存的ETF分析结果: {etf_code}")
-            return jsonify({
+            return custom_jsonify({
                 'task_id': task_id,
                 'status': task['status'],
                 'result': task['result']
@@ -848,26 +749,6 @@ def start_etf_analysis():
         if is_new:
             app.logger.info(f"创建新的ETF分析任务: {task_id}")
 
-            def run_etf_analysis():
-                try:
-                    update_task_status('etf_analysis', task_id, TASK_RUNNING, progress=10)
-                    
-                    # 使用一个新的 EtfAnalyzer 实例, 并传入stock_analyzer
-                    etf_analyzer_instance = EtfAnalyzer(etf_code, analyzer)
-                    result = etf_analyzer_instance.run_analysis()
-                    
-                    update_task_status('etf_analysis', task_id, TASK_COMPLETED, progress=100, result=result)
-                    app.logger.info(f"ETF分析任务 {task_id} 完成")
-
-                except Exception as e:
-                    app.logger.error(f"ETF分析任务 {task_id} 失败: {str(e)}")
-                    app.logger.error(traceback.format_exc())
-                    update_task_status('etf_analysis', task_id, TASK_FAILED, error=str(e))
-
-            thread = threading.Thread(target=run_etf_analysis)
-            thread.daemon = True
-            thread.start()
-
         return jsonify({
             'task_id': task_id,
             'status': task['status'],
@@ -882,28 +763,11 @@ def start_etf_analysis():
 @app.route('/api/etf_analysis_status/<task_id>', methods=['GET'])
 def get_etf_analysis_status(task_id):
     """获取ETF分析任务状态"""
-    store = get_task_store('etf_analysis')
-    with task_lock:
-        if task_id not in store:
-            return jsonify({'error': '找不到指定的ETF分析任务'}), 404
-
-        task = store[task_id]
-
-        status = {
-            'id': task['id'],
-            'status': task['status'],
-            'progress': task.get('progress', 0),
-            'created_at': task['created_at'],
-            'updated_at': task['updated_at']
-        }
-
-        if task['status'] == TASK_COMPLETED and 'result' in task:
-            status['result'] = task['result']
-        
-        if task['status'] == TASK_FAILED and 'error' in task:
-            status['error'] = task['error']
+    task = get_task_of_type(task_id, 'etf_analysis')
+    if not task:
+        return jsonify({'error': '找不到指定的ETF分析任务'}), 404
 
-        return custom_jsonify(status)
+    return custom_jsonify(task_status_response(task, 'current_step'))
 
 
 # 保留原有API用于向后兼容
@@ -918,55 +782,33 @@ def enhanced_analysis():
         if not stock_code:
             return custom_jsonify({'error': '请输入股票代码'}), 400
 
-        # 调用新的任务系统，但模拟同步行为
-        # 这会导致和之前一样的超时问题，但保持兼容
+        # 调用任务队列，但模拟同步行为
         timeout = 300
         start_time = time.time()
 
-        # 获取或创建任务
-        task_id, task, is_new = get_or_create_task(
-            'stock_analysis',
-            stock_code=stock_code,
-            market_type=market_type
-        )
+        task, is_new = submit_stock_analysis(stock_code, market_type)
 
         # 如果是已完成的任务，直接返回结果
         if task['status'] == TASK_COMPLETED and 'result' in task:
             app.logger.info(f"使用缓存的分析结果: {stock_code}")
             return custom_jsonify({'result': task['result']})
 
-        # 启动分析（如果是新任务）
-        if is_new:
-            # 同步执行分析
-            try:
-                result = analyzer.perform_enhanced_analysis(stock_code, market_type)
-                update_task_status('stock_analysis', task_id, TASK_COMPLETED, progress=100, result=result)
+        # 等待队列里的任务完成
+        wait_interval = 0.5
+        while time.time() - start_time < timeout:
+            current_task = task_queue.get(task['id'])
+            if current_task is None:
+                return custom_jsonify({'error': '任务已被删除'}), 500
+            if current_task['status'] == TASK_COMPLETED and 'result' in current_task:
                 app.logger.info(f"分析完成: {stock_code}，耗时 {time.time() - start_time:.2f} 秒")
-                return custom_jsonify({'result': result})
-            except Exception as e:
-                app.logger.error(f"分析过程中出错: {str(e)}")
-                update_task_status('stock_analysis', task_id, TASK_FAILED, error=str(e))
-                return custom_jsonify({'error': f'分析过程中出错: {str(e)}'}), 500
-        else:
-            # 已存在正在处理的任务，等待其完成
-            max_wait = timeout - (time.time() - start_time)
-            wait_interval = 0.5
-            waited = 0
-
-            while waited < max_wait:
-                with task_lock:
-                    current_task = store[task_id]
-                    if current_task['status'] == TASK_COMPLETED and 'result' in current_task:
-                        return custom_jsonify({'result': current_task['result']})
-                    if current_task['status'] == TASK_FAILED:
-                        error = current_task.get('error', '任务失败，无详细信息')
-                        return custom_jsonify({'error': error}), 500
-
-                time.sleep(wait_interval)
-                waited += wait_interval
-
-            # 超时
-            return custom_jsonify({'error': '处理超时，请稍后重试'}), 504
+                return custom_jsonify({'result': current_task['result']})
+            if current_task['status'] == TASK_FAILED:
+                error = current_task.get('error', '任务失败，无详细信息')
+                return custom_jsonify({'error': f'分析过程中出错: {error}'}), 500
+            time.sleep(wait_interval)
+
+        # 超时
+        return custom_jsonify({'error': '处理超时，请稍后重试'}), 504
 
     except Exception as e:
         app.logger.error(f"执行增强版分析时出错: {traceback.format_exc()}")
@@ -1040,6 +882,8 @@ def get_stock_data():
         # 计算技术指标
         app.logger.info(f"计算股票 {stock_code} 的技术指标")
         df = analyzer.calculate_indicators(df)
+        # 盘中把最新行情接成今天的K线，指标增量计算
+        df = analyzer.apply_realtime_bar(stock_code, df, market_type)
 
         # 将DataFrame转为JSON格式
         app.logger.info(f"将数据转换为JSON格式，行数: {len(df)}")
@@ -1124,6 +968,49 @@ def get_stock_data():
 #         app.logger.error(f"执行市场扫描时出错: {traceback.format_exc()}")
 #         return custom_jsonify({'error': str(e)}), 500
 
+# 扫描过程中任务里保留的前几名（partial），随时可读
+SCAN_TOP_K = int(os.getenv('SCAN_TOP_K', '20'))
+
+
+def run_market_scan(ctx):
+    """市场扫描任务：边扫边把命中的股票推出去，任务里的 partial 始终是当前排名前 SCAN_TOP_K 的股票"""
+    params = ctx.params
+    min_score = params.get('min_score', 60)
+    counters = {'processed': 0, 'found': 0, 'failed': 0}
+    top_k = TopK(SCAN_TOP_K)
+    results = []
+    # 重试时计数从头来
+    ctx.update(progress=0, current_stock=None, partial=[], **counters)
+
+    for processed, total, stock_code, report, error in analyzer.iter_scan_market(
+            params['stock_list'], params.get('market_type', 'A'), should_stop=ctx.cancelled):
+        # 逐只股票把进度写回任务
+        counters['processed'] = processed
+        fields = {}
+        if error:
+            counters['failed'] += 1
+        elif report['score'] >= min_score:
+            counters['found'] += 1
+            results.append(report)
+            # 命中的股票马上推出去，不用等整个扫描结束
+            ctx.emit('hit', report)
+            if top_k.push(report):
+                fields['partial'] = top_k.ranked()
+        ctx.update(progress=min(99, int(processed / total * 100)), current_stock=stock_code, **counters, **fields)
+
+    # 任务被取消
+    ctx.check_cancelled()
+
+    # 按得分排序
+    results.sort(key=lambda x: x['score'], reverse=True)
+    app.logger.info(f"扫描任务 {ctx.task_id} 完成，找到 {len(results)} 只符合条件的股票")
+    return results
+
+
+# 扫描很重，失败不自动重跑，单进程同时最多跑两个
+task_queue.register('market_scan', run_market_scan, max_retries=0, concurrency=2)
+
+
 @app.route('/api/start_market_scan', methods=['POST'])
 def start_market_scan():
     """启动市场扫描任务"""
@@ -1136,83 +1023,15 @@ def start_market_scan():
         if not stock_list:
             return jsonify({'error': '请提供股票列表'}), 400
 
-        # 限制股票数量，避免过长处理时间
-        if len(stock_list) > 100:
-            app.logger.warning(f"股票列表过长 ({len(stock_list)}只)，截取前100只")
-            stock_list = stock_list[:100]
-
         # 创建新任务
-        task_id = generate_task_id()
-        task = {
-            'id': task_id,
-            'status': TASK_PENDING,
-            'progress': 0,
-            'total': len(stock_list),
-            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'params': {
-                'stock_list': stock_list,
-                'min_score': min_score,
-                'market_type': market_type
-            }
-        }
-
-        with task_lock:
-            scan_tasks[task_id] = task
-
-        # 启动后台线程执行扫描
-        def run_scan():
-            try:
-                start_market_scan_task_status(task_id, TASK_RUNNING)
-
-                # 执行分批处理
-                results = []
-                total = len(stock_list)
-                batch_size = 10
-
-                for i in range(0, total, batch_size):
-                    if task_id not in scan_tasks or scan_tasks[task_id]['status'] != TASK_RUNNING:
-                        # 任务被取消
-                        app.logger.info(f"扫描任务 {task_id} 被取消")
-                        return
-
-                    batch = stock_list[i:i + batch_size]
-                    batch_results = []
-
-                    for stock_code in batch:
-                        try:
-                            report = analyzer.quick_analyze_stock(stock_code, market_type)
-                            if report['score'] >= min_score:
-                                batch_results.append(report)
-                        except Exception as e:
-                            app.logger.error(f"分析股票 {stock_code} 时出错: {str(e)}")
-                            continue
-
-                    results.extend(batch_results)
-
-                    # 更新进度
-                    progress = min(100, int((i + len(batch)) / total * 100))
-                    start_market_scan_task_status(task_id, TASK_RUNNING, progress=progress)
-
-                # 按得分排序
-                results.sort(key=lambda x: x['score'], reverse=True)
-
-                # 更新任务状态为完成
-                start_market_scan_task_status(task_id, TASK_COMPLETED, progress=100, result=results)
-                app.logger.info(f"扫描任务 {task_id} 完成，找到 {len(results)} 只符合条件的股票")
-
-            except Exception as e:
-                app.logger.error(f"扫描任务 {task_id} 失败: {str(e)}")
-                app.logger.error(traceback.format_exc())
-                start_market_scan_task_status(task_id, TASK_FAILED, error=str(e))
-
-        # 启动后台线程
-        thread = threading.Thread(target=run_scan)
-        thread.daemon = True
-        thread.start()
+        task, _ = task_queue.submit('market_scan', {
+            'stock_list': stock_list,
+            'min_score': min_score,
+            'market_type': market_type
+        }, total=len(stock_list))
 
         return jsonify({
-            'task_id': task_id,
+            'task_id': task['id'],
             'status': 'pending',
             'message': f'已启动扫描任务，正在处理 {len(stock_list)} 只股票'
         })
@@ -1225,51 +1044,22 @@ def start_market_scan():
 @app.route('/api/scan_status/<task_id>', methods=['GET'])
 def get_scan_status(task_id):
     """获取扫描任务状态"""
-    with task_lock:
-        if task_id not in scan_tasks:
-            return jsonify({'error': '找不到指定的扫描任务'}), 404
-
-        task = scan_tasks[task_id]
-
-        # 基本状态信息
-        status = {
-            'id': task['id'],
-            'status': task['status'],
-            'progress': task.get('progress', 0),
-            'total': task.get('total', 0),
-            'created_at': task['created_at'],
-            'updated_at': task['updated_at']
-        }
-
-        # 如果任务完成，包含结果
-        if task['status'] == TASK_COMPLETED and 'result' in task:
-            status['result'] = task['result']
-
-        # 如果任务失败，包含错误信息
-        if task['status'] == TASK_FAILED and 'error' in task:
-            status['error'] = task['error']
+    task = get_task_of_type(task_id, 'market_scan')
+    if not task:
+        return jsonify({'error': '找不到指定的扫描任务'}), 404
 
-        return custom_jsonify(status)
+    status = task_status_response(task, 'current_stock')
+    for field in ['total', 'processed', 'found', 'failed']:
+        status[field] = task.get(field, 0)
+    # 扫描中也能看到当前排名靠前的股票
+    status['partial'] = task.get('partial', [])
+    return custom_jsonify(status)
 
 
 @app.route('/api/cancel_scan/<task_id>', methods=['POST'])
 def cancel_scan(task_id):
     """取消扫描任务"""
-    with task_lock:
-        if task_id not in scan_tasks:
-            return jsonify({'error': '找不到指定的扫描任务'}), 404
-
-        task = scan_tasks[task_id]
-
-        if task['status'] in [TASK_COMPLETED, TASK_FAILED]:
-            return jsonify({'message': '任务已完成或失败，无法取消'})
-
-        # 更新状态为失败
-        task['status'] = TASK_FAILED
-        task['error'] = '用户取消任务'
-        task['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        return jsonify({'message': '任务已取消'})
+    return cancel_task(task_id, 'market_scan', '找不到指定的扫描任务')
 
 
 @app.route('/api/index_stocks', methods=['GET'])
@@ -1350,69 +1140,35 @@ def get_board_stocks():
         return jsonify({'error': str(e)}), 500
 
 
-# 添加到web_server.py
 def clean_old_tasks():
-    """清理旧的扫描任务"""
-    with task_lock:
-        now = datetime.now()
-        to_delete = []
-
-        for task_id, task in scan_tasks.items():
-            # 解析更新时间
-            try:
-                updated_at = datetime.strptime(task['updated_at'], '%Y-%m-%d %H:%M:%S')
-                # 如果任务完成或失败且超过1小时，或者任务状态异常且超过3小时，清理它
-                if ((task['status'] in [TASK_COMPLETED, TASK_FAILED] and
-                     (now - updated_at).total_seconds() > 3600) or
-                        ((now - updated_at).total_seconds() > 10800)):
-                    to_delete.append(task_id)
-            except:
-                # 日期解析错误，添加到删除列表
-                to_delete.append(task_id)
+    """清理完成或失败超过1小时的扫描任务"""
+    return task_queue.purge('market_scan', [TASK_COMPLETED, TASK_FAILED], older_than=3600)
 
-        # 删除旧任务
-        for task_id in to_delete:
-            del scan_tasks[task_id]
 
-        return len(to_delete)
-
-
-# 修改 run_task_cleaner 函数，使其每 5 分钟运行一次并在 16:30 左右清理所有缓存
 def run_task_cleaner():
-    """定期运行任务清理，并在每天 16:30 左右清理所有缓存"""
+    """定期清理旧任务；每个交易日数据定型后清一次已完成的分析任务
+
+    数据缓存不再整体清空，行情缓存按交易日历自己过期（见 TradingCalendar.cache_ttl）
+    """
+    last_purge_date = None
     while True:
         try:
             now = datetime.now()
-            # 判断是否在收盘时间附近（16:25-16:35）
-            is_market_close_time = (now.hour == 16 and 25 <= now.minute <= 35)
-
             cleaned = clean_old_tasks()
 
-            # 如果是收盘时间，清理所有缓存
-            if is_market_close_time:
-                # 清理分析器的数据缓存
-                analyzer.data_cache.clear()
+            # 过了数据定型时间，当天只清一次，不会因为睡过了时间窗口漏掉
+            if now.time() >= TradingCalendar.SETTLE_TIME and last_purge_date != now.date():
+                last_purge_date = now.date()
+                for task_type in ['stock_analysis', 'etf_analysis']:
+                    task_queue.purge(task_type, [TASK_COMPLETED])
 
-                # 清理 Flask 缓存
-                cache.clear()
-
-                # 清理任务存储
-                with task_lock:
-                    for task_type in tasks:
-                        task_store = tasks[task_type]
-                        completed_tasks = [task_id for task_id, task in task_store.items()
-                                           if task['status'] == TASK_COMPLETED]
-                        for task_id in completed_tasks:
-                            del task_store[task_id]
-
-                app.logger.info("市场收盘时间检测到，已清理所有缓存数据")
+                app.logger.info("已清理当日完成的分析任务")
 
             if cleaned > 0:
                 app.logger.info(f"清理了 {cleaned} 个旧的扫描任务")
         except Exception as e:
             app.logger.error(f"任务清理出错: {str(e)}")
 
-        # 每 5 分钟运行一次，而不是每小时
         time.sleep(600)
 
 
@@ -1606,6 +1362,55 @@ def api_portfolio_risk():
         return jsonify({'error': str(e)}), 500
 
 
+def run_group_analysis(ctx, analyze, *args):
+    """指数/行业成分股分析任务：每分析完一只成分股推一条 hit，取消时扫描马上停下"""
+    counters = {'processed': 0, 'failed': 0}
+    ctx.update(progress=0, current_stock=None, **counters)
+
+    def on_progress(processed, total, stock_code, report, error):
+        counters['processed'] = processed
+        if error:
+            counters['failed'] += 1
+        else:
+            ctx.emit('hit', report)
+        ctx.update(progress=min(99, int(processed / total * 100)), current_stock=stock_code, total=total, **counters)
+
+    result = analyze(*args, progress_callback=on_progress, should_stop=ctx.cancelled)
+    ctx.check_cancelled()
+    if 'error' in result:
+        raise Exception(result['error'])
+    return result
+
+
+def run_index_analysis(ctx):
+    """指数分析任务"""
+    return run_group_analysis(ctx, index_industry_analyzer.analyze_index,
+                              ctx.params['index_code'], ctx.params.get('limit', 30))
+
+
+def run_industry_analysis(ctx):
+    """行业分析任务"""
+    return run_group_analysis(ctx, index_industry_analyzer.analyze_industry,
+                              ctx.params['industry'], ctx.params.get('limit', 30))
+
+
+# 结果由分析器自己缓存1小时，任务只复用排队中/运行中的；失败不自动重跑
+task_queue.register('index_analysis', run_index_analysis, priority=5, max_retries=0)
+task_queue.register('industry_analysis', run_industry_analysis, priority=5, max_retries=0)
+
+
+def start_group_analysis(task_type, params, key, label):
+    """提交指数/行业分析任务，进度和逐只结果通过 /api/task_stream/<task_id> 获取"""
+    task, is_new = task_queue.submit(task_type, params, key=key, reuse_completed=False)
+    if is_new:
+        app.logger.info(f"创建新的{label}任务: {task['id']}")
+    return jsonify({
+        'task_id': task['id'],
+        'status': task['status'],
+        'message': f'已启动{label}任务'
+    })
+
+
 # 指数分析路由
 @app.route('/api/index_analysis', methods=['GET'])
 def api_index_analysis():
@@ -1644,6 +1449,72 @@ def api_industry_analysis():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/start_index_analysis', methods=['POST'])
+def start_index_analysis():
+    """启动指数分析任务（/api/index_analysis 的异步版本，可以流式看进度、中途取消）"""
+    try:
+        data = request.json or {}
+        index_code = data.get('index_code')
+        limit = int(data.get('limit', 30))
+
+        if not index_code:
+            return jsonify({'error': '请提供指数代码'}), 400
+
+        return start_group_analysis('index_analysis', {'index_code': index_code, 'limit': limit},
+                                    f"{index_code}_{limit}", '指数分析')
+    except Exception as e:
+        app.logger.error(f"启动指数分析任务出错: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/start_industry_analysis', methods=['POST'])
+def start_industry_analysis():
+    """启动行业分析任务（/api/industry_analysis 的异步版本，可以流式看进度、中途取消）"""
+    try:
+        data = request.json or {}
+        industry = data.get('industry')
+        limit = int(data.get('limit', 30))
+
+        if not industry:
+            return jsonify({'error': '请提供行业名称'}), 400
+
+        return start_group_analysis('industry_analysis', {'industry': industry, 'limit': limit},
+                                    f"{industry}_{limit}", '行业分析')
+    except Exception as e:
+        app.logger.error(f"启动行业分析任务出错: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/index_analysis_status/<task_id>', methods=['GET'])
+def get_index_analysis_status(task_id):
+    """获取指数分析任务状态"""
+    task = get_task_of_type(task_id, 'index_analysis')
+    if not task:
+        return jsonify({'error': '找不到指定的指数分析任务'}), 404
+    return custom_jsonify(task_status_response(task, 'current_stock', 'total', 'processed', 'failed'))
+
+
+@app.route('/api/industry_analysis_status/<task_id>', methods=['GET'])
+def get_industry_analysis_status(task_id):
+    """获取行业分析任务状态"""
+    task = get_task_of_type(task_id, 'industry_analysis')
+    if not task:
+        return jsonify({'error': '找不到指定的行业分析任务'}), 404
+    return custom_jsonify(task_status_response(task, 'current_stock', 'total', 'processed', 'failed'))
+
+
+@app.route('/api/cancel_index_analysis/<task_id>', methods=['POST'])
+def cancel_index_analysis(task_id):
+    """取消指数分析任务"""
+    return cancel_task(task_id, 'index_analysis', '找不到指定的指数分析任务')
+
+
+@app.route('/api/cancel_industry_analysis/<task_id>', methods=['POST'])
+def cancel_industry_analysis(task_id):
+    """取消行业分析任务"""
+    return cancel_task(task_id, 'industry_analysis', '找不到指定的行业分析任务')
+
+
 @app.route('/api/industry_fund_flow', methods=['GET'])
 def api_industry_fund_flow():
     """获取行业资金流向数据"""
@@ -1898,90 +1769,141 @@ def get_latest_news():
 
 
 
-# --- Start of new FileSessionManager implementation ---
-class FileSessionManager:
-    """A Flask-compatible file-based session manager for agent tasks."""
-    def __init__(self, data_dir):
-        self.data_dir = Path(data_dir)
-        self.data_dir.mkdir(parents=True, exist_ok=True)
+def import_agent_sessions(sessions_dir):
+    """把旧版按文件保存的智能体分析记录导入任务队列，导入过的文件加 .imported 后缀"""
+    sessions_dir = Path(sessions_dir)
+    if not sessions_dir.exists():
+        return
+    imported = 0
+    for task_file in sessions_dir.glob("*.json"):
+        try:
+            with open(task_file, 'r', encoding='utf-8') as f:
+                task = json.load(f)
+            task['type'] = 'agent_analysis'
+            if task.get('status') in [TASK_PENDING, TASK_RUNNING, TASK_CANCELLED]:
+                task['status'] = TASK_FAILED
+                task['error'] = task.get('error') or '任务因服务器重启或超时而中止'
+            task.pop('cancel_event', None)
+            if task_queue.restore(task):
+                imported += 1
+            task_file.rename(task_file.with_suffix('.json.imported'))
+        except Exception as e:
+            app.logger.warning(f"导入智能体分析记录 {task_file.name} 失败: {e}")
+    if imported:
+        app.logger.info(f"已把 {imported} 条旧的智能体分析记录导入任务队列")
 
-    def _get_task_path(self, task_id):
-        return self.data_dir / f"{task_id}.json"
 
-    def save_task(self, task_data):
-        if 'id' not in task_data:
-            app.logger.error("Attempted to save task without an 'id'")
-            return
-        task_id = task_data['id']
-        task_file = self._get_task_path(task_id)
-        with open(task_file, 'w', encoding='utf-8') as f:
-            json.dump(task_data, f, ensure_ascii=False, indent=4, cls=NumpyJSONEncoder)
+AGENT_SESSIONS_DIR = os.path.join(os.path.dirname(__file__), '../../data/agent_sessions')
+import_agent_sessions(AGENT_SESSIONS_DIR)
 
-    def load_task(self, task_id):
-        task_file = self._get_task_path(task_id)
-        if not task_file.exists():
-            return None
-        with open(task_file, 'r', encoding='utf-8') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                app.logger.error(f"Failed to decode JSON for task {task_id}")
-                return None
 
-    def get_all_tasks(self):
-        tasks = []
-        for task_file in self.data_dir.glob("*.json"):
-            with open(task_file, 'r', encoding='utf-8') as f:
-                try:
-                    tasks.append(json.load(f))
-                except json.JSONDecodeError:
-                    app.logger.warning(f"Skipping corrupted task file: {task_file.name}")
-                    continue
-        return tasks
-
-    def cleanup_stale_tasks(self, timeout_hours=2):
-        """Clean up stale 'running' tasks that have exceeded a timeout."""
-        app.logger.info("开始清理过时的任务...")
-        cleaned_count = 0
-        now = datetime.now()
-        
-        tasks = self.get_all_tasks()
-        for task in tasks:
-            if task.get('status') == TASK_RUNNING:
-                try:
-                    updated_at = datetime.strptime(task.get('updated_at'), '%Y-%m-%d %H:%M:%S')
-                    if (now - updated_at).total_seconds() > timeout_hours * 3600:
-                        task['status'] = TASK_FAILED
-                        task['error'] = '任务因服务器重启或超时而中止'
-                        task['updated_at'] = now.strftime('%Y-%m-%d %H:%M:%S')
-                        self.save_task(task)
-                        cleaned_count += 1
-                        app.logger.warning(f"清理了过时的任务 {task.get('id')}，该任务已运行超过 {timeout_hours} 小时。")
-                except (ValueError, TypeError) as e:
-                    app.logger.error(f"解析任务 {task.get('id')} 的 updated_at 时出错: {e}")
-                    continue
-        
-        if cleaned_count > 0:
-            app.logger.info(f"清理完成，共处理了 {cleaned_count} 个过时的任务。")
-        else:
-            app.logger.info("没有发现需要清理的过时任务。")
+def run_agent_analysis(ctx):
+    """智能体分析任务"""
+    params = ctx.params
+    stock_code = params['stock_code']
+    market_type = params.get('market_type', 'A')
+    selected_analysts = params.get('selected_analysts') or ["market", "social", "news", "fundamentals"]
+    analysis_date = params.get('analysis_date')
+    enable_memory = params.get('enable_memory', True)
+    max_output_length = params.get('max_output_length', 2048)
+
+    def report_step(progress, step):
+        # 当前步骤放在结果里（沿用原来的格式），同时推一条 step 事件
+        ctx.update(progress=progress, result={'current_step': step})
+        ctx.emit('step', {'progress': progress, 'step': step})
+
+    try:
+        from tradingagents.graph.trading_graph import TradingAgentsGraph
+        from tradingagents.default_config import DEFAULT_CONFIG
+
+        report_step(5, '正在初始化智能体...')
+
+        # --- 修复 Start: 强制使用主应用的OpenAI代理配置 ---
+        config = DEFAULT_CONFIG.copy()
+        config['llm_provider'] = 'openai'
+        config['backend_url'] = os.getenv('OPENAI_API_URL')
+        main_model = os.getenv('OPENAI_API_MODEL', 'gpt-4o')
+        config['deep_think_llm'] = main_model
+        config['quick_think_llm'] = main_model
+        config['memory_enabled'] = enable_memory
+        config['max_tokens'] = max_output_length
+
+        if not os.getenv('OPENAI_API_KEY'):
+            raise ValueError("主应用的 OPENAI_API_KEY 未在.env文件中设置")
+
+        app.logger.info(f"强制使用主应用代理配置进行智能体分析: provider={config['llm_provider']}, url={config['backend_url']}, model={config['deep_think_llm']}")
+
+        ta = TradingAgentsGraph(
+            selected_analysts=selected_analysts,
+            debug=True, 
+            config=config
+        )
+        # --- 修复 End ---
+
+        def progress_callback(progress, step):
+            ctx.check_cancelled()
+            report_step(progress, step)
+
+        today = analysis_date or datetime.now().strftime('%Y-%m-%d')
+
+        # Issue #34 修复: 检查propagate方法签名，兼容不同版本的tradingagents库
+        import inspect
+        propagate_sig = inspect.signature(ta.propagate)
+        propagate_params = propagate_sig.parameters
 
-    def delete_task(self, task_id):
-        """Safely delete a task file."""
+        kwargs = {}
+        if 'market_type' in propagate_params:
+            kwargs['market_type'] = market_type
+        if 'progress_callback' in propagate_params:
+            kwargs['progress_callback'] = progress_callback
+
+        # 由于tradingagents库不支持progress_callback，手动更新进度
+        report_step(30, '正在进行多智能体分析...')
+        state, raw_decision = ta.propagate(stock_code, today, **kwargs)
+        report_step(90, '正在生成分析报告...')
+
+        # 修复：在任务完成时，获取并添加公司名称到最终结果中
         try:
-            task_file = self._get_task_path(task_id)
-            if task_file.exists():
-                task_file.unlink()
-                return True
+            stock_info = analyzer.get_stock_info(stock_code)
+            stock_name = stock_info.get('股票名称', '未知')
+            if isinstance(state, dict):
+                state['company_name'] = stock_name
         except Exception as e:
-            app.logger.error(f"Failed to delete task {task_id}: {e}")
-        return False
+            app.logger.error(f"为 {stock_code} 获取公司名称时出错: {e}")
+            if isinstance(state, dict):
+                state['company_name'] = '名称获取失败'
+
+        # 构造前端期望的decision对象格式
+        final_trade_decision = state.get('final_trade_decision', '') if isinstance(state, dict) else ''
+        action = raw_decision.strip().upper() if raw_decision else 'HOLD'
+        if action not in ['BUY', 'SELL', 'HOLD']:
+            # 尝试从final_trade_decision中提取
+            if 'BUY' in final_trade_decision.upper():
+                action = 'BUY'
+            elif 'SELL' in final_trade_decision.upper():
+                action = 'SELL'
+            else:
+                action = 'HOLD'
+
+        decision_obj = {
+            'action': action,
+            'reasoning': final_trade_decision[:500] if final_trade_decision else '分析完成',
+            'confidence': 0.7,
+            'risk_score': 0.5
+        }
 
-# Instantiate the manager
-AGENT_SESSIONS_DIR = os.path.join(os.path.dirname(__file__), '../../data/agent_sessions')
-agent_session_manager = FileSessionManager(AGENT_SESSIONS_DIR)
-agent_session_manager.cleanup_stale_tasks()
-# --- End of new FileSessionManager implementation ---
+        app.logger.info(f"智能体分析任务 {ctx.task_id} 完成")
+        return {'decision': decision_obj, 'final_state': state, 'current_step': '分析完成'}
+
+    except TaskCancelledException:
+        raise
+    except Exception as e:
+        ctx.update(result={'current_step': f'分析失败: {e}'})
+        raise
+
+
+# 大模型调用又慢又贵：不自动重跑，单进程同时最多跑两个
+task_queue.register('agent_analysis', run_agent_analysis, priority=5, max_retries=0, concurrency=2)
 
 
 # 智能体分析路由
@@ -1991,141 +1913,23 @@ def start_agent_analysis():
     try:
         data = request.json
         stock_code = data.get('stock_code')
-        research_depth = data.get('research_depth', 3)
-        market_type = data.get('market_type', 'A')
-        selected_analysts = data.get('selected_analysts', ["market", "social", "news", "fundamentals"])
-        analysis_date = data.get('analysis_date')
-        enable_memory = data.get('enable_memory', True)
-        max_output_length = data.get('max_output_length', 2048)
 
         if not stock_code:
             return jsonify({'error': '请提供股票代码'}), 400
 
         # 创建新任务
-        task_id = generate_task_id()
-        task = {
-            'id': task_id,
-            'status': TASK_PENDING,
-            'progress': 0,
-            'current_step': '任务已创建',
-            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'params': {
-                'stock_code': stock_code,
-                'research_depth': research_depth,
-                'market_type': market_type,
-                'selected_analysts': selected_analysts,
-                'analysis_date': analysis_date,
-                'enable_memory': enable_memory,
-                'max_output_length': max_output_length
-            }
-        }
-        
-        # 为任务创建取消事件
-        task['cancel_event'] = threading.Event()
-        agent_session_manager.save_task(task)
-        
-        def run_agent_analysis():
-            """在后台线程中运行智能体分析"""
-            try:
-                from tradingagents.graph.trading_graph import TradingAgentsGraph
-                from tradingagents.default_config import DEFAULT_CONFIG
-                
-                update_task_status('agent_analysis', task_id, TASK_RUNNING, progress=5, result={'current_step': '正在初始化智能体...'})
-
-                # --- 修复 Start: 强制使用主应用的OpenAI代理配置 ---
-                config = DEFAULT_CONFIG.copy()
-                config['llm_provider'] = 'openai'
-                config['backend_url'] = os.getenv('OPENAI_API_URL')
-                main_model = os.getenv('OPENAI_API_MODEL', 'gpt-4o')
-                config['deep_think_llm'] = main_model
-                config['quick_think_llm'] = main_model
-                config['memory_enabled'] = enable_memory
-                config['max_tokens'] = max_output_length
-                
-                if not os.getenv('OPENAI_API_KEY'):
-                    raise ValueError("主应用的 OPENAI_API_KEY 未在.env文件中设置")
-
-                app.logger.info(f"强制使用主应用代理配置进行智能体分析: provider={config['llm_provider']}, url={config['backend_url']}, model={config['deep_think_llm']}")
-
-                ta = TradingAgentsGraph(
-                    selected_analysts=selected_analysts,
-                    debug=True, 
-                    config=config
-                )
-                # --- 修复 End ---
-                
-                def progress_callback(progress, step):
-                    current_task = agent_session_manager.load_task(task_id)
-                    if not current_task or current_task.get('status') == TASK_CANCELLED:
-                         raise TaskCancelledException(f"任务 {task_id} 已被用户取消")
-                    update_task_status('agent_analysis', task_id, TASK_RUNNING, progress=progress, result={'current_step': step})
-
-                today = analysis_date or datetime.now().strftime('%Y-%m-%d')
-
-                # Issue #34 修复: 检查propagate方法签名，兼容不同版本的tradingagents库
-                import inspect
-                propagate_sig = inspect.signature(ta.propagate)
-                propagate_params = propagate_sig.parameters
-
-                kwargs = {}
-                if 'market_type' in propagate_params:
-                    kwargs['market_type'] = market_type
-                if 'progress_callback' in propagate_params:
-                    kwargs['progress_callback'] = progress_callback
-
-                # 由于tradingagents库不支持progress_callback，手动更新进度
-                update_task_status('agent_analysis', task_id, TASK_RUNNING, progress=30, result={'current_step': '正在进行多智能体分析...'})
-                state, raw_decision = ta.propagate(stock_code, today, **kwargs)
-                update_task_status('agent_analysis', task_id, TASK_RUNNING, progress=90, result={'current_step': '正在生成分析报告...'})
-
-                # 修复：在任务完成时，获取并添加公司名称到最终结果中
-                try:
-                    stock_info = analyzer.get_stock_info(stock_code)
-                    stock_name = stock_info.get('股票名称', '未知')
-                    if isinstance(state, dict):
-                        state['company_name'] = stock_name
-                except Exception as e:
-                    app.logger.error(f"为 {stock_code} 获取公司名称时出错: {e}")
-                    if isinstance(state, dict):
-                        state['company_name'] = '名称获取失败'
-
-                # 构造前端期望的decision对象格式
-                final_trade_decision = state.get('final_trade_decision', '') if isinstance(state, dict) else ''
-                action = raw_decision.strip().upper() if raw_decision else 'HOLD'
-                if action not in ['BUY', 'SELL', 'HOLD']:
-                    # 尝试从final_trade_decision中提取
-                    if 'BUY' in final_trade_decision.upper():
-                        action = 'BUY'
-                    elif 'SELL' in final_trade_decision.upper():
-                        action = 'SELL'
-                    else:
-                        action = 'HOLD'
-
-                decision_obj = {
-                    'action': action,
-                    'reasoning': final_trade_decision[:500] if final_trade_decision else '分析完成',
-                    'confidence': 0.7,
-                    'risk_score': 0.5
-                }
-
-                update_task_status('agent_analysis', task_id, TASK_COMPLETED, progress=100, result={'decision': decision_obj, 'final_state': state, 'current_step': '分析完成'})
-                app.logger.info(f"智能体分析任务 {task_id} 完成")
-
-            except TaskCancelledException as e:
-                app.logger.info(str(e))
-                update_task_status('agent_analysis', task_id, TASK_FAILED, error='任务已被用户取消', result={'current_step': '任务已被用户取消'})
-            except Exception as e:
-                app.logger.error(f"智能体分析任务 {task_id} 失败: {str(e)}")
-                app.logger.error(traceback.format_exc())
-                update_task_status('agent_analysis', task_id, TASK_FAILED, error=str(e), result={'current_step': f'分析失败: {e}'})
-
-        thread = threading.Thread(target=run_agent_analysis)
-        thread.daemon = True
-        thread.start()
+        task, _ = task_queue.submit('agent_analysis', {
+            'stock_code': stock_code,
+            'research_depth': data.get('research_depth', 3),
+            'market_type': data.get('market_type', 'A'),
+            'selected_analysts': data.get('selected_analysts', ["market", "social", "news", "fundamentals"]),
+            'analysis_date': data.get('analysis_date'),
+            'enable_memory': data.get('enable_memory', True),
+            'max_output_length': data.get('max_output_length', 2048)
+        }, current_step='任务已创建')
 
         return jsonify({
-            'task_id': task_id,
+            'task_id': task['id'],
             'status': 'pending',
             'message': f'已启动对 {stock_code} 的智能体分析'
         })
@@ -2137,7 +1941,7 @@ def start_agent_analysis():
 @app.route('/api/agent_analysis_status/<task_id>', methods=['GET'])
 def get_agent_analysis_status(task_id):
     """获取智能体分析任务的状态"""
-    task = agent_session_manager.load_task(task_id)
+    task = get_task_of_type(task_id, 'agent_analysis')
 
     if not task:
         return jsonify({'error': '找不到指定的智能体分析任务'}), 404
@@ -2164,11 +1968,7 @@ def get_agent_analysis_status(task_id):
 def get_agent_analysis_history():
     """获取已完成的智能体分析任务历史"""
     try:
-        all_tasks = agent_session_manager.get_all_tasks()
-        history = [
-            task for task in all_tasks 
-            if task.get('status') in [TASK_COMPLETED, TASK_FAILED]
-        ]
+        history = task_queue.list('agent_analysis', [TASK_COMPLETED, TASK_FAILED])
         # 按更新时间排序，最新的在前
         history.sort(key=lambda x: x.get('updated_at', ''), reverse=True)
         return custom_jsonify({'history': history})
@@ -2193,25 +1993,21 @@ def delete_agent_analysis():
         cancelled_count = 0
         
         for task_id in task_ids:
-            task = agent_session_manager.load_task(task_id)
+            task = get_task_of_type(task_id, 'agent_analysis')
             if not task:
                 app.logger.warning(f"尝试删除一个不存在的任务: {task_id}")
                 continue
 
-            # If the task is running, mark it as cancelled
-            if task.get('status') == TASK_RUNNING:
-                task['status'] = TASK_CANCELLED
-                task['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                task['error'] = '任务已被用户取消'
-                agent_session_manager.save_task(task)
+            # If the task is queued or running, mark it as cancelled
+            if task_queue.cancel(task_id, error='任务已被用户取消'):
                 cancelled_count += 1
                 app.logger.info(f"任务 {task_id} 已被标记为取消。")
             
-            # For all other states (or after cancelling), delete the task file
-            if agent_session_manager.delete_task(task_id):
+            # For all other states (or after cancelling), delete the task
+            if task_queue.delete(task_id):
                 deleted_count += 1
         
-        message = f"请求处理 {len(task_ids)} 个任务。已取消 {cancelled_count} 个运行中的任务，并删除了 {deleted_count} 个任务文件。"
+        message = f"请求处理 {len(task_ids)} 个任务。已取消 {cancelled_count} 个运行中的任务，并删除了 {deleted_count} 个任务。"
         app.logger.info(message)
         return jsonify({'success': True, 'message': message})
 
@@ -2223,19 +2019,18 @@ def delete_agent_analysis():
 
 @app.route('/api/active_tasks', methods=['GET'])
 def get_active_tasks():
-    """获取所有正在进行的智能体分析任务"""
+    """获取所有排队中和正在进行的智能体分析任务"""
     try:
-        all_tasks = agent_session_manager.get_all_tasks()
         active_tasks_list = []
-        for task in all_tasks:
-            if task.get('status') == TASK_RUNNING:
-                task_info = {
-                    'task_id': task['id'],
-                    'stock_code': task.get('params', {}).get('stock_code'),
-                    'progress': task.get('progress', 0),
-                    'current_step': task.get('result', {}).get('current_step', '加载中...')
-                }
-                active_tasks_list.append(task_info)
+        for task in task_queue.list('agent_analysis', [TASK_PENDING, TASK_RUNNING]):
+            task_info = {
+                'task_id': task['id'],
+                'stock_code': task.get('params', {}).get('stock_code'),
+                'progress': task.get('progress', 0),
+                'current_step': (task.get('result') or {}).get('current_step') or task.get('current_step', '加载中...'),
+                'created_at': task['created_at']
+            }
+            active_tasks_list.append(task_info)
         # 按创建时间排序，最新的在前
         active_tasks_list.sort(key=lambda x: x.get('created_at', ''), reverse=True)
         return custom_jsonify({'active_tasks': active_tasks_list})
@@ -2244,6 +2039,76 @@ def get_active_tasks():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/task_queue/status', methods=['GET'])
+def get_task_queue_status():
+    """任务队列各类任务的数量和本进程的运行情况"""
+    try:
+        return custom_jsonify(task_queue.get_stats())
+    except Exception as e:
+        app.logger.error(f"获取任务队列状态出错: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/cache_warmer/status', methods=['GET'])
+def get_cache_warmer_status():
+    """获取缓存预热进度和耗时，以及缓存命中统计"""
+    try:
+        from app.core.cache import get_cache
+        return custom_jsonify({'warmer': cache_warmer.get_status(), 'cache': get_cache().get_stats()})
+    except Exception as e:
+        app.logger.error(f"获取缓存预热状态出错: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/cache_warmer/trigger', methods=['POST'])
+def trigger_cache_warmer():
+    """手动触发一次缓存预热，可传 stock_codes 只预热指定股票"""
+    try:
+        data = request.get_json(silent=True) or {}
+        codes = data.get('stock_codes')
+        if codes is not None and not isinstance(codes, list):
+            return jsonify({'error': 'stock_codes 必须是股票代码列表'}), 400
+
+        if not cache_warmer.trigger(codes):
+            return jsonify({'error': '缓存预热正在进行中', 'warmer': cache_warmer.get_status()}), 409
+        return custom_jsonify({'message': '缓存预热已启动'})
+    except Exception as e:
+        app.logger.error(f"触发缓存预热出错: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/data_source/metrics', methods=['GET'])
+def get_data_source_metrics():
+    """数据源每个接口的耗时直方图、返回行数、成败和兜底路径，以及限流和熔断状态
+
+    可选参数 source 按来源前缀过滤，如 adapter: / akshare: / akshare:eastmoney / baostock:
+    默认合并本机所有 worker 的计数，scope=process 只看处理这个请求的进程；限流和熔断状态总是本进程的
+    """
+    try:
+        from app.core.data_provider import get_data_provider
+        metrics = get_metrics()
+        source = request.args.get('source')
+        if request.args.get('scope') == 'process':
+            result = {'metrics': metrics.snapshot(source), 'owner': metrics.owner, 'scope': 'process'}
+        else:
+            try:
+                result = {**metrics.aggregate(source), 'scope': 'all'}
+            except Exception as e:
+                app.logger.warning(f"合并各 worker 指标失败，只返回本进程的: {e}")
+                result = {'metrics': metrics.snapshot(source), 'owner': metrics.owner, 'scope': 'process'}
+        result['status'] = get_data_provider().get_status()
+        return custom_jsonify(result)
+    except Exception as e:
+        app.logger.error(f"获取数据源指标出错: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+
+# 所有任务类型注册完后再启动任务队列的工作线程
+task_queue.start()
+
+# 定期发布本进程的数据源指标，/api/data_source/metrics 合并各 worker 的计数
+get_metrics().start_publishing()
+
 # 在应用启动时启动清理线程（保持原有代码不变）
 cleaner_thread = threading.Thread(target=run_task_cleaner)
 cleaner_thread.daemon = True
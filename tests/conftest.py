@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共配置 - 老王说：跑个测试别把 data/ 目录写得到处都是，也别连真数据源！
+导入 app 之前把各种落盘路径指到临时目录，共享缓存和缓存预热都关掉。
+"""
+import os
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix='stockanal-tests-')
+
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('SHARED_CACHE_BACKEND', 'none')
+os.environ.setdefault('CACHE_WARM_ENABLED', 'false')
+os.environ.setdefault('BAR_STORE_DIR', os.path.join(_TMP_DIR, 'bars'))
+os.environ.setdefault('TASK_DB_PATH', os.path.join(_TMP_DIR, 'tasks.db'))
+os.environ.setdefault('METRICS_DB_PATH', os.path.join(_TMP_DIR, 'metrics.db'))
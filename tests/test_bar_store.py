@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""本地K线仓库：缺口计算、写入读取、覆盖区间合并、冲突检测、并发读写"""
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.core.bar_store import BarStore
+
+
+def make_bars(start, end, close=10.0, volume=1e6, source=None):
+    dates = pd.bdate_range(start, end).astype('datetime64[ns]')
+    n = len(dates)
+    closes = close + dates.dayofyear.to_numpy(dtype='f8') * 0.01
+    df = pd.DataFrame({
+        'date': dates,
+        'open': closes - 0.05,
+        'high': closes + 0.1,
+        'low': closes - 0.1,
+        'close': closes,
+        'volume': np.full(n, volume),
+        'amount': np.full(n, volume) * closes,
+    })
+    if source:
+        df.attrs['source'] = source
+    return df
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BarStore(root_dir=str(tmp_path / 'bars'))
+
+
+def test_missing_ranges_on_empty_store_trims_to_business_days(store):
+    # 2024-01-06/07 是周末
+    assert store.missing_ranges('000001', 'qfq', '2024-01-06', '2024-01-12') == \
+        [(pd.Timestamp('2024-01-08'), pd.Timestamp('2024-01-12'))]
+    assert store.missing_ranges('000001', 'qfq', '2024-01-06', '2024-01-07') == []
+    assert store.missing_ranges('000001', 'qfq', '2024-01-12', '2024-01-08') == []
+
+
+def test_write_read_round_trip(store):
+    df = make_bars('2024-01-02', '2024-03-29')
+    assert store.write('sz000001', 'qfq', df, '2024-01-01', '2024-03-31')
+
+    out = store.read('000001', 'qfq')
+    pd.testing.assert_frame_equal(out, df.reset_index(drop=True), check_freq=False)
+    assert out['date'].dtype == np.dtype('datetime64[ns]')
+
+    sliced = store.read('000001', 'qfq', '2024-02-01', '20240229')
+    assert sliced['date'].min() == pd.Timestamp('2024-02-01')
+    assert sliced['date'].max() == pd.Timestamp('2024-02-29')
+
+    assert store.coverage('000001', 'qfq') == (pd.Timestamp('2024-01-01'), pd.Timestamp('2024-03-31'))
+    assert store.last_bar_date('000001', 'qfq') == pd.Timestamp('2024-03-29')
+    # 复权类型分开存
+    assert store.read('000001', 'hfq').empty
+
+
+def test_missing_ranges_after_write_only_head_and_tail(store):
+    store.write('000001', 'qfq', make_bars('2024-02-01', '2024-02-29'), '2024-02-01', '2024-02-29')
+
+    assert store.missing_ranges('000001', 'qfq', '2024-02-05', '2024-02-20') == []
+    assert store.missing_ranges('000001', 'qfq', '2024-01-29', '2024-03-05') == [
+        (pd.Timestamp('2024-01-29'), pd.Timestamp('2024-01-31')),
+        (pd.Timestamp('2024-03-01'), pd.Timestamp('2024-03-05')),
+    ]
+
+
+def test_adjacent_write_extends_coverage(store):
+    store.write('000001', 'qfq', make_bars('2024-01-02', '2024-01-31'), '2024-01-01', '2024-01-31')
+    store.write('000001', 'qfq', make_bars('2024-02-01', '2024-02-29'), '2024-02-01', '2024-02-29')
+
+    assert store.coverage('000001', 'qfq') == (pd.Timestamp('2024-01-01'), pd.Timestamp('2024-02-29'))
+    assert store.missing_ranges('000001', 'qfq', '2024-01-02', '2024-02-29') == []
+    assert len(store.read('000001', 'qfq')) == len(pd.bdate_range('2024-01-02', '2024-02-29'))
+
+
+def test_gap_between_writes_is_not_covered(store):
+    store.write('000001', 'qfq', make_bars('2024-01-02', '2024-01-31'), '2024-01-01', '2024-01-31')
+    store.write('000001', 'qfq', make_bars('2024-03-01', '2024-03-29'), '2024-03-01', '2024-03-31')
+
+    # 中间二月没抓过，不能算已覆盖
+    assert store.coverage('000001', 'qfq') == (pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-31'))
+    assert store.missing_ranges('000001', 'qfq', '2024-01-02', '2024-02-29') == \
+        [(pd.Timestamp('2024-02-01'), pd.Timestamp('2024-02-29'))]
+
+
+def test_overlapping_write_replaces_same_dates(store):
+    store.write('000001', 'qfq', make_bars('2024-01-02', '2024-01-31'), '2024-01-01', '2024-01-31')
+    store.write('000001', 'qfq', make_bars('2024-01-15', '2024-02-09', close=20.0), '2024-01-15', '2024-02-09')
+
+    out = store.read('000001', 'qfq')
+    assert out['date'].is_unique and out['date'].is_monotonic_increasing
+    assert out.loc[out['date'] == pd.Timestamp('2024-01-12'), 'close'].iloc[0] < 20
+    assert out.loc[out['date'] == pd.Timestamp('2024-01-15'), 'close'].iloc[0] > 20
+
+
+def test_write_rejects_frames_missing_columns(store):
+    df = make_bars('2024-01-02', '2024-01-31').drop(columns=['close'])
+    assert not store.write('000001', 'qfq', df, '2024-01-01', '2024-01-31')
+    assert not store.has_data('000001', 'qfq')
+
+
+def test_source_recorded_in_meta(store):
+    store.write('000001', 'qfq', make_bars('2024-01-02', '2024-01-31', source='akshare'), '2024-01-01', '2024-01-31')
+    store.write('000001', 'qfq', make_bars('2024-02-01', '2024-02-29', source='baostock'), '2024-02-01', '2024-02-29')
+
+    meta = store.load_meta('000001', 'qfq')
+    assert meta['source'] == 'baostock'
+    assert meta['sources'] == ['akshare', 'baostock']
+
+
+def test_conflicts(store):
+    store.write('000001', 'qfq', make_bars('2024-01-02', '2024-01-31'), '2024-01-01', '2024-01-31')
+
+    assert not store.conflicts('000001', 'qfq', make_bars('2024-01-15', '2024-02-09'))
+    # 没有重叠日期不算冲突
+    assert not store.conflicts('000001', 'qfq', make_bars('2024-03-01', '2024-03-29', close=50.0))
+    # 复权因子变了
+    assert store.conflicts('000001', 'qfq', make_bars('2024-01-15', '2024-02-09', close=11.0))
+    # 成交量单位是手
+    assert store.conflicts('000001', 'qfq', make_bars('2024-01-15', '2024-02-09', volume=1e4))
+
+
+def test_invalidate(store):
+    store.write('000001', 'qfq', make_bars('2024-01-02', '2024-01-31'), '2024-01-01', '2024-01-31')
+    store.invalidate('000001', 'qfq')
+    assert not store.has_data('000001', 'qfq')
+    assert store.read('000001', 'qfq').empty
+    assert len(store.missing_ranges('000001', 'qfq', '2024-01-02', '2024-01-31')) == 1
+
+
+def test_reads_never_see_empty_data_during_concurrent_writes(store):
+    df = make_bars('2024-01-02', '2024-06-28')
+    store.write('000001', 'qfq', df, '2024-01-01', '2024-06-30')
+    stop = threading.Event()
+
+    def writer():
+        while not stop.is_set():
+            store.write('000001', 'qfq', df, '2024-01-01', '2024-06-30')
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        empty_reads = sum(1 for _ in range(500) if store.read('000001', 'qfq').empty)
+    finally:
+        stop.set()
+        thread.join()
+    assert empty_reads == 0
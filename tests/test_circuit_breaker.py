@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""熔断器状态切换，以及故障转移管理器里熔断器和适配器异常、对冲请求的配合"""
+from concurrent.futures import Future
+
+import pandas as pd
+import pytest
+
+from app.adapters.base_adapter import UpstreamError
+from app.core.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from app.core.fallback_manager import FallbackManager
+
+
+def make_breaker(**kwargs):
+    params = dict(failure_threshold=3, recovery_timeout=10, max_recovery_timeout=100)
+    params.update(kwargs)
+    return CircuitBreaker(**params)
+
+
+def half_open(breaker):
+    """熔断后把冷却时间拨到现在，下一次 allow_request 转半开"""
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    breaker.open_until = 0
+    return breaker
+
+
+def test_trips_after_threshold_and_rejects_while_open():
+    breaker = make_breaker()
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == CLOSED and breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+
+def test_success_resets_consecutive_failures():
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_single_probe():
+    breaker = half_open(make_breaker())
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_failed_probe_reopens_with_longer_backoff(monkeypatch):
+    monkeypatch.setattr('app.core.circuit_breaker.random.uniform', lambda a, b: 1.0)
+    monkeypatch.setattr('app.core.circuit_breaker.time.time', lambda: 1000.0)
+    breaker = half_open(make_breaker())
+    assert breaker.open_count == 1
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.open_count == 2
+    assert breaker.open_until == pytest.approx(1000.0 + 20)
+
+    breaker.open_until = 0
+    breaker.allow_request()
+    breaker.record_failure()
+    breaker.open_until = 0
+    breaker.allow_request()
+    breaker.record_failure()
+    breaker.open_until = 0
+    breaker.allow_request()
+    breaker.record_failure()
+    # 冷却时间封顶
+    assert breaker.open_until == pytest.approx(1000.0 + 100)
+
+
+def test_empty_result_is_not_a_failure():
+    breaker = make_breaker()
+    for _ in range(10):
+        breaker.record_empty()
+    assert breaker.state == CLOSED
+    assert breaker.consecutive_failures == 0
+    assert breaker.empty_results == 10
+    assert breaker.samples == 0
+
+
+def test_empty_result_keeps_half_open_and_releases_probe():
+    breaker = half_open(make_breaker())
+    assert breaker.allow_request()
+    breaker.record_empty()
+    assert breaker.state == HALF_OPEN
+    # 探测名额已经还回来，下一个请求接着探测
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_release_probe():
+    breaker = half_open(make_breaker())
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.release_probe()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+
+
+class FakeAdapter:
+    def __init__(self, name, result=None, error=None):
+        self.name = name
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def get_stock_history(self, *args, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def frame():
+    return pd.DataFrame({'date': pd.to_datetime(['2024-01-02']), 'close': [1.0]})
+
+
+@pytest.fixture
+def manager_factory():
+    managers = []
+
+    def factory(adapters, **kwargs):
+        manager = FallbackManager(adapters, max_retries=1, retry_delay=0)
+        manager.hedge_enabled = False
+        for key, value in kwargs.items():
+            setattr(manager, key, value)
+        managers.append(manager)
+        return manager
+
+    yield factory
+    for manager in managers:
+        if manager._hedge_executor is not None:
+            manager._hedge_executor.shutdown(wait=False)
+
+
+def test_upstream_error_trips_breaker_and_falls_back(manager_factory):
+    primary = FakeAdapter('primary', error=UpstreamError('all endpoints failed'))
+    backup = FakeAdapter('backup', result=frame())
+    manager = manager_factory([primary, backup])
+    breaker = manager._get_breaker('primary', 'get_stock_history')
+    breaker.failure_threshold = 2
+
+    for _ in range(2):
+        assert manager.execute('get_stock_history', '000001') is not None
+    assert breaker.state == OPEN
+
+    # 熔断期间不再调主数据源
+    manager.execute('get_stock_history', '000001')
+    assert primary.calls == 2
+    assert backup.calls == 3
+
+
+def test_empty_results_fall_back_without_tripping(manager_factory):
+    primary = FakeAdapter('primary', result=pd.DataFrame())
+    backup = FakeAdapter('backup', result=frame())
+    manager = manager_factory([primary, backup])
+
+    for _ in range(10):
+        manager.execute('get_stock_history', '000001')
+    breaker = manager._get_breaker('primary', 'get_stock_history')
+    assert breaker.state == CLOSED
+    assert breaker.empty_results == 10
+
+
+class QueueingExecutor:
+    """第一个请求一直排队不执行，之后的请求当场执行，模拟首选源的请求还没轮到线程就输掉了"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        if self.submitted:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        self.submitted.append(future)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def test_cancelled_hedge_loser_releases_half_open_probe(manager_factory):
+    primary = FakeAdapter('primary', result=frame())
+    backup = FakeAdapter('backup', result=frame())
+    manager = manager_factory([primary, backup], hedge_enabled=True, hedge_default_delay=0.01,
+                              hedge_min_delay=0.01, _hedge_executor=QueueingExecutor())
+    breaker = half_open(manager._get_breaker('primary', 'get_stock_history'))
+
+    result = manager._execute_hedged('get_stock_history', ('000001',), {})
+
+    assert result is backup.result
+    assert primary.calls == 0
+    assert manager._hedge_executor.submitted[0].cancelled()
+    assert breaker.state == HALF_OPEN
+    # 输掉的探测被取消了，名额要还回来，不然主数据源永远卡在半开
+    assert breaker.allow_request()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""批量（面板）计算必须和逐只计算结果一致：技术指标、综合评分、技术面评分"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.analysis.indicator_engine import calculate_panel_indicators
+from app.analysis.stock_analyzer import StockAnalyzer
+
+# 覆盖各指标窗口边界附近的长度
+LENGTHS = [1, 2, 5, 13, 14, 15, 19, 20, 21, 26, 30, 35, 59, 60, 61, 120, 250, 400]
+
+
+def make_frames(seed=7, random_count=40):
+    rng = np.random.default_rng(seed)
+    lengths = LENGTHS + [int(n) for n in rng.integers(1, 500, random_count)]
+    frames = {}
+    for i, n in enumerate(lengths):
+        close = np.abs(10 + rng.standard_normal(n).cumsum() * 0.2) + 1
+        df = pd.DataFrame({
+            'date': pd.bdate_range('2023-01-02', periods=n).astype('datetime64[ns]'),
+            'open': close * 1.001,
+            'high': close * (1 + rng.uniform(0, 0.03, n)),
+            'low': close * (1 - rng.uniform(0, 0.03, n)),
+            'close': close,
+            'volume': rng.integers(100000, 1000000, n).astype('f8'),
+            'amount': close * 1e5,
+        })
+        if n > 50 and i % 3 == 0:
+            # 停牌、脏数据留下的缺失值
+            df.loc[20, 'close'] = np.nan
+            df.loc[25, 'volume'] = np.nan
+        frames[f"{i:06d}"] = df
+    return frames
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    return StockAnalyzer()
+
+
+@pytest.fixture(scope='module')
+def frames():
+    return make_frames()
+
+
+@pytest.fixture(scope='module')
+def indicator_frames(analyzer, frames):
+    return {code: analyzer.calculate_indicators(df.copy()) for code, df in frames.items()}
+
+
+def test_panel_indicators_match_per_stock(analyzer, frames, indicator_frames):
+    batch = calculate_panel_indicators(frames, analyzer.params)
+    assert set(batch) == set(frames)
+    for code, expected in indicator_frames.items():
+        pd.testing.assert_frame_equal(batch[code], expected, check_exact=True, obj=code)
+
+
+def test_panel_indicators_accept_multiindex(analyzer, frames):
+    panel = pd.concat(frames, names=['code', 'row'])
+    batch = calculate_panel_indicators(panel, analyzer.params)
+    expected = calculate_panel_indicators(frames, analyzer.params)
+    assert set(batch) == set(expected)
+    for code in expected:
+        pd.testing.assert_frame_equal(batch[code].reset_index(drop=True),
+                                      expected[code].reset_index(drop=True), check_exact=True, obj=code)
+
+
+def test_batch_indicators_do_not_modify_input(analyzer, frames):
+    before = {code: df.copy() for code, df in frames.items()}
+    analyzer.calculate_indicators_batch(frames)
+    for code, df in frames.items():
+        pd.testing.assert_frame_equal(df, before[code])
+
+
+def test_score_batch_matches_per_stock(analyzer, indicator_frames):
+    batch = analyzer.calculate_score_batch(indicator_frames, 'A')
+    assert set(batch.index) == set(indicator_frames)
+    for code, df in indicator_frames.items():
+        expected = analyzer.calculate_score_details(df, 'A')
+        for key, value in expected.items():
+            assert batch.loc[code, key] == pytest.approx(value), (code, key)
+
+
+def test_technical_score_batch_matches_per_stock(analyzer, indicator_frames):
+    batch = analyzer.calculate_technical_score_batch(indicator_frames)
+    assert set(batch.index) == set(indicator_frames)
+    for code, df in indicator_frames.items():
+        expected = analyzer.calculate_technical_score(df)
+        for key, value in expected.items():
+            assert batch.loc[code, key] == pytest.approx(value), (code, key)
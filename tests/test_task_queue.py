@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""持久化任务队列：提交去重、执行与重试、取消、心跳超时回收"""
+import time
+
+import pytest
+
+from app.core.task_queue import (TaskQueue, TaskCancelledException, TASK_COMPLETED, TASK_FAILED,
+                                 TASK_PENDING, TASK_RUNNING)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = TaskQueue(db_path=str(tmp_path / 'tasks.db'), max_workers=1)
+    q.retry_delay = 0
+    return q
+
+
+def run_next(queue):
+    """不起工作线程，手动领一个任务执行"""
+    task = queue._claim()
+    assert task is not None
+    queue._execute(task)
+    return queue.get(task['id'])
+
+
+def test_submit_reuses_active_task_with_same_key(queue):
+    queue.register('demo', lambda ctx: {'ok': True})
+    first, is_new = queue.submit('demo', {'code': '000001'}, key='000001')
+    second, second_new = queue.submit('demo', {'code': '000001'}, key='000001')
+    other, other_new = queue.submit('demo', {'code': '000002'}, key='000002')
+
+    assert is_new and not second_new and other_new
+    assert second['id'] == first['id']
+    assert other['id'] != first['id']
+
+
+def test_completed_task_reused_only_when_allowed(queue):
+    queue.register('demo', lambda ctx: {'value': ctx.params['value']})
+    task, _ = queue.submit('demo', {'value': 1}, key='k')
+    assert run_next(queue)['result'] == {'value': 1}
+
+    reused, is_new = queue.submit('demo', {'value': 2}, key='k')
+    assert not is_new and reused['id'] == task['id']
+
+    fresh, is_new = queue.submit('demo', {'value': 2}, key='k', reuse_completed=False)
+    assert is_new and fresh['id'] != task['id']
+
+
+def test_priority_order(queue):
+    queue.register('demo', lambda ctx: None)
+    low, _ = queue.submit('demo', key='low', priority=0)
+    high, _ = queue.submit('demo', key='high', priority=5)
+    assert queue._claim()['id'] == high['id']
+    assert queue._claim()['id'] == low['id']
+
+
+def test_failed_task_retried_then_marked_failed(queue):
+    calls = []
+
+    def handler(ctx):
+        calls.append(ctx.attempt)
+        raise ValueError('boom')
+
+    queue.register('demo', handler, max_retries=1)
+    task, _ = queue.submit('demo')
+
+    assert run_next(queue)['status'] == TASK_PENDING
+    final = run_next(queue)
+    assert final['status'] == TASK_FAILED
+    assert 'boom' in final['error']
+    assert calls == [1, 2]
+
+
+def test_events_and_progress(queue):
+    def handler(ctx):
+        ctx.emit('hit', {'code': '000001'})
+        ctx.update(progress=50, processed=1)
+        ctx.emit('hit', {'code': '000002'})
+        return {'count': 2}
+
+    queue.register('demo', handler)
+    task, _ = queue.submit('demo')
+    done = run_next(queue)
+
+    assert done['status'] == TASK_COMPLETED and done['progress'] == 100
+    assert done['processed'] == 1
+    events = queue.get_events(task['id'])
+    assert [e['data']['code'] for e in events] == ['000001', '000002']
+    assert queue.get_events(task['id'], after_id=events[0]['id'])[0]['data']['code'] == '000002'
+
+
+def test_cancel_pending_task_is_never_run(queue):
+    queue.register('demo', lambda ctx: pytest.fail('cancelled task should not run'))
+    task, _ = queue.submit('demo')
+
+    assert queue.cancel(task['id'])
+    assert queue.get(task['id'])['status'] == TASK_FAILED
+    assert queue._claim() is None
+    # 已经结束的任务不能再取消
+    assert not queue.cancel(task['id'])
+
+
+def test_cancel_running_task_keeps_cancelled_state(queue):
+    def handler(ctx):
+        queue.cancel(ctx.task_id)
+        ctx._checked_at = 0
+        ctx.check_cancelled()
+        return {'should': 'not be stored'}
+
+    queue.register('demo', handler)
+    task, _ = queue.submit('demo')
+    done = run_next(queue)
+
+    assert done['status'] == TASK_FAILED
+    assert done['cancelled']
+    assert 'result' not in done
+
+
+def test_cancel_check_raises(queue):
+    queue.register('demo', lambda ctx: None)
+    task, _ = queue.submit('demo')
+    claimed = queue._claim()
+    from app.core.task_queue import TaskContext
+    ctx = TaskContext(queue, claimed)
+    assert not ctx.cancelled()
+    queue.cancel(task['id'])
+    ctx._checked_at = 0
+    with pytest.raises(TaskCancelledException):
+        ctx.check_cancelled()
+
+
+def test_stale_task_recovered_by_other_worker(tmp_path):
+    db_path = str(tmp_path / 'tasks.db')
+    dead = TaskQueue(db_path=db_path, max_workers=1)
+    dead.owner = 'dead-host:1'
+    dead.register('demo', lambda ctx: None, max_retries=1)
+    task, _ = dead.submit('demo')
+    claimed = dead._claim()
+    assert claimed['status'] == TASK_RUNNING
+
+    alive = TaskQueue(db_path=db_path, max_workers=1)
+    alive.register('demo', lambda ctx: {'done': True}, max_retries=1)
+    alive.stale_seconds = 0.05
+    time.sleep(0.1)
+
+    assert alive.heartbeat() == 1
+    assert alive.get(task['id'])['status'] == TASK_PENDING
+    assert run_next(alive)['status'] == TASK_COMPLETED
+
+    # 原来的 worker 回来了也不能覆盖别人接手后的结果
+    dead._finish(claimed, TASK_FAILED, error='late')
+    assert alive.get(task['id'])['status'] == TASK_COMPLETED
+
+
+def test_stale_task_without_retries_left_fails(tmp_path):
+    db_path = str(tmp_path / 'tasks.db')
+    dead = TaskQueue(db_path=db_path, max_workers=1)
+    dead.owner = 'dead-host:1'
+    dead.register('demo', lambda ctx: None, max_retries=0)
+    task, _ = dead.submit('demo')
+    dead._claim()
+
+    alive = TaskQueue(db_path=db_path, max_workers=1)
+    alive.stale_seconds = 0.05
+    time.sleep(0.1)
+
+    assert alive.heartbeat() == 1
+    assert alive.get(task['id'])['status'] == TASK_FAILED
+
+
+def test_concurrency_limit_per_type(queue):
+    queue.register('demo', lambda ctx: None, concurrency=1)
+    queue.submit('demo', key='a')
+    queue.submit('demo', key='b')
+    first = queue._claim()
+    assert first is not None
+    assert queue._claim() is None
+    queue._execute(first)
+    assert queue._claim() is not None